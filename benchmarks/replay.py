@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+# Runs the collector's Postgres path (DB.run_query -> fetch_postgres_information -> encode -> compress)
+# against a local replay of a recording made with --record-wire, so it can be benchmarked and
+# regression-tested on a machine without a database.
+#
+# Record with the same options that are passed to the collector here, otherwise it sends queries
+# that aren't in the recording. --scale repeats every relation in the recording N times.
+#
+#   python pganalyze-collector.py --record-wire recording.json --dry-run
+#   python benchmarks/replay.py recording.json --scale 1000 [-- collector options]
+#
+# With --serve the replay keeps running on --port, to point a collector (or psql) at it.
+
+import os
+import sys
+import imp
+import json
+import time
+import zlib
+import logging
+import calendar
+from optparse import OptionParser
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(1, ROOT)
+sys.path.insert(1, os.path.join(ROOT, 'vendor'))
+from pgacollector.WireRecording import Recording, ReplayServer
+from pgacollector.DB import DB
+
+
+def load_collector(args):
+    path = os.path.join(ROOT, 'pganalyze-collector.py')
+    collector = imp.load_source('pganalyze_collector', path)
+    sys.argv = [path] + args
+    collector.option = collector.parse_options()
+    collector.logger = logging.getLogger('pganalyze-collector')
+    return collector
+
+
+def run(collector, port):
+    timings = []
+    start = time.time()
+
+    def lap(name, size=None):
+        now = time.time()
+        timings.append((name, now - lap.last, size))
+        lap.last = now
+    lap.last = start
+
+    db = DB('postgres', collector.MYNAME, username='replay', host='127.0.0.1', port=port, exit_on_error=False)
+    lap('connect')
+
+    collected_at = calendar.timegm(time.gmtime())
+    data = {}
+    if collector.option['collect_postgres_queries']:
+        data['queries'] = collector.fetch_query_information(db, collected_at=collected_at)[1]
+        lap('queries', len(data['queries']))
+
+    data['postgres'] = collector.fetch_postgres_information(db, collected_at=collected_at)
+    lap('postgres', len(data['postgres']['schema']))
+    db.close()
+
+    encoded = json.dumps(data, cls=collector.DatetimeEncoder)
+    lap('encode', len(encoded))
+    compressed = zlib.compress(encoded)
+    lap('compress', len(compressed))
+
+    timings.append(('total', time.time() - start, None))
+    return timings
+
+
+def main():
+    parser = OptionParser(usage="%prog RECORDING [options] [-- collector options]")
+    parser.add_option('--scale', type='int', default=1, help='Repeat every relation this many times. Default: %default')
+    parser.add_option('--runs', type='int', default=3, help='Report the fastest of this many runs. Default: %default')
+    parser.add_option('--serve', action='store_true', help='Only run the replay server, until interrupted')
+    parser.add_option('--port', type='int', default=0, help='Port for --serve. Default: any free port')
+    options, args = parser.parse_args()
+    if not args:
+        parser.error("RECORDING is required")
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+
+    server = ReplayServer(Recording.load(args[0]), options.scale, port=options.port)
+    server.start()
+
+    if options.serve:
+        print("Replaying %s on 127.0.0.1:%d, interrupt to stop" % (args[0], server.port))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
+        return
+
+    collector = load_collector(args[1:])
+
+    best = None
+    for i in range(options.runs):
+        timings = run(collector, server.port)
+        if best is None:
+            best = timings
+        else:
+            best = [(name, min(seconds, best_seconds), size)
+                    for (name, seconds, size), (_, best_seconds, _) in zip(timings, best)]
+    server.stop()
+
+    print("%-10s %10s %14s" % ('step', 'seconds', 'rows/bytes'))
+    for name, seconds, size in best:
+        print("%-10s %10.3f %14s" % (name, seconds, '' if size is None else size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# Compares decoding DataRow messages with pg8000's own handle_DATA_ROW (oid columns in text
+# format, numerics through Decimal) against pgacollector.RowDecoder, for a relations()-like
+# result with a mix of oid, name, int8, float8, numeric, bool and timestamp columns and some NULLs.
+#
+#   python benchmarks/row_decoding.py [rows]
+
+import os
+import sys
+import time
+import struct
+from decimal import Decimal
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'vendor'))
+from pg8000 import core
+from pgacollector import RowDecoder
+from pgacollector.WireRecording import join_data_row
+
+# name, type oid
+COLUMNS = [('oid', 26), ('schema_name', 19), ('table_name', 19), ('size_bytes', 20), ('relation_type', 18)] + \
+    [('stat_%d' % i, 20) for i in range(16)] + \
+    [('last_vacuum', 1184), ('last_analyze', 1184), ('reltuples', 701), ('avg_width', 1700), ('has_oids', 16)]
+
+
+class Cursor(object):
+    def __init__(self, ps):
+        self.ps = ps
+        self._cached_rows = []
+
+
+def encode(type_oid, fc, i):
+    if i % 7 == 0 and type_oid in (1184, 20) and i % 2:
+        return None
+    if type_oid == 26:
+        return struct.pack('!I', 16384 + i) if fc == core.FC_BINARY else str(16384 + i)
+    if type_oid == 19:
+        return 'table_%d' % i
+    if type_oid == 18:
+        return 'r'
+    if type_oid == 20:
+        return struct.pack('!q', i * 31)
+    if type_oid == 1184:
+        return struct.pack('!q', i * 1000000)
+    if type_oid == 701:
+        return struct.pack('!d', i * 1.5)
+    if type_oid == 1700:
+        return '%d.25' % i
+    if type_oid == 16:
+        return '\x01' if i % 2 else '\x00'
+
+
+def prepare(pg_types, rows):
+    row_desc = [{'name': name, 'type_oid': type_oid, 'pg8000_fc': pg_types[type_oid][0],
+                 'func': pg_types[type_oid][1]} for name, type_oid in COLUMNS]
+    ps = {'row_desc': row_desc, 'input_funcs': tuple(f['func'] for f in row_desc)}
+    messages = [join_data_row([encode(f['type_oid'], f['pg8000_fc'], i) for f in row_desc]) for i in range(rows)]
+    return ps, messages
+
+
+class FakeConnection(object):
+    def __init__(self):
+        # The types used by COLUMNS as pg8000 sets them up, numerics the way DB converted them to float
+        self.pg_types = {
+            16: (core.FC_BINARY, lambda d, o, l: d[o] == '\x01'),
+            18: (core.FC_TEXT, lambda d, o, l: unicode(d[o:o + l], 'utf-8')),
+            19: (core.FC_BINARY, lambda d, o, l: unicode(d[o:o + l], 'utf-8')),
+            20: (core.FC_BINARY, core.int8_recv),
+            26: (core.FC_TEXT, core.int_in),
+            701: (core.FC_BINARY, core.float8_recv),
+            1184: (core.FC_BINARY, core.timestamptz_recv_integer),
+            1700: (core.FC_TEXT, lambda d, o, l: float(Decimal(d[o:o + l].decode('ascii')))),
+        }
+        self.message_types = {core.DATA_ROW: None}
+
+
+def run(handle, ps, messages):
+    cursor = Cursor(ps)
+    start = time.time()
+    for data in messages:
+        handle(data, cursor)
+    return time.time() - start, cursor._cached_rows
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    conn = FakeConnection()
+    ps, messages = prepare(conn.pg_types, rows)
+    stock = core.Connection.handle_DATA_ROW.im_func
+    generic_seconds, generic_rows = min((run(lambda data, cursor: stock(None, data, cursor), ps, messages)
+                                         for i in range(3)), key=lambda r: r[0])
+
+    RowDecoder.install(conn, core.DATA_ROW)
+    ps, messages = prepare(conn.pg_types, rows)
+    fast_seconds, fast_rows = min((run(conn.message_types[core.DATA_ROW], dict(ps), messages)
+                                   for i in range(3)), key=lambda r: r[0])
+
+    assert generic_rows == fast_rows, "decoders disagree"
+
+    print("%-10s %10s %12s" % ('decoder', 'seconds', 'rows/second'))
+    for name, seconds in (('pg8000', generic_seconds), ('fast', fast_seconds)):
+        print("%-10s %10.3f %12d" % (name, seconds, rows / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#
+# Compares the collector's side of the two --schema-engine options on a synthetic catalog: client
+# (five catalog queries turned into rows, merged by assemble_schema) against server (one JSON document
+# per relation built by Postgres, passed through). Both go through fetch_postgres_information and are
+# JSON-encoded, as the upload would.
+#
+# SyntheticDB answers without a database, so neither driver decoding nor the time Postgres spends on
+# the queries is included. Driver decoding only adds to the client engine, which gets ~25 columns per
+# relation plus one row per column, index and constraint, instead of one bytea per relation. To measure
+# the database side, record both engines against a real catalog with --record-wire and run them through
+# benchmarks/replay.py.
+#
+#   python benchmarks/schema_engine.py [tables]
+
+import os
+import sys
+import json
+import time
+import calendar
+
+sys.path.insert(1, os.path.dirname(__file__))
+from replay import load_collector
+from synthetic import SyntheticDB
+
+
+def run(engine, tables):
+    collector = load_collector(['--schema-engine', engine])
+    db = SyntheticDB(tables=tables)
+    if engine == 'server':
+        # Stands in for the documents arriving from Postgres
+        db.schema_documents()
+    collected_at = calendar.timegm(time.gmtime())
+
+    start = time.time()
+    info = collector.fetch_postgres_information(db, collected_at=collected_at)
+    fetched = time.time()
+    encoded = json.dumps({'postgres': info}, cls=collector.DatetimeEncoder)
+    encoded_at = time.time()
+
+    return fetched - start, encoded_at - fetched, len(encoded)
+
+
+def main():
+    tables = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    print("%-8s %10s %10s %10s %12s" % ('engine', 'fetch', 'encode', 'total', 'bytes'))
+    for engine in ('client', 'server'):
+        fetch, encode, size = min((run(engine, tables) for i in range(3)), key=lambda r: r[0] + r[1])
+        print("%-8s %10.3f %10.3f %10.3f %12d" % (engine, fetch, encode, fetch + encode, size))
+
+
+if __name__ == '__main__':
+    main()
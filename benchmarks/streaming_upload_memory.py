@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+# Compares peak memory of building the upload body in one piece (json.dumps + zlib.compress +
+# urlencode, like post_data_to_web) against the streaming writer in pgacollector.Upload.
+#
+# Every mode runs in its own process, since ru_maxrss only ever grows. The number reported is
+# the peak RSS on top of what the snapshot itself takes up.
+#
+#   python benchmarks/streaming_upload_memory.py [relations]
+
+import os
+import sys
+import json
+import zlib
+import urllib
+import resource
+import subprocess
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector import Upload
+from synthetic import synthetic_snapshot
+
+
+def default(obj):
+    return str(obj)
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_mode(mode, relations):
+    data = synthetic_snapshot(relations)
+    baseline = peak_rss_kb()
+
+    if mode == 'buffered':
+        body = urllib.urlencode({'api_key': 'x', 'data': zlib.compress(json.dumps(data, default=default))})
+        size = len(body)
+    else:
+        size = 0
+        for chunk in Upload.form_encoded({'api_key': 'x'}, Upload.compressed(
+                Upload.buffered(Upload.iterencode(data, default)))):
+            size += len(chunk)
+
+    print("%d %d" % (peak_rss_kb() - baseline, size))
+
+
+def main():
+    if len(sys.argv) > 2:
+        run_mode(sys.argv[2], int(sys.argv[1]))
+        return
+
+    relations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print("%-10s %12s %14s" % ('mode', 'peak KB', 'body bytes'))
+    for mode in ('buffered', 'streaming'):
+        output = subprocess.check_output([sys.executable, __file__, str(relations), mode])
+        peak, size = output.split()
+        print("%-10s %12s %14s" % (mode, peak, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#
+# End-to-end benchmark of the collector against synthetic catalogs: every stage (collecting the
+# Postgres information, collecting pg_stat_statements, JSON encoding, compression) runs against
+# SyntheticDB, which answers the collector's queries without a database, and reports its time
+# and peak memory.
+#
+# Every (size, stage) pair runs in its own process, since ru_maxrss only ever grows. The inputs of
+# a stage are built before its baseline is taken, so the memory reported is only the stage's own.
+# Compression gets the encoded JSON from a file, written by a separate encode run, as encoding it
+# in the same process would leave a higher peak behind than compressing it.
+#
+# Results are compared against benchmarks/baselines.json and the run fails when a stage got slower
+# or bigger by more than --threshold. Baselines are machine-specific, record them again with
+# --update-baselines after changing machines or after an intentional change.
+#
+#   python benchmarks/suite.py [--sizes 1k,10k,100k] [--threshold 0.5] [--update-baselines]
+
+import os
+import sys
+import json
+import time
+import zlib
+import logging
+import calendar
+import resource
+import tempfile
+import subprocess
+from optparse import OptionParser, SUPPRESS_HELP
+
+sys.path.insert(1, os.path.dirname(__file__))
+from replay import load_collector
+from synthetic import SyntheticDB
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+SIZES = {
+    '1k': {'tables': 1000, 'statements': 5000, 'backends': 5000},
+    '10k': {'tables': 10000, 'statements': 20000, 'backends': 5000},
+    '100k': {'tables': 100000, 'statements': 50000, 'backends': 5000},
+}
+STAGES = ['postgres', 'queries', 'encode', 'compress']
+
+# Differences below these are noise, regardless of the threshold
+MIN_SECONDS = 0.05
+MIN_PEAK_KB = 1024
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_stage(size, stage, data_path=None):
+    collector = load_collector([])
+    db = SyntheticDB(**SIZES[size])
+    collected_at = calendar.timegm(time.gmtime())
+
+    def postgres():
+        return collector.fetch_postgres_information(db, collected_at=collected_at)
+
+    def queries():
+        return collector.fetch_query_information(db, collected_at=collected_at)[1]
+
+    if stage == 'postgres':
+        fn = postgres
+    elif stage == 'queries':
+        fn = queries
+    elif stage == 'compress':
+        with open(data_path, 'rb') as f:
+            encoded = f.read()
+        fn = lambda: zlib.compress(encoded)
+    else:
+        data = {'postgres': postgres(), 'queries': queries()}
+        fn = lambda: json.dumps(data, cls=collector.DatetimeEncoder)
+
+    baseline = peak_rss_kb()
+    start = time.time()
+    result = fn()
+    seconds = time.time() - start
+    size = len(result['schema']) if stage == 'postgres' else len(result)
+
+    if stage == 'encode' and data_path:
+        with open(data_path, 'wb') as f:
+            f.write(result)
+
+    print(json.dumps({'seconds': seconds, 'peak_kb': peak_rss_kb() - baseline, 'size': size}))
+
+
+def measure(size, stage, runs):
+    """ Runs a stage in a fresh process runs times, keeping the fastest time and the smallest peak """
+    command = [sys.executable, __file__, '--stage', '%s:%s' % (size, stage)]
+    data_path = None
+    if stage == 'compress':
+        fd, data_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        subprocess.check_output([sys.executable, __file__, '--stage', '%s:encode' % size, '--data', data_path])
+        command += ['--data', data_path]
+
+    try:
+        best = None
+        for i in range(runs):
+            result = json.loads(subprocess.check_output(command).splitlines()[-1])
+            if best is None:
+                best = result
+            else:
+                best['seconds'] = min(best['seconds'], result['seconds'])
+                best['peak_kb'] = min(best['peak_kb'], result['peak_kb'])
+        return best
+    finally:
+        if data_path:
+            os.remove(data_path)
+
+
+def regressions(result, baseline, threshold):
+    failures = []
+    if result['seconds'] > baseline['seconds'] * (1 + threshold) and \
+            result['seconds'] - baseline['seconds'] > MIN_SECONDS:
+        failures.append('seconds')
+    if result['peak_kb'] > baseline['peak_kb'] * (1 + threshold) and \
+            result['peak_kb'] - baseline['peak_kb'] > MIN_PEAK_KB:
+        failures.append('peak KB')
+    return failures
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--sizes', default='1k,10k',
+                      help='Comma-separated catalog sizes to run, out of %s. Default: %%default' %
+                      ', '.join(sorted(SIZES, key=lambda s: SIZES[s]['tables'])))
+    parser.add_option('--runs', type='int', default=3, help='Report the best of this many runs. Default: %default')
+    parser.add_option('--threshold', type='float', default=0.5,
+                      help='Fail when a stage is slower or bigger than its baseline by this fraction. Default: %default')
+    parser.add_option('--update-baselines', action='store_true', help='Store the results as the new baselines')
+    parser.add_option('--stage', help=SUPPRESS_HELP)
+    parser.add_option('--data', help=SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+
+    if options.stage:
+        run_stage(*options.stage.split(':'), data_path=options.data)
+        return
+
+    sizes = options.sizes.split(',')
+    for size in sizes:
+        if size not in SIZES:
+            parser.error("Unknown size %s" % size)
+
+    baselines = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as f:
+            baselines = json.load(f)
+
+    failed = False
+    print("%-5s %-9s %9s %9s %11s %11s  %s" % ('size', 'stage', 'seconds', 'baseline', 'peak KB', 'baseline', ''))
+    for size in sizes:
+        for stage in STAGES:
+            key = '%s:%s' % (size, stage)
+            result = measure(size, stage, options.runs)
+            baseline = baselines.get(key)
+
+            status = ''
+            if options.update_baselines:
+                baselines[key] = {'seconds': round(result['seconds'], 3), 'peak_kb': result['peak_kb']}
+            elif baseline:
+                failures = regressions(result, baseline, options.threshold)
+                if failures:
+                    failed = True
+                    status = 'REGRESSION (%s)' % ', '.join(failures)
+            else:
+                status = 'no baseline'
+
+            print("%-5s %-9s %9.3f %9s %11d %11s  %s" % (
+                size, stage, result['seconds'], '%.3f' % baseline['seconds'] if baseline else '-',
+                result['peak_kb'], baseline['peak_kb'] if baseline else '-', status))
+
+    if options.update_baselines:
+        with open(BASELINES, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print("Stored baselines in %s" % BASELINES)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
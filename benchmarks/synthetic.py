@@ -0,0 +1,172 @@
+# Synthetic collector data for the benchmarks in this directory
+
+import json
+import datetime
+import collections
+
+
+def synthetic_snapshot(relations):
+    schema = []
+    for i in range(relations):
+        schema.append({
+            'schema_name': 'public',
+            'table_name': 'table_%d' % i,
+            'relation_type': 'r',
+            'stats': {'size_bytes': i * 8192, 'seq_scan': i, 'n_live_tup': i * 10,
+                      'last_autovacuum': datetime.datetime(2015, 4, 8, 12, 0, 0)},
+            'columns': [{'name': 'column_%d' % j, 'data_type': 'integer', 'default_value': None,
+                         'not_null': True, 'position': j} for j in range(20)],
+            'indices': [{'name': 'table_%d_pkey' % i, 'columns': [1], 'size_bytes': 16384,
+                         'index_def': 'CREATE UNIQUE INDEX table_%d_pkey ON table_%d USING btree (column_1)' % (i, i)}],
+            'constraints': [],
+        })
+    return {'postgres': {'schema': schema}}
+
+
+TIMESTAMP = datetime.datetime(2015, 4, 8, 12, 0, 0)
+
+TABLE_STATS = ['seq_scan', 'seq_tup_read', 'idx_scan', 'idx_tup_fetch', 'n_tup_ins', 'n_tup_upd', 'n_tup_del',
+               'n_tup_hot_upd', 'n_live_tup', 'n_dead_tup', 'n_mod_since_analyze', 'vacuum_count',
+               'autovacuum_count', 'analyze_count', 'autoanalyze_count']
+TABLE_TIMES = ['last_vacuum', 'last_autovacuum', 'last_analyze', 'last_autoanalyze']
+TABLE_IO = ['heap_blks_read', 'heap_blks_hit', 'idx_blks_read', 'idx_blks_hit', 'toast_blks_read',
+            'toast_blks_hit', 'tidx_blks_read', 'tidx_blks_hit']
+STATEMENT_COUNTERS = ['calls', 'total_time', 'rows', 'shared_blks_hit', 'shared_blks_read', 'shared_blks_dirtied',
+                      'shared_blks_written', 'local_blks_hit', 'local_blks_read', 'local_blks_dirtied',
+                      'local_blks_written', 'temp_blks_read', 'temp_blks_written', 'blk_read_time', 'blk_write_time']
+
+
+class SyntheticDB():
+    """
+    Stand-in for pgacollector.DB that answers the collector's queries with synthetic results
+
+    Results are generated once up front as value tuples, every query turns them into fresh Row
+    objects like DB does with driver results, so the grooming code can modify them as usual.
+    """
+
+    querymarker = '/* pganalyze-collector */'
+    version_numeric = 90500
+    profiler = None
+    wire_recorder = None
+    bulk_copy = False
+
+    def __init__(self, tables=1000, columns=20, statements=5000, backends=5000):
+        from pgacollector.DB import ResultColumns
+
+        self.results = []
+        self.queries = 0
+        self.documents = None
+
+        def add(pattern, names, rows):
+            self.results.append((pattern, ResultColumns(names), rows))
+
+        stats = ['relid', 'schemaname', 'relname'] + TABLE_STATS + TABLE_TIMES + TABLE_IO
+        add('attrelid IN', ['view', 'name', 'is_timestamp'],
+            [('s', name, name in TABLE_TIMES) for name in stats] +
+            [('sio', name, False) for name in ['relid', 'schemaname', 'relname'] + TABLE_IO])
+        add('sio.*', ['oid', 'schema_name', 'table_name', 'size_bytes', 'relation_type'] + stats,
+            [(i, 'public', 'table_%d' % i, i * 8192, 'r', i, 'public', 'table_%d' % i) +
+             tuple(i * j for j in range(len(TABLE_STATS))) + (TIMESTAMP,) * len(TABLE_TIMES) +
+             tuple(i + j for j in range(len(TABLE_IO))) for i in range(tables)])
+        add('pg_table_size', ['oid', 'size_bytes'], [(i, i * 8192) for i in range(tables)])
+
+        add('format_type', ['oid', 'name', 'data_type', 'default_value', 'not_null', 'position'],
+            [(i, 'column_%d' % j, 'integer' if j % 2 else 'text', "nextval('table_%d_id_seq'::regclass)" % i if j == 1
+              else None, j < 3, j) for i in range(tables) for j in range(1, columns + 1)])
+
+        index_columns = ['oid', 'index_oid', 'name', 'size_bytes', 'idx_scan', 'idx_tup_read', 'idx_tup_fetch',
+                         'idx_blks_read', 'idx_blks_hit']
+        indexes = [(i, tables + i * 2 + k, 'table_%d_%s' % (i, 'pkey' if k == 0 else 'column_2_idx'), 16384,
+                    i, i * 2, i * 3, i, i * 10) for i in range(tables) for k in range(2)]
+        add('pg_get_indexdef', index_columns[:3] + ['columns', 'is_primary', 'is_unique', 'is_valid', 'index_def',
+                                                    'constraint_def'] + index_columns[3:],
+            [row[:3] + ('1' if row[2].endswith('pkey') else '2', row[2].endswith('pkey'), row[2].endswith('pkey'),
+                        True, 'CREATE UNIQUE INDEX %s ON table_%d USING btree (column_1)' % (row[2], row[0]),
+                        'PRIMARY KEY (column_1)' if row[2].endswith('pkey') else None) + row[3:]
+             for row in indexes])
+        add('idx_scan', index_columns, indexes)
+
+        add("contype = 'f'", ['oid', 'name', 'constraint_def', 'columns', 'foreign_schema', 'foreign_table',
+                              'foreign_columns'],
+            [(i, 'table_%d_fkey' % i, 'FOREIGN KEY (column_2) REFERENCES table_%d(column_1)' % (i - 1), [2],
+              'public', 'table_%d' % (i - 1), [1]) for i in range(1, tables, 4)])
+
+        add('table_estimates', ['oid', 'table_bytes', 'expected_bytes', 'wasted_bytes'],
+            [(i, i * 8192, i * 4096, i * 4096) for i in range(tables)])
+        add('otta_calc', ['index_oid', 'wasted_bytes'], [(row[1], 8192) for row in indexes])
+
+        add('pp.proname', ['schema_name', 'function_name', 'language', 'source', 'source_bin', 'config', 'arguments',
+                           'result', 'aggregate', 'window', 'security_definer', 'leakproof', 'strict',
+                           'returns_set', 'volatile', 'calls', 'total_time', 'self_time'],
+            [('public', 'function_%d' % i, 'plpgsql', 'BEGIN RETURN %d; END' % i, None, None, '', 'integer',
+              False, False, False, False, False, False, 'v', i, i * 1.5, i * 0.5) for i in range(100)])
+
+        add('pg_settings', ['name', 'setting', 'unit', 'boot_val', 'reset_val', 'source', 'sourcefile', 'sourceline'],
+            [('setting_%d' % i, str(i), None, str(i), str(i), 'default', None, None) for i in range(250)])
+
+        add('pg_locks', ['schema', 'relation', 'locktype', 'page', 'tuple', 'virtualxid', 'transactionid',
+                         'virtualtransaction', 'pid', 'mode', 'granted'],
+            [('public', 'table_%d' % (i % max(tables, 1)), 'relation', None, None, None, None, '%d/1' % i,
+              1000 + i, 'AccessShareLock', True) for i in range(backends)])
+
+        add('application_name', ['pid', 'usename', 'application_name', 'client_addr', 'backend_start', 'xact_start',
+                                 'query_start', 'state_change', 'waiting', 'state'],
+            [(1000 + i, 'app', 'web', '10.0.0.%d' % (i % 250), TIMESTAMP, TIMESTAMP, TIMESTAMP, TIMESTAMP,
+              False, 'idle' if i % 3 else 'active') for i in range(backends)])
+
+        add('pg_extension', ['extname'], [('pg_stat_statements',)])
+        add('SELECT version()', ['version'], [('PostgreSQL 9.5.3 on x86_64-pc-linux-gnu',)])
+        add('pg_stat_bgwriter', ['checkpoints_timed', 'checkpoints_req', 'buffers_clean', 'stats_reset'],
+            [(10, 1, 100, TIMESTAMP)])
+        add('pg_stat_database_conflicts', ['confl_tablespace', 'confl_lock', 'confl_snapshot', 'confl_bufferpin',
+                                           'confl_deadlock'], [(0, 0, 0, 0, 0)])
+        add('pg_stat_database', ['datid', 'datname', 'numbackends', 'xact_commit', 'xact_rollback'],
+            [(1, 'postgres', backends, 1000, 10)])
+        add('pg_postmaster_start_time', ['postmaster_start_time', 'conf_load_time'], [(TIMESTAMP, TIMESTAMP)])
+
+        add('FROM pg_stat_statements', ['userid', 'dbid', 'queryid', 'query'] + STATEMENT_COUNTERS,
+            [(10, 1, i, 'SELECT * FROM table_%d WHERE column_1 = ? AND column_2 IN (?, ?, ?)' % (i % max(tables, 1)))
+             + tuple(i * (j + 1) for j in range(len(STATEMENT_COUNTERS))) for i in range(statements)])
+
+    def schema_documents(self):
+        """ Rows of PostgresInformation.schema_documents(), the records assembled from the other results """
+        from pgacollector.SchemaAssembly import assemble_schema
+
+        if self.documents is None:
+            relations = self.run_query('sio.*')
+            indexes = self.run_query('pg_get_indexdef')
+            for row in indexes:
+                row['columns'] = map(int, row['columns'].split())
+            table_bloat = dict((row['oid'], row['wasted_bytes']) for row in self.run_query('table_estimates'))
+            index_bloat = dict((row['index_oid'], row['wasted_bytes']) for row in self.run_query('otta_calc'))
+            oids = [row['oid'] for row in relations]
+            records = assemble_schema(relations, self.run_query('format_type'), indexes,
+                                      self.run_query("contype = 'f'"), None, None, table_bloat, index_bloat)
+            default = lambda o: dict(o.iteritems()) if isinstance(o, collections.Mapping) else str(o)
+            self.documents = [(oid, json.dumps(record, default=default)) for oid, record in zip(oids, records)]
+        return self.documents
+
+    def run_query(self, query, should_raise=False, commit=False, cached=False, params=None):
+        from pgacollector.DB import Row, ResultColumns
+
+        self.queries += 1
+        # Checked first, as the query contains the patterns of the queries it replaces
+        if 'json_build_object' in query:
+            columns = ResultColumns(['oid', 'document'])
+            return [Row(columns, list(row)) for row in self.schema_documents()]
+        for pattern, columns, rows in self.results:
+            if pattern in query:
+                return [Row(columns, list(row)) for row in rows]
+        return []
+
+    def iter_query(self, query, batch_size=1000, params=None):
+        return iter(self.run_query(query, params=params))
+
+    def bulk_query(self, query, stream=False, params=None):
+        return self.iter_query(query, params=params) if stream else self.run_query(query, params=params)
+
+    def rollback(self):
+        pass
+
+    def invalidate_cache(self):
+        pass
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Compares the form-encoded upload protocol (compressed data percent-encoded as a form field)
+# with the binary protocol (compressed JSON as the request body, metadata in headers).
+#
+# Reports body size, time to build the body and time to POST it to a local HTTP server.
+#
+#   python benchmarks/upload_encoding.py [relations]
+
+import os
+import sys
+import json
+import time
+import zlib
+import urllib
+import urllib2
+import threading
+import BaseHTTPServer
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector import Upload
+from synthetic import synthetic_snapshot
+
+METADATA = {'api_key': 'x' * 32, 'collected_at': 1428494400, 'collected_from': 'db.example.com',
+            'submitter': 'pganalyze-collector', 'system_information': True,
+            'query_source': 'pg_stat_statements', 'no_reset': True}
+
+
+class SinkHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write('OK')
+
+    def log_message(self, *args):
+        pass
+
+
+def build_form(compressed):
+    return urllib.urlencode(dict(METADATA, data=compressed, data_compressor='zlib')), {}
+
+
+def build_binary(compressed):
+    return compressed, Upload.binary_headers(METADATA, True)
+
+
+def main():
+    relations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    compressed = zlib.compress(json.dumps(synthetic_snapshot(relations), default=str))
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), SinkHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%d/' % server.server_port
+
+    print("compressed snapshot: %d bytes" % len(compressed))
+    print("%-8s %12s %10s %10s %12s" % ('protocol', 'body bytes', 'overhead', 'build ms', 'post MB/s'))
+
+    for name, build in (('form', build_form), ('binary', build_binary)):
+        start = time.time()
+        body, headers = build(compressed)
+        build_ms = (time.time() - start) * 1000
+
+        start = time.time()
+        urllib2.urlopen(urllib2.Request(url, data=body, headers=headers)).read()
+        post_s = time.time() - start
+
+        print("%-8s %12d %9.2fx %10.1f %12.1f" % (name, len(body), float(len(body)) / len(compressed), build_ms,
+                                                 len(compressed) / post_s / 1024 / 1024))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
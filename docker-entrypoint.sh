@@ -2,7 +2,7 @@
 
 set -e
 
-if [ "$1" != 'cron' ] && [ "$1" != 'debug' ]; then
+if [ "$1" != 'cron' ] && [ "$1" != 'debug' ] && [ "$1" != 'daemon' ]; then
   exec "$@"
 fi
 
@@ -52,6 +52,10 @@ if [ "$1" = 'debug' ]; then
   exit 0
 fi
 
+if [ "$1" = 'daemon' ]; then
+  exec gosu pganalyze python $HOME_DIR/pganalyze-collector.py --daemon $OPTS
+fi
+
 echo "Doing initial collector test run..."
 
 gosu pganalyze python $HOME_DIR/pganalyze-collector.py $OPTS
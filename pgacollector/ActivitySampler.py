@@ -0,0 +1,161 @@
+import logging
+import collections
+import threading
+import time
+
+from .PostgresInformation import PostgresInformation
+
+logger = logging.getLogger(__name__)
+
+# Longest running transactions kept per bucket
+LONGEST_TRANSACTIONS = 5
+
+
+def sample_query(version_numeric, stat_activity_helper=False):
+    """ Backends grouped by state and wait event, with the oldest transaction of each group """
+    if version_numeric >= 90600:
+        wait_event = "wait_event_type, wait_event"
+    else:
+        wait_event = "CASE WHEN waiting THEN 'Lock' END AS wait_event_type, NULL::text AS wait_event"
+    query_id = "(array_agg(query_id ORDER BY xact_start))[1]" if version_numeric >= 140000 else "NULL::bigint"
+
+    return """
+    SELECT coalesce(state, 'unknown') AS state, %s,
+           count(*) AS backends,
+           extract(epoch FROM now() - min(xact_start))::float AS longest_xact_seconds,
+           (array_agg(pid ORDER BY xact_start))[1] AS longest_xact_pid,
+           %s AS longest_xact_query_id
+      FROM %s
+     WHERE pid <> pg_backend_pid()
+     GROUP BY 1, 2, 3
+    """ % (wait_event, query_id,
+           'pganalyze.get_stat_activity()' if stat_activity_helper else 'pg_catalog.pg_stat_activity')
+
+
+class ActivityBucket():
+    """ Sums of the samples taken within bucket_seconds """
+
+    def __init__(self, start, seconds):
+        self.start = start
+        self.seconds = seconds
+        self.samples = 0
+        self.states = collections.defaultdict(int)
+        self.wait_events = collections.defaultdict(int)
+        self.transactions = {}
+
+    def add(self, rows):
+        self.samples += 1
+        for row in rows:
+            self.states[row['state']] += row['backends']
+            if row['wait_event_type']:
+                self.wait_events['%s:%s' % (row['wait_event_type'], row['wait_event'] or '')] += row['backends']
+
+            pid, seconds = row['longest_xact_pid'], row['longest_xact_seconds']
+            if seconds is None:
+                continue
+            previous = self.transactions.get(pid)
+            if previous is None or seconds > previous['seconds']:
+                self.transactions[pid] = {'pid': pid, 'seconds': seconds, 'state': row['state'],
+                                          'query_id': row['longest_xact_query_id']}
+
+        if len(self.transactions) > LONGEST_TRANSACTIONS:
+            self.transactions = dict((t['pid'], t) for t in self.longest_transactions())
+
+    def longest_transactions(self):
+        return sorted(self.transactions.values(), key=lambda t: -t['seconds'])[:LONGEST_TRANSACTIONS]
+
+    def as_dict(self):
+        return {
+            'start': self.start,
+            'seconds': self.seconds,
+            'samples': self.samples,
+            'states': dict(self.states),
+            'wait_events': dict(self.wait_events),
+            'longest_transactions': self.longest_transactions(),
+        }
+
+
+class ActivitySampler():
+    """
+    Samples pg_stat_activity every interval seconds in a background thread
+
+    Samples are summed up into buckets of bucket_seconds, of which the last buffer_size are
+    kept in a ring buffer. snapshot() returns all finished buckets, they are kept until commit()
+    so that they are sent again if the snapshot doesn't make it to the server.
+    """
+
+    def __init__(self, db, interval=1.0, bucket_seconds=10, buffer_size=120):
+        self.db = db
+        self.interval = interval
+        self.bucket_seconds = bucket_seconds
+        self.buckets = collections.deque(maxlen=buffer_size)
+        self.current = None
+        self.pending = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add_sample(self, rows, now):
+        start = int(now) // self.bucket_seconds * self.bucket_seconds
+        with self.lock:
+            if self.current is not None and self.current.start != start:
+                self.buckets.append(self.current.as_dict())
+                self.current = None
+            if self.current is None:
+                self.current = ActivityBucket(start, self.bucket_seconds)
+            self.current.add(rows)
+
+    def snapshot(self, now=None):
+        """ Returns the buckets that are over, oldest first """
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.current is not None and self.current.start + self.bucket_seconds <= now:
+                self.buckets.append(self.current.as_dict())
+                self.current = None
+            buckets = list(self.buckets)
+        self.pending = buckets[-1]['start'] if buckets else None
+        return buckets
+
+    def commit(self):
+        # Only called once the server has received the buckets of the last snapshot
+        if self.pending is None:
+            return
+        with self.lock:
+            while self.buckets and self.buckets[0]['start'] <= self.pending:
+                self.buckets.popleft()
+        self.pending = None
+
+    def sample(self):
+        self.db.ensure_connected()
+        try:
+            # Without the helper a monitoring user only sees the state of its own backends
+            helper = PostgresInformation(self.db).have_stat_activity_helper()
+            rows = self.db.run_query(sample_query(self.db.version_numeric, helper), should_raise=True)
+        finally:
+            # A new transaction for every sample, otherwise now() and the statistics snapshot stand still
+            self.db.rollback()
+        self.add_sample(rows, time.time())
+
+    def start(self):
+        def run():
+            failing = False
+            while not self.stopped.is_set():
+                started = time.time()
+                try:
+                    self.sample()
+                    failing = False
+                except Exception as e:
+                    # Retried with a new connection every interval, only the first failure is worth a warning
+                    if not failing:
+                        logger.warning("Failed to sample activity: %s", e)
+                    failing = True
+                    self.db.close()
+                self.stopped.wait(max(0, self.interval - (time.time() - started)))
+            self.db.close()
+
+        self.thread = threading.Thread(target=run, name='activity-sampler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
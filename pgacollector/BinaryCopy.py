@@ -0,0 +1,123 @@
+import struct
+
+from .RowDecoder import FC_BINARY, compile_row_decoder
+
+SIGNATURE = 'PGCOPY\n\xff\r\n\x00'
+# Signature, flags and header extension length
+HEADER_SIZE = len(SIGNATURE) + 8
+TRAILER = '\xff\xff'
+
+NUMERIC = 1700
+# Types pg8000 receives in text format, whose binary format is the same
+TEXT_AS_BINARY = set([
+    18,  # "char"
+])
+
+_length = struct.Struct('!i').unpack_from
+_numeric_header = struct.Struct('!hhH').unpack_from
+
+
+def numeric_recv(data, offset, length):
+    # Base 10000 digits, weight being the exponent of the first one. JSON has no decimals, so straight to float
+    ndigits, weight, sign = _numeric_header(data, offset)
+    if sign == 0xC000:
+        return float('nan')
+    if sign in (0xD000, 0xF000):
+        return float('inf') if sign == 0xD000 else float('-inf')
+
+    value = 0
+    for digit in struct.unpack_from('!%dh' % ndigits, data, offset + 8):
+        value = value * 10000 + digit
+    exponent = weight - ndigits + 1
+    value = float(value) * 10000 ** exponent if exponent >= 0 else float(value) / 10000 ** -exponent
+    return -value if sign == 0x4000 else value
+
+
+def compile_copy_decoder(row_desc, pg_types):
+    """
+    Returns a function that decodes a tuple of binary COPY data into a list of values, and its end
+
+    Binary COPY tuples are laid out like DataRow messages, with every column in binary format. Returns
+    None if there is a column whose binary format pg8000 can't decode.
+    """
+    fields = []
+    funcs = []
+    for field in row_desc:
+        type_oid = field['type_oid']
+        fc, func = pg_types.get(type_oid, (None, None))
+        if type_oid == NUMERIC:
+            func = numeric_recv
+        elif fc != FC_BINARY and type_oid not in TEXT_AS_BINARY:
+            return None
+        fields.append({'type_oid': type_oid, 'pg8000_fc': FC_BINARY})
+        funcs.append(func)
+    return compile_row_decoder(fields, funcs, with_end=True)
+
+
+class BinaryCopyParser():
+    """
+    Stream for pg8000's COPY TO support that decodes binary COPY data into rows as it arrives
+
+    Postgres sends one tuple per CopyData message, but tuples split across writes are put together too.
+    Errors are kept until finish() instead of being raised from write(), which would make pg8000 close
+    the connection.
+    """
+
+    def __init__(self, decode):
+        self.decode = decode
+        self.rows = []
+        self.pending = ''
+        self.started = False
+        self.finished = False
+        self.error = None
+        # Size of the COPY data, for the profiler
+        self.received_bytes = 0
+
+    def write(self, data):
+        self.received_bytes += len(data)
+        if self.error is not None or self.finished:
+            return
+        try:
+            self._parse(data)
+        except Exception as e:
+            self.error = e
+
+    def _parse(self, data):
+        if self.pending:
+            data = self.pending + data
+            self.pending = ''
+
+        offset = 0
+        if not self.started:
+            if len(data) < HEADER_SIZE:
+                self.pending = data
+                return
+            if not data.startswith(SIGNATURE):
+                raise ValueError("Not binary COPY data")
+            offset = HEADER_SIZE + _length(data, HEADER_SIZE - 4)[0]
+            self.started = True
+
+        size = len(data)
+        decode = self.decode
+        append = self.rows.append
+        while offset < size:
+            if data.startswith(TRAILER, offset):
+                self.finished = True
+                return
+            try:
+                row, end = decode(data, offset + 2)
+            except (struct.error, IndexError):
+                end = None
+            if end is None or end > size:
+                self.pending = data[offset:]
+                return
+            append(row)
+            offset = end
+
+    def finish(self):
+        """ Returns the decoded rows, raises if the data was incomplete or couldn't be decoded """
+        if self.error is not None:
+            raise self.error
+        if not self.finished:
+            raise ValueError("Binary COPY data ended without trailer")
+        return self.rows
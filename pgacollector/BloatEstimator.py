@@ -0,0 +1,165 @@
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Same constants as the estimation queries in PostgresInformation.table_bloat/index_bloat
+TUPLE_HEADER = 23
+INDEX_TUPLE_HEADER = 6
+PAGE_HEADER = 24
+MAXALIGN = 8
+
+
+def _padding(width):
+    """ Bytes needed to align width on MAXALIGN """
+    remainder = width % MAXALIGN
+    return MAXALIGN - remainder if remainder else 0
+
+
+def table_tuple_width(columns):
+    """
+    Estimated width of a heap tuple from (null_frac, avg_width) pairs of all its columns
+
+    Returns None unless every column has statistics, like the table_bloat query.
+    """
+    if not columns or any(null_frac is None for null_frac, avg_width in columns):
+        return None
+
+    null_header = TUPLE_HEADER + 1 + len([1 for null_frac, avg_width in columns if null_frac != 0]) / 8
+    data_width = sum((1 - null_frac) * avg_width for null_frac, avg_width in columns)
+    max_null_frac = max(null_frac for null_frac, avg_width in columns)
+
+    data_header = data_width + TUPLE_HEADER + _padding(TUPLE_HEADER)
+    return data_header + _padding(data_header) + max_null_frac * (null_header + _padding(null_header)) + 4
+
+
+def index_tuple_width(columns):
+    """
+    Estimated width of a btree index tuple from (null_frac, avg_width) pairs of its indexed columns
+
+    Columns without statistics are skipped, returns None if none of them have any, like the index_bloat query.
+    """
+    columns = [(null_frac, 1024 if avg_width is None else avg_width)
+               for null_frac, avg_width in columns if null_frac is not None]
+    if not columns:
+        return None
+
+    header = 2 if max(null_frac for null_frac, avg_width in columns) == 0 else 6
+    data_width = sum((1 - null_frac) * avg_width for null_frac, avg_width in columns)
+
+    return INDEX_TUPLE_HEADER + _padding(header) + data_width + _padding(int(round(data_width)))
+
+
+def table_bloat(width, reltuples, relpages, block_size):
+    """ Returns a row like PostgresInformation.table_bloat, without the oid """
+    table_bytes = relpages * block_size or None
+    expected_bytes = int(math.ceil(reltuples * width / (block_size - 20))) * block_size or None
+
+    wasted_bytes = 0
+    if table_bytes and expected_bytes and expected_bytes <= table_bytes:
+        wasted_bytes = table_bytes - expected_bytes
+
+    return {'table_bytes': table_bytes, 'expected_bytes': expected_bytes, 'wasted_bytes': wasted_bytes}
+
+
+def index_wasted_bytes(width, reltuples, relpages, block_size):
+    # btree indexes have one metadata page
+    otta = math.ceil(reltuples * width) / block_size - PAGE_HEADER + 1
+    if relpages <= otta:
+        return 0
+    return block_size * int(round(relpages - otta))
+
+
+class BloatEstimator():
+    """
+    Estimates table and index bloat in the collector, instead of running the bloat queries
+
+    The expensive part of an estimate is the tuple width derived from pg_stats, which changes slowly.
+    Widths are cached in the state directory for up to ttl seconds and each run only refreshes the
+    widths of a rotating share of tables, so all of them are refreshed once per ttl. Sizes and row
+    counts come from pg_class on every run, so estimates still follow table growth immediately.
+    """
+
+    def __init__(self, state, ttl, interval):
+        self.state = state
+        self.ttl = ttl
+        self.interval = interval
+        self.data = state.load('bloat_estimates')
+        self.data.setdefault('tables', {})
+        self.data.setdefault('indexes', {})
+
+    def _tables_to_refresh(self, table_oids, new_index_tables, collected_at):
+        tables = self.data['tables']
+        missing = set(oid for oid in table_oids if str(oid) not in tables) | new_index_tables
+        cached = sorted((tables[str(oid)][0], oid) for oid in table_oids if oid not in missing)
+
+        if self.ttl <= self.interval:
+            return missing | set(oid for estimated_at, oid in cached)
+
+        # Refresh the oldest widths first, at least as many as needed to cycle through all tables once per ttl,
+        # and everything that has expired in any case
+        share = int(math.ceil(len(table_oids) * float(self.interval) / self.ttl))
+        expired = len([1 for estimated_at, oid in cached if collected_at - estimated_at >= self.ttl])
+
+        return missing | set(oid for estimated_at, oid in cached[:max(share, expired)])
+
+    def estimate(self, PI, collected_at):
+        """ Returns (table_bloat, index_bloat) rows in the format of the corresponding PostgresInformation methods """
+        tables = {}
+        indexes = {}
+        for row in PI.bloat_relation_sizes():
+            if row['table_oid'] is None:
+                tables[row['oid']] = row
+            else:
+                indexes[row['oid']] = row
+
+        # Indexes of materialized views are estimated too, their parents rotate like tables
+        parents = set(tables) | set(row['table_oid'] for row in indexes.itervalues())
+        new_index_tables = set(row['table_oid'] for oid, row in indexes.iteritems()
+                               if str(oid) not in self.data['indexes'])
+        refresh = self._tables_to_refresh(parents, new_index_tables, collected_at)
+        logger.debug("Refreshing bloat estimates for %d of %d relations", len(refresh), len(parents))
+
+        columns = {}
+        if refresh:
+            for row in PI.bloat_column_stats(refresh):
+                columns.setdefault(row['oid'], {})[row['attnum']] = (row['null_frac'], row['avg_width'])
+
+        table_widths = {}
+        for oid in parents:
+            if oid in refresh:
+                width = table_tuple_width(columns.get(oid, {}).values()) if oid in tables else None
+                table_widths[str(oid)] = [collected_at, width]
+            else:
+                table_widths[str(oid)] = self.data['tables'][str(oid)]
+
+        index_widths = {}
+        for oid, row in indexes.iteritems():
+            if row['table_oid'] in refresh:
+                table_columns = columns.get(row['table_oid'], {})
+                indexed = [table_columns[attnum] for attnum in map(int, row['indkey'].split())
+                           if attnum in table_columns]
+                index_widths[str(oid)] = [collected_at, index_tuple_width(indexed)]
+            elif str(oid) in self.data['indexes']:
+                index_widths[str(oid)] = self.data['indexes'][str(oid)]
+
+        # Widths don't describe anything the server knows about, so they can be kept even if the upload fails
+        self.data = {'tables': table_widths, 'indexes': index_widths}
+        self.state.save('bloat_estimates', self.data)
+
+        table_result = []
+        for oid, row in tables.iteritems():
+            width = table_widths[str(oid)][1]
+            if width is not None:
+                result = table_bloat(width, row['reltuples'], row['relpages'], row['block_size'])
+                result['oid'] = oid
+                table_result.append(result)
+
+        index_result = []
+        for oid, row in indexes.iteritems():
+            width = index_widths.get(str(oid), [None, None])[1]
+            if width is not None:
+                index_result.append({'index_oid': oid, 'wasted_bytes': index_wasted_bytes(
+                    width, row['reltuples'], row['relpages'], row['block_size'])})
+
+        return table_result, index_result
@@ -36,33 +36,89 @@ class Configuration():
     def read_file(self):
         logger.debug("Reading filesystem config")
 
-        configfile = None
-        for candidate in self.option['configfile']:
-            try:
-                mode = os.stat(candidate).st_mode
-            except Exception as e:
-                logger.debug("Couldn't stat file: %s" % e)
-                continue
+        configfile = self.find_file()
+        if not configfile:
+            logger.error("Couldn't find a readable config file, perhaps create one with --generate-config?")
+            sys.exit(1)
 
-            if not S_ISREG(mode):
-                logger.debug("%s isn't a regular file" % candidate)
-                continue
+        configparser = self.parse_file(configfile)
+        return self.dbconf_from_section(configparser, 'pganalyze', configfile)
+
+    def read_fleet(self):
+        """
+        Reads all [pganalyze] and [pganalyze:<name>] sections of the config file and of *.conf files in --config-dir
+
+        Each server gets a unique name, optionally its own interval and timeout (in seconds).
+        """
+        configfiles = []
+        configfile = self.find_file()
+        if configfile:
+            configfiles.append(configfile)
+
+        if self.option['config_dir']:
+            for filename in sorted(os.listdir(self.option['config_dir'])):
+                path = os.path.join(self.option['config_dir'], filename)
+                if filename.endswith('.conf') and self.check_file(path):
+                    configfiles.append(path)
+
+        servers = []
+        names = set()
+        for configfile in configfiles:
+            configparser = self.parse_file(configfile)
+            for section in configparser.sections():
+                if section == 'pganalyze':
+                    name = os.path.splitext(os.path.basename(configfile))[0]
+                elif section.startswith('pganalyze:'):
+                    name = section[len('pganalyze:'):]
+                else:
+                    continue
+
+                if name in names:
+                    logger.error("Server name %s is used more than once, in %s", name, configfile)
+                    sys.exit(1)
+                names.add(name)
+
+                dbconf = self.dbconf_from_section(configparser, section, configfile)
+                dbconf['name'] = name
+                for k in ('interval', 'timeout'):
+                    if configparser.has_option(section, k):
+                        dbconf[k] = configparser.getint(section, k)
+                servers.append(dbconf)
+
+        if not servers:
+            logger.error("Couldn't find any [pganalyze] or [pganalyze:<name>] sections for fleet mode")
+            sys.exit(1)
 
-            if int(oct(mode)[-2:]) != 0:
-                logger.error("Configfile is accessible by other users, please run `chmod go-rwx %s`" % candidate)
-                sys.exit(1)
+        return servers
 
-            if not os.access(candidate, os.R_OK):
-                logger.debug("%s isn't readable" % candidate)
-                continue
+    def check_file(self, candidate):
+        try:
+            mode = os.stat(candidate).st_mode
+        except Exception as e:
+            logger.debug("Couldn't stat file: %s" % e)
+            return False
 
-            configfile = candidate
-            break
+        if not S_ISREG(mode):
+            logger.debug("%s isn't a regular file" % candidate)
+            return False
 
-        if not configfile:
-            logger.error("Couldn't find a readable config file, perhaps create one with --generate-config?")
+        if int(oct(mode)[-2:]) != 0:
+            logger.error("Configfile is accessible by other users, please run `chmod go-rwx %s`" % candidate)
             sys.exit(1)
 
+        if not os.access(candidate, os.R_OK):
+            logger.debug("%s isn't readable" % candidate)
+            return False
+
+        return True
+
+    def find_file(self):
+        for candidate in self.option['configfile']:
+            if self.check_file(candidate):
+                return candidate
+        return None
+
+    def parse_file(self, configfile):
         configparser = ConfigParser.RawConfigParser()
 
         try:
@@ -72,9 +128,12 @@ class Configuration():
                 "Failure while parsing %s: %s, please fix or create a new one with --generate-config" % (configfile, e))
             sys.exit(1)
 
+        return configparser
+
+    def dbconf_from_section(self, configparser, section, configfile):
         configdump = {}
-        logger.debug("read config from %s" % configfile)
-        for k, v in configparser.items('pganalyze'):
+        logger.debug("read config from %s [%s]" % (configfile, section))
+        for k, v in configparser.items(section):
             configdump[k] = v
             # Don't print the password to debug output
             if k == 'db_password': v = '***removed***'
@@ -2,6 +2,11 @@ import logging
 import sys
 import os
 import time
+import itertools
+import collections
+import socket
+
+from . import RowDecoder
 
 logger = logging.getLogger(__name__)
 
@@ -20,44 +25,292 @@ if db_driver == None:
     except Exception as e:
         pass
 
+if db_driver == 'pg8000':
+    from . import Pipeline
+    from . import BinaryCopy
+
 if db_driver == None:
     print("*** Couldn't import database driver")
     print("*** Please install the python-psycopg2 package or the pg8000 module")
     sys.exit(1)
 
+_MISSING = object()
+
+
+class ResultColumns(object):
+    """ Column names of a result, shared by all of its rows """
+    __slots__ = ('names', 'index')
+
+    def __init__(self, names):
+        # Duplicate names (e.g. "s.*, sio.*") resolve to the last column, just like dict(zip(...)) did
+        self.index = dict((name, i) for i, name in enumerate(names))
+        self.names = tuple(name for i, name in enumerate(names) if self.index[name] == i)
+
+
+class Row(object):
+    """
+    A result row that behaves like a dict, without repeating the column names in every row
+
+    Values stay in the list (or tuple) the driver returned. Keys that aren't result
+    columns can be added, and columns can be removed, as the grooming code expects.
+    """
+    __slots__ = ('_columns', '_values', '_extra')
+
+    def __init__(self, columns, values):
+        self._columns = columns
+        self._values = values
+        self._extra = None
+
+    def __getitem__(self, key):
+        i = self._columns.index.get(key)
+        if i is not None:
+            value = self._values[i]
+            if value is not _MISSING:
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        i = self._columns.index.get(key)
+        if i is None:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+            return
+
+        if type(self._values) is tuple:
+            self._values = list(self._values)
+        self._values[i] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self._columns.index:
+            self[key] = _MISSING
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        i = self._columns.index.get(key)
+        if i is not None:
+            return self._values[i] is not _MISSING
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for name in self._columns.names:
+            if self._values[self._columns.index[name]] is not _MISSING:
+                yield name
+        if self._extra:
+            for name in self._extra:
+                yield name
+
+    iterkeys = __iter__
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def keys(self):
+        return list(self)
+
+    def iteritems(self):
+        for name in self:
+            yield name, self[name]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        for name in self:
+            yield self[name]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=_MISSING):
+        i = self._columns.index.get(key)
+        if i is not None:
+            value = self._values[i]
+            if value is not _MISSING:
+                if type(self._values) is tuple:
+                    self._values = list(self._values)
+                self._values[i] = _MISSING
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra.pop(key)
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+
+    def update(self, other=(), **kwargs):
+        if hasattr(other, 'keys'):
+            other = ((key, other[key]) for key in other.keys())
+        for key, value in itertools.chain(other, kwargs.iteritems()):
+            self[key] = value
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.Mapping):
+            return NotImplemented
+        return dict(self.iteritems()) == dict(other.items())
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+collections.MutableMapping.register(Row)
+
+
 class DB():
 
-    def __init__(self, dbname, querymarker, username=None, password=None, host=None, port=None):
+    def __init__(self, dbname, querymarker, username=None, password=None, host=None, port=None,
+                 exit_on_error=True, cache_ttl=3600, wire_recorder=None, timeout=None):
         self.querymarker = '/* ' + querymarker + ' */'
-        self.conn = self._connect(dbname, username, password, host, port)
-        logger.debug("Connected to database using %s driver" % db_driver)
+        self.connect_args = (dbname, username, password, host, port)
+
+        # Long-running callers (daemon mode) want exceptions instead of sys.exit() so they can reconnect
+        self.exit_on_error = exit_on_error
+
+        # Results of capability probes (helper functions, extensions, version) are cached for cache_ttl seconds
+        self.cache_ttl = cache_ttl
+        self.query_cache = {}
+        # Results run ahead of time by prefetch(), handed out once by run_query
+        self.prefetched = {}
+
+        self._result_columns = {}
+        # Names of the server-side cursors currently open, see iter_query
+        self._open_cursors = set()
 
+        # Optional Profiler that gets told about every query
+        self.profiler = None
+        # Optional WireRecorder that records the results of all queries (pg8000 only)
+        self.wire_recorder = wire_recorder
+        # Whether bulk_query transfers results with COPY (pg8000 only)
+        self.bulk_copy = False
+        # Socket timeout in seconds once connected (pg8000 only, psycopg2 connections are interrupted by cancel())
+        self.timeout = timeout
+
+        self.conn = None
+        self.connect()
+
+    def connect(self):
+        self.conn = self._connect(*self.connect_args)
+        logger.debug("Connected to database using %s driver" % db_driver)
+        if self.timeout and db_driver == 'pg8000':
+            self.conn._usock.settimeout(self.timeout)
         self._register_pg_type_wrappers()
-        self.version_numeric = int(self.run_query('SHOW server_version_num')[0]['server_version_num'])
+        if self.wire_recorder:
+            self.wire_recorder.attach(self.conn)
+
+        self.query_cache = {}
+        self.prefetched = {}
+        self.version_numeric = int(self.run_query('SHOW server_version_num', cached=True)[0]['server_version_num'])
+
+    def clone(self, dbname=None):
+        # Additional connections are used from worker threads, where sys.exit() would go unnoticed
+        own_dbname, username, password, host, port = self.connect_args
+        db = DB(dbname or own_dbname, self.querymarker[3:-3], username=username, password=password, host=host, port=port,
+                exit_on_error=False, cache_ttl=self.cache_ttl, wire_recorder=self.wire_recorder,
+                timeout=self.timeout)
+        db.profiler = self.profiler
+        db.bulk_copy = self.bulk_copy
+        return db
+
+    def ensure_connected(self):
+        if self.conn is None:
+            logger.info("Reconnecting to database")
+            self.connect()
+
+    def close(self):
+        if self.conn is None:
+            return
+
+        try:
+            self.conn.close()
+        except Exception as e:
+            logger.debug("Error while closing connection: %s", e)
+
+        self.conn = None
+
+    def cancel(self):
+        """ Interrupts whatever the connection is doing, can be called from another thread """
+        conn = self.conn
+        if conn is None:
+            return
 
-    def run_query(self, query, should_raise=False, commit=False):
+        if db_driver == 'psycopg':
+            conn.cancel()
+        else:
+            # pg8000 can't send cancel requests, shutting down the socket makes the blocked call fail instead
+            conn._usock.shutdown(socket.SHUT_RDWR)
+
+    def invalidate_cache(self):
+        self.query_cache = {}
+
+    def run_query(self, query, should_raise=False, commit=False, cached=False, params=None):
+        """
+        Runs a query, returning its rows
+
+        params are passed separately from the query text, which refers to each of them with %s and then has to
+        write % as %%. pg8000 keeps every distinct query text prepared until the connection is closed, so values
+        that vary between runs (like lists of oids) should be passed this way.
+        """
+        if cached:
+            key = self.query_key(query, params)
+            entry = self.query_cache.get(key)
+            if entry and time.time() - entry[0] < self.cache_ttl:
+                logger.debug("Using cached result for query: %s" % query)
+                return entry[1]
+
+            result = self._run_query(query, should_raise, commit, params)
+            self.query_cache[key] = (time.time(), result)
+            return result
+
+        return self._run_query(query, should_raise, commit, params)
+
+    @staticmethod
+    def query_key(query, params=None):
+        """ Identifies a query together with its parameters, as queries are passed to run_queries and prefetch """
+        return (query, tuple(params)) if params else query
+
+    def _operation(self, query, params=None):
         # pg8000 is picky regarding % characters in query strings, escaping with extreme prejudice
-        if db_driver == 'pg8000' and '%' in query:
+        if db_driver == 'pg8000' and '%' in query and not params:
             logger.debug("Escaping % characters in query string")
             query = query.replace('%', '%%')
 
         logger.debug("Running query: %s" % query)
 
         # Prepending querymarker to be able to filter own queries during subsequent runs
-        query = self.querymarker + query
+        return self.querymarker + query
+
+    def _run_query(self, query, should_raise=False, commit=False, params=None):
+        result = self.prefetched.pop(self.query_key(query, params), None)
+        if result is not None:
+            logger.debug("Using prefetched result for query: %s" % query)
+            return result
 
+        query = self._operation(query, params)
         cur = self.conn.cursor()
 
         try:
             start_time = time.time()
-            cur.execute(query)
+            cur.execute(query, params or None)
 
             if commit:
                 self.conn.commit()
 
             logger.debug("Elapsed time: %f ms", (time.time() - start_time) * 1000)
         except Exception as e:
-            if should_raise:
+            if should_raise or not self.exit_on_error:
                 self.conn.rollback()
                 raise e
             logger.error("Got an error during query execution")
@@ -67,21 +320,173 @@ class DB():
 
         # Didn't get any column definition back, this is most likely a return-less command (SET et al)
         if cur.description is None:
+            rows = []
+        else:
+            rows = cur.fetchall()
+
+        if self.profiler:
+            self.profiler.record_query(time.time() - start_time, rows, getattr(cur, 'received_bytes', None))
+
+        return self._result(cur.description, rows)
+
+    def _result(self, description, rows):
+        if description is None:
             return []
 
-        # Fetch column headers
-        columns = [f[0] for f in cur.description]
+        # Fetch column headers, shared between all rows
+        columns = self._columns_for(tuple(f[0] for f in description))
 
-        # Build list of hashes
-        result = [dict(zip(columns, row)) for row in cur.fetchall()]
+        # Build list of hash-like rows
+        result = [Row(columns, row) for row in rows]
         return result
 
+    def run_queries(self, queries):
+        """
+        Runs independent queries, returns a list with the result (or the exception) of each of them
+
+        Queries with parameters are given as (query, params) pairs, see query_key. With pg8000 they are sent
+        to Postgres together, costing one round-trip instead of one per query, and an error fails only its
+        own query (see Pipeline). Otherwise they run one after another.
+        """
+        if not queries:
+            return []
+        queries = [query if isinstance(query, tuple) else (query, None) for query in queries]
+
+        # Recordings are made per query, through the regular path
+        if db_driver != 'pg8000' or self.wire_recorder:
+            results = []
+            for query, params in queries:
+                try:
+                    results.append(self._run_query(query, should_raise=True, params=params))
+                except Exception as e:
+                    results.append(e)
+            return results
+
+        operations = [self._operation(query, params) for query, params in queries]
+        try:
+            start_time = time.time()
+            outcomes = Pipeline.run_pipelined(self.conn, operations, [params for query, params in queries])
+            elapsed = time.time() - start_time
+            logger.debug("Elapsed time for %d pipelined queries: %f ms", len(queries), elapsed * 1000)
+        except Exception as e:
+            if not self.exit_on_error:
+                raise e
+            logger.error("Got an error during query execution")
+            for line in str(e).splitlines():
+                logger.error(line)
+            sys.exit(1)
+
+        results = []
+        for cur, error in outcomes:
+            if error is not None:
+                results.append(error)
+                continue
+            rows = cur.fetchall() if cur.description is not None else []
+            if self.profiler:
+                self.profiler.record_query(elapsed / len(queries), rows, getattr(cur, 'received_bytes', None))
+            results.append(self._result(cur.description, rows))
+        return results
+
+    def prefetch(self, queries):
+        """ Runs queries together ahead of time, run_query then hands out their results instead of running them """
+        for query, result in zip(queries, self.run_queries(queries)):
+            if isinstance(result, Exception):
+                logger.debug("Prefetching failed, query will be run on its own: %s", result)
+            else:
+                self.prefetched[query] = result
+
+    def discard_prefetched(self):
+        self.prefetched = {}
+
+    def iter_query(self, query, batch_size=1000, params=None):
+        """
+        Like run_query, but yields rows as they are fetched through a server-side cursor
+
+        Only batch_size rows are held in memory at a time. Needs to be consumed within the current transaction.
+        """
+        # Names are reused once closed, as pg8000 keeps every distinct statement text prepared for good
+        name = 'pganalyze_cursor'
+        suffix = 0
+        while name in self._open_cursors:
+            suffix += 1
+            name = 'pganalyze_cursor_%d' % suffix
+        self.run_query("DECLARE %s NO SCROLL CURSOR FOR %s" % (name, query), params=params)
+        self._open_cursors.add(name)
+
+        try:
+            while True:
+                rows = self.run_query("FETCH FORWARD %d FROM %s" % (batch_size, name))
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            self._open_cursors.discard(name)
+            if self.conn is not None:
+                self.run_query("CLOSE %s" % name)
+
+    def bulk_query(self, query, stream=False, params=None):
+        """
+        Runs a query with a large result, through COPY (...) TO STDOUT in binary format if bulk_copy is on
+
+        pg8000 fetches at most 100 rows per round-trip, COPY sends the whole result at once. Falls back to
+        iter_query (stream) or run_query with psycopg2, for result types binary COPY can't be decoded for,
+        or if the COPY fails. Rows of a COPY are all held in memory, even with stream.
+        """
+        if self.bulk_copy and db_driver == 'pg8000' and not self.wire_recorder:
+            result = self._copy_query(query, params)
+            if result is not None:
+                return iter(result) if stream else result
+
+        if stream:
+            return self.iter_query(query, params=params)
+        return self.run_query(query, params=params)
+
+    def _copy_query(self, query, params=None):
+        start_time = time.time()
+
+        # Prepared like for run_query, to find out the result types
+        ps, error = Pipeline.prepare(self.conn, [self._operation(query, params)], [params])[0]
+        if error is not None:
+            logger.debug("Not using COPY, query failed: %s", error)
+            return None
+        decode = BinaryCopy.compile_copy_decoder(ps['row_desc'], self.conn.pg_types)
+        if decode is None:
+            logger.debug("Not using COPY, result types can't be decoded from binary COPY data")
+            return None
+
+        # COPY doesn't take parameters, they are written into it. It runs as the unnamed statement, which
+        # pg8000 doesn't keep prepared.
+        if params:
+            query = query % tuple("'%s'" % param.replace("'", "''") for param in params)
+
+        parser = BinaryCopy.BinaryCopyParser(decode)
+        error = Pipeline.run_copy(self.conn, self._operation("COPY (%s) TO STDOUT WITH BINARY" % query), parser)
+        try:
+            if error is not None:
+                raise error
+            rows = parser.finish()
+        except Exception as e:
+            logger.debug("Not using COPY, it failed: %s", e)
+            return None
+
+        logger.debug("Elapsed time: %f ms", (time.time() - start_time) * 1000)
+        if self.profiler:
+            self.profiler.record_query(time.time() - start_time, rows, parser.received_bytes)
+
+        return self._result([(f['name'],) for f in ps['row_desc']], rows)
+
+    def _columns_for(self, names):
+        columns = self._result_columns.get(names)
+        if columns is None:
+            if len(self._result_columns) > 1000:
+                self._result_columns = {}
+            columns = self._result_columns[names] = ResultColumns(names)
+        return columns
+
     def rollback(self):
         self.conn.rollback()
 
-    def _pg8000_float_numeric_wrapper(self, data, offset, length):
-        return float(self._pg8000_numeric_in(data, offset, length))
-
     def _connect(self, dbname, username, password, host, port):
         try:
             kw = {}
@@ -107,6 +512,8 @@ class DB():
 
         except Exception as e:
             logger.error("Failed to connect to database: %s", str(e))
+            if not self.exit_on_error:
+                raise e
             sys.exit(1)
 
     def _connect_with_kw(self, kw):
@@ -117,8 +524,7 @@ class DB():
 
         # Convert decimal values to float since JSON can't handle Decimals
         if pg.__name__ == 'pg8000':
-            self._pg8000_numeric_in = self.conn.pg_types[1700][1]
-            self.conn.pg_types[1700] = (pg.core.FC_TEXT, self._pg8000_float_numeric_wrapper)
+            RowDecoder.install(self.conn, pg.core.DATA_ROW)
 
         if pg.__name__ == 'psycopg2':
             dec2float = pg.extensions.new_type(
@@ -0,0 +1,120 @@
+import logging
+import heapq
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Member():
+    def __init__(self, name, interval, timeout, job, cancel):
+        self.name = name
+        self.interval = interval
+        self.timeout = timeout
+        self.job = job
+        self.cancel = cancel
+        self.started_at = None
+        self.cancelled = False
+
+
+class Fleet():
+    """
+    Runs the collections of many servers from one process, each on its own schedule
+
+    At most concurrency runs happen at the same time, each in its own thread. A run that takes longer
+    than its timeout gets cancelled (its database connections are interrupted), a server whose previous
+    run is still going skips its next slot. First runs are spread out over the interval so that
+    servers with the same schedule don't all start at once.
+    """
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.members = []
+        self.lock = threading.Lock()
+        self.running = {}
+        self.stopped = threading.Event()
+
+    def install_signal_handlers(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        logger.info("Received signal %d, stopping after running collections", signum)
+        self.stop()
+
+    def stop(self):
+        self.stopped.set()
+
+    def add(self, name, interval, timeout, job, cancel=None):
+        self.members.append(Member(name, interval, timeout, job, cancel))
+
+    def _check_timeouts(self):
+        now = time.time()
+        with self.lock:
+            overdue = [m for m in self.running.values()
+                       if not m.cancelled and m.timeout and now - m.started_at > m.timeout]
+        for member in overdue:
+            logger.error("Collection for %s exceeded its timeout of %d seconds, cancelling", member.name, member.timeout)
+            member.cancelled = True
+            if member.cancel:
+                try:
+                    member.cancel()
+                except Exception as e:
+                    logger.debug("Failed to cancel collection for %s: %s", member.name, e)
+
+    def _run(self, member, slots):
+        try:
+            member.job()
+        except BaseException as e:
+            # Nothing may take down the whole fleet, not even sys.exit() deep down in a collection
+            logger.error("Collection for %s failed: %r", member.name, e)
+        finally:
+            with self.lock:
+                del self.running[member.name]
+            slots.release()
+
+    def _wait(self, until):
+        while not self.stopped.is_set():
+            self._check_timeouts()
+            remaining = until - time.time()
+            if remaining <= 0:
+                return True
+            # Wake up regularly so signals and timeouts get handled in a timely manner
+            self.stopped.wait(min(remaining, 1.0))
+        return False
+
+    def run_forever(self):
+        slots = threading.BoundedSemaphore(self.concurrency)
+        now = time.time()
+        queue = [(now + member.interval * float(i) / len(self.members), i) for i, member in enumerate(self.members)]
+        heapq.heapify(queue)
+
+        while queue and self._wait(queue[0][0]):
+            next_run, i = heapq.heappop(queue)
+            member = self.members[i]
+            heapq.heappush(queue, (max(next_run + member.interval, time.time()), i))
+
+            if member.name in self.running:
+                logger.warning("Previous collection for %s is still running, skipping this one", member.name)
+                continue
+
+            # Global concurrency limit, the queue waits while all slots are taken
+            while not slots.acquire(False):
+                if not self._wait(time.time() + 0.1):
+                    break
+            else:
+                member.started_at = time.time()
+                member.cancelled = False
+                with self.lock:
+                    self.running[member.name] = member
+                thread = threading.Thread(target=self._run, args=(member, slots), name='collect-' + member.name)
+                thread.daemon = True
+                thread.start()
+
+        logger.info("Waiting for %d running collections to finish", len(self.running))
+        # Give up on collections that don't react to being cancelled
+        deadline = time.time() + max(member.timeout for member in self.members)
+        while self.running and time.time() < deadline:
+            self._check_timeouts()
+            time.sleep(0.1)
@@ -0,0 +1,116 @@
+# Table-level lock modes, in the order of the conflict table in the Postgres docs
+MODES = ['AccessShareLock', 'RowShareLock', 'RowExclusiveLock', 'ShareUpdateExclusiveLock', 'ShareLock',
+         'ShareRowExclusiveLock', 'ExclusiveLock', 'AccessExclusiveLock']
+
+CONFLICTS = {
+    'AccessShareLock': ['AccessExclusiveLock'],
+    'RowShareLock': ['ExclusiveLock', 'AccessExclusiveLock'],
+    'RowExclusiveLock': ['ShareLock', 'ShareRowExclusiveLock', 'ExclusiveLock', 'AccessExclusiveLock'],
+    'ShareUpdateExclusiveLock': ['ShareUpdateExclusiveLock', 'ShareLock', 'ShareRowExclusiveLock', 'ExclusiveLock',
+                                 'AccessExclusiveLock'],
+    'ShareLock': ['RowExclusiveLock', 'ShareUpdateExclusiveLock', 'ShareRowExclusiveLock', 'ExclusiveLock',
+                  'AccessExclusiveLock'],
+    'ShareRowExclusiveLock': ['RowExclusiveLock', 'ShareUpdateExclusiveLock', 'ShareLock', 'ShareRowExclusiveLock',
+                              'ExclusiveLock', 'AccessExclusiveLock'],
+    'ExclusiveLock': MODES[1:],
+    'AccessExclusiveLock': MODES,
+}
+
+
+def conflicts(mode, other):
+    return other in CONFLICTS.get(mode, MODES)
+
+
+def wait_graph(rows):
+    """
+    Returns which pids each waiting pid is blocked by, from locks on contended objects
+
+    Uses blocked_by (pg_blocking_pids(), 9.6+) when it is set. Otherwise a waiter is blocked by the
+    other pids that were granted a conflicting lock on the same object, which leaves out waiters
+    queued ahead of it.
+    """
+    granted = {}
+    for row in rows:
+        if row['granted']:
+            granted.setdefault(row['lock_key'], []).append(row)
+
+    graph = {}
+    for row in rows:
+        if row['granted']:
+            continue
+        if row.get('blocked_by') is not None:
+            blockers = set(row['blocked_by'])
+        else:
+            blockers = set(holder['pid'] for holder in granted.get(row['lock_key'], [])
+                           if holder['pid'] != row['pid'] and conflicts(row['mode'], holder['mode']))
+        if blockers:
+            graph.setdefault(row['pid'], set()).update(blockers)
+    return graph
+
+
+def blocking_trees(graph, waits):
+    """
+    Turns the wait graph into one tree per root blocker, a pid that blocks others without waiting itself
+
+    A pid waiting for several others is listed once, under the first of them reached.
+
+    waits maps waiting pids to their lock wait in seconds. Each tree lists the pids blocked by its root
+    in depth-first order, each with the pid it is listed under as parent, and how many there are in
+    total. Queues of waiters make chains as long as the queue, so trees are flat instead of nested.
+    Pids in a cycle without a root (a deadlock not resolved yet) are left out.
+    """
+    blocking = {}
+    for waiter, blockers in graph.iteritems():
+        for blocker in blockers:
+            blocking.setdefault(blocker, []).append(waiter)
+
+    trees = []
+    for root in sorted(pid for pid in blocking if pid not in graph):
+        seen = set([root])
+        blocked = []
+        stack = [(root, iter(sorted(blocking[root])))]
+        while stack:
+            parent, waiters = stack[-1]
+            for waiter in waiters:
+                if waiter not in seen:
+                    seen.add(waiter)
+                    blocked.append({'pid': waiter, 'parent': parent, 'wait_seconds': waits.get(waiter)})
+                    stack.append((waiter, iter(sorted(blocking.get(waiter, [])))))
+                    break
+            else:
+                stack.pop()
+        trees.append({'pid': root, 'wait_seconds': waits.get(root), 'blocked_total': len(blocked),
+                      'blocked': blocked})
+
+    trees.sort(key=lambda tree: -tree['blocked_total'])
+    return trees
+
+
+def summarize_locks(contended, counts):
+    """
+    Returns the rows of waiting and blocking pids among the contended locks, and a summary with
+    the blocking trees and the lock counts by relation and mode
+    """
+    graph = wait_graph(contended)
+    participants = set(graph)
+    for blockers in graph.itervalues():
+        participants.update(blockers)
+
+    waits = {}
+    rows = []
+    for row in contended:
+        if row['pid'] not in participants:
+            continue
+        del row['lock_key']
+        if not row['granted']:
+            row['blocked_by'] = sorted(graph.get(row['pid'], []))
+            if row['wait_seconds'] is not None:
+                waits[row['pid']] = max(waits.get(row['pid'], 0), row['wait_seconds'])
+        rows.append(row)
+
+    summary = {
+        'waiting': len(graph),
+        'blocking_trees': blocking_trees(graph, waits),
+        'counts': counts,
+    }
+    return rows, summary
@@ -0,0 +1,246 @@
+import logging
+import threading
+import collections
+import decimal
+import hashlib
+import BaseHTTPServer
+import SocketServer
+
+from .Upload import RawJSON
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Label value for the series that everything beyond the cardinality limit is summed into
+OTHER = '__other__'
+
+QUERY_COUNTERS = ['calls', 'total_time', 'rows', 'shared_blks_hit', 'shared_blks_read', 'shared_blks_dirtied',
+                  'shared_blks_written', 'temp_blks_read', 'temp_blks_written', 'blk_read_time', 'blk_write_time']
+
+TABLE_STATS = ['size_bytes', 'wasted_bytes', 'seq_scan', 'seq_tup_read', 'idx_scan', 'idx_tup_fetch',
+               'n_tup_ins', 'n_tup_upd', 'n_tup_del', 'n_tup_hot_upd', 'n_live_tup', 'n_dead_tup',
+               'heap_blks_read', 'heap_blks_hit', 'idx_blks_read', 'idx_blks_hit',
+               'vacuum_count', 'autovacuum_count', 'analyze_count', 'autoanalyze_count']
+TABLE_GAUGES = set(['size_bytes', 'wasted_bytes', 'n_live_tup', 'n_dead_tup'])
+
+
+def _is_number(value):
+    return isinstance(value, (int, long, float, decimal.Decimal)) and not isinstance(value, bool)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value != value:
+            return 'NaN'
+        if value in (float('inf'), float('-inf')):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Metrics():
+    """ Metric families in text exposition format, series with equal labels are summed up """
+
+    def __init__(self):
+        self.families = collections.OrderedDict()
+
+    def add(self, name, metric_type, help, labels, value):
+        if not _is_number(value):
+            return
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = (metric_type, help, collections.OrderedDict())
+        key = tuple(labels)
+        family[2][key] = family[2].get(key, 0) + value
+
+    def render(self):
+        lines = []
+        for name, (metric_type, help, series) in self.families.iteritems():
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            for labels, value in series.iteritems():
+                if labels:
+                    label_text = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+                    lines.append('%s{%s} %s' % (name, label_text, _format_value(value)))
+                else:
+                    lines.append('%s %s' % (name, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _capped(rows, key, max_series):
+    """
+    Splits (labels, row) pairs into the max_series largest rows by key and the rest, which is reported
+    as one series per labels
+    """
+    ranked = sorted(rows, key=lambda entry: entry[1].get(key) or 0, reverse=True)
+    return ranked[:max_series], ranked[max_series:]
+
+
+def _add_row(metrics, prefix, view, row, labels, exclude=()):
+    for column in sorted(row.keys()):
+        if column not in exclude:
+            metrics.add(prefix + column, 'untyped', '%s.%s' % (view, column), labels, row[column])
+
+
+def _query_id(row):
+    if row.get('queryid') is not None:
+        return str(row['queryid'])
+    if row.get('query_hash'):
+        return row['query_hash']
+    text = row.get('query') or ''
+    return hashlib.md5(text.encode('utf-8') if isinstance(text, unicode) else text).hexdigest()
+
+
+def render(data, collected_at, max_series):
+    """ Renders a snapshot as built by collect_and_post in Prometheus text exposition format """
+    metrics = Metrics()
+    metrics.add('pganalyze_collector_last_collection_timestamp_seconds', 'gauge',
+                'When the data was collected', [], collected_at)
+
+    postgres = data.get('postgres', {})
+
+    for row in postgres.get('database', []):
+        _add_row(metrics, 'pganalyze_database_', 'pg_stat_database', row, [('database', row.get('datname'))],
+                 exclude=('datid', 'datname', 'stats_reset'))
+
+    for row in postgres.get('bgwriter', []):
+        _add_row(metrics, 'pganalyze_bgwriter_', 'pg_stat_bgwriter', row, [], exclude=('stats_reset',))
+
+    for row in postgres.get('backends', []):
+        metrics.add('pganalyze_backends', 'gauge', 'Connections by state', [('state', row.get('state'))], 1)
+
+    if 'lock_summary' in postgres:
+        # With --lock-summary locks only holds the waiting and blocking backends
+        for row in postgres['lock_summary']['counts']:
+            metrics.add('pganalyze_locks', 'gauge', 'Locks by mode',
+                        [('mode', row.get('mode')), ('granted', 'true' if row.get('granted') else 'false')],
+                        row['count'])
+        metrics.add('pganalyze_lock_waiting_backends', 'gauge', 'Backends waiting for a lock held by another',
+                    [], postgres['lock_summary']['waiting'])
+    else:
+        for row in postgres.get('locks', []):
+            metrics.add('pganalyze_locks', 'gauge', 'Locks by mode',
+                        [('mode', row.get('mode')), ('granted', 'true' if row.get('granted') else 'false')], 1)
+
+    # With --all-databases tables and queries come per database and are labelled with its name
+    sections = [([], postgres, data.get('queries') or [])]
+    for database in data.get('databases', []):
+        sections.append(([('database', database['name'])], database['postgres'], database.get('queries') or []))
+
+    relations = []
+    query_rows = []
+    for labels, section, section_queries in sections:
+        # Records built by Postgres (--schema-engine server) are decoded for the few fields needed here
+        schema = (r.load() if isinstance(r, RawJSON) else r for r in section.get('schema', []))
+        relations.extend((labels, dict(r['stats'], schema_name=r['schema_name'], table_name=r['table_name']))
+                         for r in schema if r.get('relation_type') == 'r')
+        query_rows.extend((labels, row) for row in section_queries)
+
+    tables, other_tables = _capped(relations, 'size_bytes', max_series)
+    for rows, other in ((tables, False), (other_tables, True)):
+        for database, row in rows:
+            labels = database + [('schema', '' if other else row['schema_name']),
+                                 ('table', OTHER if other else row['table_name'])]
+            for column in TABLE_STATS:
+                if column in TABLE_GAUGES:
+                    metrics.add('pganalyze_table_' + column, 'gauge', 'Table ' + column, labels, row.get(column))
+                else:
+                    metrics.add('pganalyze_table_' + column + '_total', 'counter', 'Table statistics ' + column,
+                                labels, row.get(column))
+
+    # With --query-deltas the counters cover the last interval only
+    deltas = 'query_deltas' in data
+    queries, other_queries = _capped(query_rows, 'total_time', max_series)
+    for rows, other in ((queries, False), (other_queries, True)):
+        for database, row in rows:
+            labels = database + [('queryid', OTHER if other else _query_id(row))]
+            for column in QUERY_COUNTERS:
+                name = 'pganalyze_query_' + column + ('_interval' if deltas else '_total')
+                metrics.add(name, 'gauge' if deltas else 'counter', 'pg_stat_statements ' + column,
+                            labels, row.get(column))
+
+    memory = (data.get('system') or {}).get('memory') or {}
+    for key in sorted(memory.keys()):
+        metrics.add('pganalyze_system_memory_' + key, 'gauge', 'System memory ' + key, [], memory[key])
+
+    stats = data.get('collector_stats') or {}
+    for phase, seconds in sorted(stats.get('phases', {}).items()):
+        metrics.add('pganalyze_collector_phase_seconds', 'gauge', 'Time spent per collection phase',
+                    [('phase', phase)], seconds)
+    for section, section_stats in sorted(stats.get('sections', {}).items()):
+        metrics.add('pganalyze_collector_section_seconds', 'gauge', 'Time spent per collected section',
+                    [('section', section)], section_stats['wall_time'])
+    metrics.add('pganalyze_collector_peak_rss_bytes', 'gauge', 'Peak memory use of the collector',
+                [], stats.get('peak_rss_bytes'))
+
+    return metrics.render()
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.exporter.body
+        if body is None:
+            self.send_error(503, 'No data collected yet')
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MetricsExporter():
+    """
+    Serves the most recent snapshot on /metrics in Prometheus text exposition format
+
+    Collection runs on its own schedule and calls update(), which renders the output once.
+    Scrapes only ever return that rendered output, so any number of scrapers adds no load on Postgres.
+    Per-table and per-query series are limited to the max_series largest tables (by size) and queries
+    (by total time), everything else is summed up in a series labelled __other__.
+    """
+
+    def __init__(self, address, port, max_series):
+        self.max_series = max_series
+        self.body = None
+        self.httpd = _Server((address, port), _Handler)
+        self.httpd.exporter = self
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("Serving metrics on http://%s:%d/metrics", *self.httpd.server_address[:2])
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def update(self, data, collected_at):
+        body = render(data, collected_at, self.max_series)
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        # Replacing the reference is atomic, scrapes in progress keep the previous body
+        self.body = body
@@ -0,0 +1,187 @@
+import logging
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = '.snapshot'
+READ_SIZE = 64 * 1024
+
+
+class Outbox():
+    """
+    Spool directory of compressed snapshots waiting to be uploaded
+
+    Each entry is one file, written to a temporary file first and renamed into place, so a crash
+    never leaves a partial entry behind. The first line holds the upload metadata as JSON, the rest
+    is the zlib-compressed snapshot. File names start with the collection time, so sorting them
+    gives the upload order. Entries older than max_age seconds are dropped, and while the spool is
+    larger than max_bytes the oldest entries are dropped first. Dropped entries are counted, as later
+    snapshots may depend on what they carried.
+    """
+
+    def __init__(self, directory, max_bytes, max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def entries(self):
+        """ Names of all spooled snapshots, oldest first """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(name for name in names if name.endswith(SUFFIX))
+
+    def put(self, metadata, chunks):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0700)
+
+        fd, tmppath = tempfile.mkstemp(dir=self.directory, prefix='.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(metadata) + '\n')
+                for chunk in chunks:
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            name = "%012d-%s%s" % (metadata['collected_at'], os.path.basename(tmppath)[1:], SUFFIX)
+            os.rename(tmppath, self._path(name))
+        except Exception:
+            os.unlink(tmppath)
+            raise
+
+        self.evict()
+        return name
+
+    def read(self, name):
+        """ Returns the metadata of an entry and a generator of its compressed snapshot """
+        f = open(self._path(name), 'r')
+        metadata = json.loads(f.readline())
+
+        def body():
+            with f:
+                while True:
+                    chunk = f.read(READ_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        return metadata, body()
+
+    def remove(self, name):
+        try:
+            os.unlink(self._path(name))
+        except OSError as e:
+            logger.debug("Failed to remove spooled snapshot %s: %s", name, e)
+
+    def evict(self, now=None):
+        now = time.time() if now is None else now
+        names = self.entries()
+
+        sizes = {}
+        for name in names:
+            try:
+                sizes[name] = os.path.getsize(self._path(name))
+            except OSError:
+                sizes[name] = 0
+
+        total = sum(sizes.values())
+        for name in names:
+            expired = now - int(name.split('-', 1)[0]) > self.max_age
+            if not expired and total <= self.max_bytes:
+                break
+            logger.warning("Dropping spooled snapshot %s (%s)", name, 'too old' if expired else 'spool is full')
+            self.remove(name)
+            total -= sizes[name]
+            with self.lock:
+                self.dropped += 1
+
+    def take_dropped(self):
+        """ Returns how many entries were dropped since the last call """
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class OutboxSender():
+    """
+    Uploads the snapshots of an Outbox, oldest first
+
+    send is called with a list of up to batch_size entry names and returns whether they were accepted.
+    After a failure nothing is sent for an exponentially growing, randomized backoff time, so that
+    collectors don't all retry at the same moment once an outage is over. When several entries have
+    queued up, each request carries up to batch_size of them.
+    """
+
+    def __init__(self, outbox, send, batch_size=1, min_backoff=10, max_backoff=600):
+        self.outbox = outbox
+        self.send = send
+        self.batch_size = batch_size
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.next_attempt = 0
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def backoff(self):
+        delay = min(self.max_backoff, self.min_backoff * 2 ** (self.failures - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def flush(self):
+        """ Sends entries until the outbox is empty or an upload fails, returns whether it is empty """
+        with self.lock:
+            if time.time() < self.next_attempt:
+                logger.debug("Backing off for %d seconds after %d failed uploads",
+                             self.next_attempt - time.time(), self.failures)
+                return False
+
+            self.outbox.evict()
+            while True:
+                names = self.outbox.entries()[:self.batch_size]
+                if not names:
+                    return True
+
+                try:
+                    accepted = self.send(names)
+                except Exception as e:
+                    logger.error("Failed to upload spooled snapshots: %s", e)
+                    accepted = False
+
+                if not accepted:
+                    self.failures += 1
+                    delay = self.backoff()
+                    self.next_attempt = time.time() + delay
+                    logger.warning("Upload failed, %d snapshots spooled, retrying in %d seconds",
+                                   len(self.outbox.entries()), delay)
+                    return False
+
+                self.failures = 0
+                for name in names:
+                    self.outbox.remove(name)
+
+    def start(self):
+        """ Keeps sending in a background thread, woken up by wake() and when the backoff time is over """
+        def run():
+            while True:
+                self.wakeup.wait(max(1, self.next_attempt - time.time()) if self.outbox.entries() else None)
+                self.wakeup.clear()
+                self.flush()
+
+        self.thread = threading.Thread(target=run, name='outbox')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wake(self):
+        self.wakeup.set()
@@ -2,9 +2,18 @@ import logging
 import re
 import sys
 
+from .StatementDeltas import entry_key
+from .PostgresInformation import array_param
+
 logger = logging.getLogger(__name__)
 
 
+def database_filter(all_databases):
+    if all_databases:
+        return ""
+    return "AND dbid IN (SELECT oid FROM pg_database WHERE datname = current_database())"
+
+
 class PgStatStatements():
 
     def __init__(self, db):
@@ -17,9 +26,31 @@ class PgStatStatements():
           JOIN pg_namespace ON (pronamespace = pg_namespace.oid)
          WHERE nspname = 'pganalyze' AND proname = 'get_stat_statements'
         """
-        return self.db.run_query(query) == [{"enabled": 1}]
+        return self.db.run_query(query, cached=True) == [{"enabled": 1}]
+
+    def have_showtext(self):
+        # pg_stat_statements 1.2 (Postgres 9.4) can omit query texts
+        query = """
+        SELECT 1 AS enabled
+          FROM pg_proc
+         WHERE proname = 'pg_stat_statements' AND pronargs = 1
+        """
+        return self.db.version_numeric >= 90400 and self.db.run_query(query, cached=True) == [{"enabled": 1}]
+
+    def is_ignored_text(self, text):
+        # Client-side equivalent of the filters in fetch_queries, for texts fetched separately
+        pattern = r'%s|<insufficient privilege>$|DEALLOCATE ' % re.escape(self.db.querymarker)
+        return text is None or re.match(pattern, text, re.I) is not None
+
+    def fetch_queries(self, deltas=None, collected_at=None, texts=None, all_databases=False):
+        """
+        Returns the pg_stat_statements entries of the current database
+
+        With all_databases, entries of all databases are returned and keep their dbid.
+        """
+        if texts and not self.have_stats_helper() and self.have_showtext():
+            return self._fetch_queries_without_text(deltas, collected_at, texts, all_databases)
 
-    def fetch_queries(self):
         query = "SELECT * FROM "
 
         if self.have_stats_helper():
@@ -34,12 +65,75 @@ class PgStatStatements():
         # Filter out DEALLOCATE statements - they are not useful and consume space
         query += " AND query NOT LIKE 'DEALLOCATE %'"
         # Only get queries from current database
-        query += " AND dbid IN (SELECT oid FROM pg_database WHERE datname = current_database())"
+        if not all_databases:
+            query += " AND dbid IN (SELECT oid FROM pg_database WHERE datname = current_database())"
+
+        queries = []
+        rows = self.db.bulk_query(query)
+
+        if deltas:
+            rows = deltas.apply(rows, collected_at)
+
+        for row in rows:
+            if texts:
+                row['query_hash'] = texts.add(row.pop('query'), entry_key(row) if row.get('queryid') else None)
+
+            if not all_databases:
+                del row['dbid']
+            del row['userid']
+
+            queries.append(row)
+
+        return queries
+
+    def _fetch_queries_without_text(self, deltas, collected_at, texts, all_databases):
+        # Counters only - texts are fetched separately, and only for entries we haven't seen before
+        query = """
+        SELECT *
+          FROM pg_stat_statements(showtext := false)
+         WHERE queryid IS NOT NULL
+               %s
+        """ % database_filter(all_databases)
+        rows = [row for row in self.db.bulk_query(query) if not texts.is_ignored(entry_key(row))]
+
+        if deltas:
+            rows = deltas.apply(rows, collected_at)
+
+        unknown = set(row['queryid'] for row in rows if texts.hash_for_queryid(entry_key(row)) is None)
+        fetched = {}
+
+        if unknown:
+            logger.debug("Fetching %d query texts", len(unknown))
+            query = """
+            SELECT userid, dbid, queryid, query
+              FROM pg_stat_statements
+             WHERE queryid = ANY(%%s::bigint[])
+                   %s
+            """ % database_filter(all_databases)
+            for row in self.db.run_query(query, params=[array_param(int(queryid) for queryid in unknown)]):
+                fetched[entry_key(row)] = row['query']
 
         queries = []
 
-        for row in self.db.run_query(query, False):
-            del row['dbid']
+        for row in rows:
+            key = entry_key(row)
+            del row['query']
+
+            known = texts.hash_for_queryid(key)
+            if known:
+                texts.reference(known, key)
+                row['query_hash'] = known
+            elif key not in fetched:
+                # Evicted in between the two queries
+                continue
+            elif self.is_ignored_text(fetched[key]):
+                texts.ignore(key)
+                continue
+            else:
+                row['query_hash'] = texts.add(fetched[key], key)
+
+            if not all_databases:
+                del row['dbid']
             del row['userid']
 
             queries.append(row)
@@ -0,0 +1,242 @@
+import logging
+import struct
+
+import pg8000
+from pg8000 import core
+
+logger = logging.getLogger(__name__)
+
+SAVEPOINT = 'pganalyze_pipeline'
+
+# Binds the unnamed statement without parameters to the unnamed portal, and executes it for all rows
+_BIND_UNNAMED = core.NULL_BYTE + core.NULL_BYTE + core.h_pack(0) + core.h_pack(0) + core.h_pack(0)
+_EXECUTE_UNNAMED = core.NULL_BYTE + core.i_pack(0)
+
+
+def _send_command(conn, command):
+    conn._send_message(core.PARSE, core.NULL_BYTE + command.encode(conn._client_encoding) + core.NULL_BYTE +
+                       core.h_pack(0))
+    conn._send_message(core.BIND, _BIND_UNNAMED)
+    conn._send_message(core.EXECUTE, _EXECUTE_UNNAMED)
+
+
+def _run_isolated(conn, steps):
+    """
+    Sends all steps at once, each followed by a Sync, then reads the responses of one step after another
+
+    steps are (send, cursor) pairs. Within a transaction an error would abort all steps after it, so a
+    savepoint is set up front and rolled back to before each following step. The steps only read, so
+    rolling back after the successful ones doesn't lose anything. Returns the error of each step, or None.
+    """
+    if not steps:
+        return []
+
+    if not conn.in_transaction and not conn.autocommit:
+        _send_command(conn, 'begin transaction')
+    _send_command(conn, 'SAVEPOINT ' + SAVEPOINT)
+    for i, (send, cursor) in enumerate(steps):
+        if i > 0:
+            _send_command(conn, 'ROLLBACK TO SAVEPOINT ' + SAVEPOINT)
+        send()
+        conn._write(core.SYNC_MSG)
+    _send_command(conn, 'ROLLBACK TO SAVEPOINT ' + SAVEPOINT)
+    _send_command(conn, 'RELEASE SAVEPOINT ' + SAVEPOINT)
+    conn._write(core.SYNC_MSG)
+    conn._flush()
+
+    errors = []
+    for send, cursor in steps:
+        try:
+            conn.handle_messages(cursor)
+            errors.append(None)
+        except pg8000.ProgrammingError as e:
+            errors.append(e)
+    conn.handle_messages(conn.cursor())
+    return errors
+
+
+def _param_types(conn, params):
+    # (oid, format code, send function) of each parameter, as pg8000 picks them
+    return conn.make_params(params or ())
+
+
+def _parse_step(conn, operation, types, cursor):
+    statement = core.convert_paramstyle(pg8000.paramstyle, operation)[0]
+    name = ('pg8000_statement_%d' % conn.statement_number).encode('ascii') + core.NULL_BYTE
+    conn.statement_number += 1
+    cursor.ps = {'row_desc': [], 'param_funcs': tuple(send_func for oid, fc, send_func in types)}
+
+    def send():
+        # Like pg8000, NULL parameters are declared as unknown
+        oids = ''.join(core.i_pack(705 if oid == -1 else oid) for oid, fc, send_func in types)
+        conn._send_message(core.PARSE, name + statement.encode(conn._client_encoding) + core.NULL_BYTE +
+                           core.h_pack(len(types)) + oids)
+        conn._send_message(core.DESCRIBE, core.STATEMENT + name)
+    return name, send
+
+
+def _complete_statement(conn, ps, name, types):
+    # The same as pg8000 sets up for a statement once it knows the result columns
+    output_fc = tuple(conn.pg_types[f['type_oid']][0] for f in ps['row_desc'])
+    param_fc = tuple(fc for oid, fc, send_func in types)
+    ps['input_funcs'] = tuple(f['func'] for f in ps['row_desc'])
+    ps['bind_1'] = (name + core.h_pack(len(param_fc)) + struct.pack('!' + 'h' * len(param_fc), *param_fc) +
+                    core.h_pack(len(param_fc)))
+    ps['bind_2'] = core.h_pack(len(output_fc)) + struct.pack('!' + 'h' * len(output_fc), *output_fc)
+
+
+def _execute_step(conn, ps, params):
+    def send():
+        data = bytearray(core.NULL_BYTE + ps['bind_1'])
+        for value, send_func in zip(params or (), ps['param_funcs']):
+            if value is None:
+                data.extend(core.NULL)
+            else:
+                value = send_func(value)
+                data.extend(core.i_pack(len(value)))
+                data.extend(value)
+        data.extend(ps['bind_2'])
+        conn._send_message(core.BIND, data)
+        conn._send_message(core.EXECUTE, _EXECUTE_UNNAMED)
+    return send
+
+
+def prepare(conn, operations, params=None):
+    """
+    Prepares the statements pg8000 hasn't on this connection yet, in one round-trip
+
+    params holds the parameters of each operation, or None. Returns a (ps, error) pair for each operation,
+    ps being pg8000's prepared statement. Its row_desc describes the result columns.
+    """
+    params = params or [None] * len(operations)
+    cache = conn._caches[pg8000.paramstyle]['ps']
+    types = [_param_types(conn, values) for values in params]
+    # pg8000 keeps statements by the types of their parameters and the operation
+    keys = [(tuple(oid for oid, fc, send_func in param_types), operation)
+            for param_types, operation in zip(types, operations)]
+    cursors = []
+    for key in keys:
+        cursor = conn.cursor()
+        cursor.ps = cache.get(key)
+        cursors.append(cursor)
+    errors = [None] * len(operations)
+
+    unprepared = [i for i, cursor in enumerate(cursors) if cursor.ps is None]
+    if unprepared:
+        names = {}
+        steps = []
+        conn._lock.acquire()
+        try:
+            for i in unprepared:
+                names[i], send = _parse_step(conn, operations[i], types[i], cursors[i])
+                steps.append((send, cursors[i]))
+            results = _run_isolated(conn, steps)
+        finally:
+            conn._lock.release()
+
+        for i, error in zip(unprepared, results):
+            if error is not None:
+                errors[i] = error
+                continue
+            _complete_statement(conn, cursors[i].ps, names[i], types[i])
+            cache[keys[i]] = cursors[i].ps
+
+    return [(None if error else cursor.ps, error) for cursor, error in zip(cursors, errors)]
+
+
+def run_pipelined(conn, operations, params=None):
+    """
+    Runs queries on a pg8000 connection without waiting for the result of one before sending the next
+
+    params holds the parameters of each operation, or None.
+    Statements pg8000 has prepared on this connection before cost one round-trip for all of them, others
+    need one more to find out their result columns first. An error only fails its own query. Returns a
+    (cursor, error) pair for each operation, the cursor holding all result rows if error is None.
+
+    All messages are written before any result is read. That can't deadlock on full socket buffers:
+    the round-trip that sends the query texts gets small responses, the one that gets the rows sends
+    only a few bytes per query.
+    """
+    cursors = []
+    errors = []
+    params = params or [None] * len(operations)
+    for ps, error in prepare(conn, operations, params):
+        cursor = conn.cursor()
+        cursor.ps = ps
+        cursors.append(cursor)
+        errors.append(error)
+
+    prepared = [i for i in range(len(operations)) if errors[i] is None]
+    steps = [(_execute_step(conn, cursors[i].ps, params[i]), cursors[i]) for i in prepared]
+    conn._lock.acquire()
+    try:
+        results = _run_isolated(conn, steps)
+    finally:
+        conn._lock.release()
+
+    for i, error in zip(prepared, results):
+        errors[i] = error
+    return zip(cursors, errors)
+
+
+def run_copy(conn, operation, stream):
+    """
+    Runs a COPY ... TO STDOUT, writing the data to stream as it arrives
+
+    Isolated like the queries of run_pipelined, in a single round-trip. Returns the error, or None.
+    """
+    statement = core.convert_paramstyle(pg8000.paramstyle, operation)[0]
+    cursor = conn.cursor()
+    cursor.stream = stream
+
+    conn._lock.acquire()
+    try:
+        return _run_isolated(conn, [(lambda: _send_command(conn, statement), cursor)])[0]
+    finally:
+        conn._lock.release()
+
+
+class QueryPlanner():
+    """
+    Stands in for a DB to find out which queries code is going to run, without running them
+
+    Queries return no rows, except cached ones (capability probes like the server version) which other
+    queries depend on, and which are run for real. Streaming queries (iter_query) are left out. Queries with
+    parameters are planned as (query, params) pairs, see DB.query_key.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.queries = []
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def run_query(self, query, should_raise=False, commit=False, cached=False, params=None):
+        if cached:
+            return self.db.run_query(query, should_raise, commit, cached, params)
+        key = self.db.query_key(query, params)
+        if not commit and key not in self.queries:
+            self.queries.append(key)
+        return []
+
+    def iter_query(self, query, batch_size=1000, params=None):
+        return iter([])
+
+    def bulk_query(self, query, stream=False, params=None):
+        if stream or self.db.bulk_copy:
+            return iter([]) if stream else []
+        return self.run_query(query, params=params)
+
+
+def planned_queries(db, sections, info_class):
+    """ Returns the queries the (name, callable) sections would run on an info_class(db), in order """
+    planner = QueryPlanner(db)
+    info = info_class(planner)
+    for name, fn in sections:
+        try:
+            fn(info)
+        except Exception as e:
+            # Post-processing that expects rows, the queries run so far are still known
+            logger.debug("Stopped planning queries of section %s: %s", name, e)
+    return planner.queries
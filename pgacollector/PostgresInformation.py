@@ -2,16 +2,61 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+def array_param(values):
+    """ Passes a list as a single query parameter, which the query casts to an array (like %s::oid[]) """
+    return '{%s}' % ','.join(str(value) for value in values)
+
+
+def oid_filter(oids, column='c.oid'):
+    """
+    Restricts a catalog query to the given relation oids, None means no restriction
+
+    Returns the condition and its query parameters.
+    """
+    if oids is None:
+        return "", []
+    if not oids:
+        return "AND FALSE", []
+    return "AND %s = ANY(%%s::oid[])" % column, [array_param(int(oid) for oid in oids)]
+
+
+def quote_ident(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def text_column(expression, name, known_hashes=None):
+    """
+    Selects a large text column, leaving it NULL if the server already knows it by its md5 hash
+
+    Returns the column and its query parameters.
+    """
+    if known_hashes is None:
+        return "%s AS %s" % (expression, name), []
+    return ("md5(%s) AS %s_hash, CASE WHEN md5(%s) = ANY(%%s::text[]) THEN NULL ELSE %s END AS %s" % (
+        expression, name, expression, expression, name), [array_param(known_hashes)])
+
+
+def timestamp_text(expression):
+    """ Formats a timestamptz like str() does for the UTC datetimes pg8000 returns, as the client engine sends them """
+    return ("pg_catalog.regexp_replace(pg_catalog.to_char(%s AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS.US'), "
+            "'[.]000000$', '') || '+00:00'" % expression)
+
+
 class PostgresInformation():
     def __init__(self, db):
         self.db = db
 
-    def relations(self, with_views):
+    def relations(self, with_views, estimated_sizes=False):
+        # pg_table_size() stat()s every file of the relation, relpages is what the last VACUUM/ANALYZE saw
+        if estimated_sizes:
+            size = "c.relpages::bigint * current_setting('block_size')::bigint"
+        else:
+            size = "pg_catalog.pg_table_size(c.oid)"
         query = """
         SELECT c.oid,
                n.nspname AS schema_name,
                c.relname AS table_name,
-               pg_catalog.pg_table_size(c.oid) AS size_bytes,
+               %s AS size_bytes,
                c.relkind AS relation_type,
                s.*,
                sio.*
@@ -23,11 +68,23 @@ class PostgresInformation():
                AND c.relpersistence <> 't'
                AND c.relname NOT IN ('pg_stat_statements')
                AND n.nspname NOT IN ('pg_catalog', 'information_schema')
-        """ % ("'r','v','m'" if with_views else "'r'")
+         ORDER BY c.oid
+        """ % (size, "'r','v','m'" if with_views else "'r'")
         result = self.db.run_query(query)
         return result
 
-    def columns(self, with_views):
+    def relation_sizes(self, oids):
+        condition, params = oid_filter(oids)
+        query = """
+        SELECT c.oid, pg_catalog.pg_table_size(c.oid) AS size_bytes
+          FROM pg_catalog.pg_class c
+         WHERE c.relkind IN ('r','v','m')
+               %s
+        """ % condition
+        return self.db.run_query(query, params=params)
+
+    def columns(self, with_views, oids=None):
+        condition, params = oid_filter(oids)
         query = """
         SELECT c.oid,
                a.attname AS name,
@@ -45,12 +102,15 @@ class PostgresInformation():
               AND n.nspname NOT IN ('pg_catalog', 'information_schema')
               AND a.attnum > 0
               AND NOT a.attisdropped
-        """ % ("'r','v','m'" if with_views else "'r'")
+              %s
+        ORDER BY c.oid, a.attnum
+        """ % ("'r','v','m'" if with_views else "'r'", condition)
 
-        result = self.db.run_query(query)
-        return result
+        # Usually the largest result by far, so it's streamed instead of fetched at once
+        return self.db.bulk_query(query, stream=True, params=params)
 
-    def indexes(self, with_views):
+    def indexes(self, with_views, oids=None):
+        condition, params = oid_filter(oids)
         query = """
         SELECT c.oid,
                c2.oid AS index_oid,
@@ -76,16 +136,66 @@ class PostgresInformation():
          WHERE c.relkind IN (%s)
                AND c.relpersistence <> 't'
                AND n.nspname NOT IN ('pg_catalog', 'information_schema')
-        """ % ("'r','v','m'" if with_views else "'r'")
+               %s
+         ORDER BY c.oid, c2.oid
+        """ % ("'r','v','m'" if with_views else "'r'", condition)
         #FIXME: column references for index expressions
 
-        result = self.db.run_query(query)
-        for row in result:
+        for row in self.db.bulk_query(query, stream=True, params=params):
             # We need to convert the Postgres legacy int2vector to an int[]
             row['columns'] = map(int, str(row['columns']).split())
-        return result
+            yield row
+
+    def index_stats(self, with_views):
+        # Statistics-only counterpart of indexes(), for relations whose definitions haven't changed
+        query = """
+        SELECT c.oid,
+               c2.oid AS index_oid,
+               c2.relname AS name,
+               pg_catalog.pg_relation_size(c2.oid) AS size_bytes,
+               s.idx_scan, s.idx_tup_read, s.idx_tup_fetch,
+               sio.idx_blks_read, sio.idx_blks_hit
+          FROM pg_catalog.pg_class c
+          JOIN pg_catalog.pg_namespace n ON (n.oid = c.relnamespace)
+          JOIN pg_catalog.pg_index i ON (c.oid = i.indrelid)
+          JOIN pg_catalog.pg_class c2 ON (i.indexrelid = c2.oid)
+          LEFT JOIN pg_stat_user_indexes s ON (s.indexrelid = c2.oid)
+          LEFT JOIN pg_statio_user_indexes sio ON (sio.indexrelid = c2.oid)
+         WHERE c.relkind IN (%s)
+               AND c.relpersistence <> 't'
+               AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+         ORDER BY c.oid, c2.oid
+        """ % ("'r','v','m'" if with_views else "'r'")
+        return self.db.run_query(query)
 
-    def constraints(self):
+    def relation_fingerprints(self, with_views):
+        # Any DDL on a relation touches at least one of these catalog rows, which changes their xmin
+        query = """
+        SELECT c.oid,
+               md5(concat_ws(':', c.xmin::text, c.relfilenode, c.relnatts,
+                 (SELECT count(*) || '/' || coalesce(sum(a.xmin::text::bigint), 0)
+                    FROM pg_catalog.pg_attribute a WHERE a.attrelid = c.oid AND a.attnum > 0),
+                 (SELECT count(*) || '/' || coalesce(sum(d.xmin::text::bigint), 0)
+                    FROM pg_catalog.pg_attrdef d WHERE d.adrelid = c.oid),
+                 (SELECT count(*) || '/' || coalesce(sum(i.xmin::text::bigint + ic.xmin::text::bigint), 0)
+                    FROM pg_catalog.pg_index i JOIN pg_catalog.pg_class ic ON (ic.oid = i.indexrelid)
+                   WHERE i.indrelid = c.oid),
+                 (SELECT count(*) || '/' || coalesce(sum(r.xmin::text::bigint), 0)
+                    FROM pg_catalog.pg_constraint r WHERE r.conrelid = c.oid),
+                 (SELECT count(*) || '/' || coalesce(sum(rw.xmin::text::bigint), 0)
+                    FROM pg_catalog.pg_rewrite rw WHERE rw.ev_class = c.oid)
+               )) AS fingerprint
+          FROM pg_catalog.pg_class c
+          LEFT JOIN pg_catalog.pg_namespace n ON (n.oid = c.relnamespace)
+         WHERE c.relkind IN (%s)
+               AND c.relpersistence <> 't'
+               AND c.relname NOT IN ('pg_stat_statements')
+               AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+        """ % ("'r','v','m'" if with_views else "'r'")
+        return dict((row['oid'], row['fingerprint']) for row in self.db.run_query(query))
+
+    def constraints(self, oids=None):
+        condition, params = oid_filter(oids)
         query = """
         SELECT c.oid,
                conname AS name,
@@ -101,22 +211,170 @@ class PostgresInformation():
           LEFT JOIN pg_catalog.pg_namespace n2 ON n2.oid = c2.relnamespace
          WHERE r.contype = 'f'
                AND n.nspname NOT IN ('pg_catalog', 'information_schema')
-        """
+               %s
+         ORDER BY c.oid, r.oid
+        """ % condition
         #FIXME: This probably misses check constraints and others?
-        return self.db.run_query(query)
+        return self.db.run_query(query, params=params)
 
-    def view_definitions(self):
+    def view_definitions(self, oids=None, known_hashes=None):
+        column, column_params = text_column('pg_catalog.pg_get_viewdef(c.oid)', 'view_definition', known_hashes)
+        condition, params = oid_filter(oids)
         query = """
         SELECT c.oid,
-               pg_catalog.pg_get_viewdef(c.oid) AS view_definition
+               %s
           FROM pg_catalog.pg_class c
           LEFT JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
          WHERE c.relkind IN ('v','m')
                AND c.relpersistence <> 't'
                AND c.relname NOT IN ('pg_stat_statements')
                AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+               %s
+         ORDER BY c.oid
+        """ % (column, condition)
+        return self.db.run_query(query, params=column_params + params)
+
+    def relation_stat_columns(self):
         """
-        return self.db.run_query(query)
+        Returns the columns of pg_stat_user_tables and pg_statio_user_tables, as (view alias, name, is_timestamp)
+        """
+        query = """
+        SELECT CASE WHEN attrelid = 'pg_catalog.pg_stat_user_tables'::regclass THEN 's' ELSE 'sio' END AS view,
+               attname AS name,
+               atttypid = 'pg_catalog.timestamptz'::pg_catalog.regtype AS is_timestamp
+          FROM pg_catalog.pg_attribute
+         WHERE attrelid IN ('pg_catalog.pg_stat_user_tables'::regclass, 'pg_catalog.pg_statio_user_tables'::regclass)
+               AND attnum > 0
+               AND NOT attisdropped
+         ORDER BY attrelid = 'pg_catalog.pg_stat_user_tables'::regclass DESC, attnum
+        """
+        return [(row['view'], row['name'], row['is_timestamp']) for row in self.db.run_query(query, cached=True)]
+
+    def schema_documents(self, with_views, with_bloat):
+        """
+        Returns one row per relation, with the record assemble_schema() would build for it as a JSON document
+
+        Postgres 9.4+. The documents are bytea, to be passed through without decoding them. Timestamps in
+        the statistics are formatted as text the way the client engine's JSON encoder formats them.
+        """
+        # Same statistics as relations() has, later views win like they do for duplicate names there
+        stat_columns = dict((name, (view, is_timestamp)) for view, name, is_timestamp in self.relation_stat_columns()
+                            if name not in ('relid', 'relname', 'schemaname'))
+        stats = ''
+        for name, (view, is_timestamp) in sorted(stat_columns.iteritems()):
+            column = '%s.%s' % (view, quote_ident(name))
+            if is_timestamp:
+                column = '%s AS %s' % (timestamp_text(column), quote_ident(name))
+            stats += column + ', '
+
+        if with_bloat:
+            bloat = "table_bloat AS (%s), index_bloat AS (%s)" % (self.table_bloat_query(), self.index_bloat_query())
+        else:
+            bloat = """table_bloat AS (SELECT NULL::oid AS oid, NULL::numeric AS wasted_bytes),
+            index_bloat AS (SELECT NULL::oid AS index_oid, NULL::numeric AS wasted_bytes)"""
+
+        fields = """
+                   'schema_name', n.nspname,
+                   'table_name', c.relname,
+                   'relation_type', c.relkind,
+                   'stats', (SELECT row_to_json(x)
+                               FROM (SELECT %s
+                                            pg_catalog.pg_table_size(c.oid) AS size_bytes,
+                                            tb.wasted_bytes) x),
+                   'columns', coalesce(rc.columns, '[]'),
+                   'indices', coalesce(ri.indices, '[]'),
+                   'constraints', coalesce(rco.constraints, '[]')""" % stats
+
+        # Every part is aggregated by relation in one go and joined, instead of being looked up per relation.
+        # View definitions are only part of the records of views.
+        query = """
+        WITH %s,
+        relation_oids AS (
+          SELECT c.oid
+            FROM pg_catalog.pg_class c
+            LEFT JOIN pg_catalog.pg_namespace n ON (n.oid = c.relnamespace)
+           WHERE c.relkind IN (%s)
+                 AND c.relpersistence <> 't'
+                 AND c.relname NOT IN ('pg_stat_statements')
+                 AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+        ),
+        relation_columns AS (
+          SELECT a.attrelid AS oid,
+                 json_agg(json_build_object(
+                   'name', a.attname,
+                   'data_type', pg_catalog.format_type(a.atttypid, a.atttypmod),
+                   'default_value', pg_catalog.pg_get_expr(d.adbin, d.adrelid),
+                   'not_null', a.attnotnull,
+                   'position', a.attnum) ORDER BY a.attnum) AS columns
+            FROM relation_oids r
+            JOIN pg_catalog.pg_attribute a ON (a.attrelid = r.oid)
+            LEFT JOIN pg_catalog.pg_attrdef d ON (d.adrelid = a.attrelid AND d.adnum = a.attnum AND a.atthasdef)
+           WHERE a.attnum > 0
+                 AND NOT a.attisdropped
+           GROUP BY a.attrelid
+        ),
+        relation_indices AS (
+          SELECT i.indrelid AS oid,
+                 json_agg(json_build_object(
+                   'columns', pg_catalog.string_to_array(i.indkey::text, ' ')::int[],
+                   'name', c2.relname,
+                   'size_bytes', pg_catalog.pg_relation_size(c2.oid),
+                   'is_primary', i.indisprimary,
+                   'is_unique', i.indisunique,
+                   'is_valid', i.indisvalid,
+                   'index_def', pg_catalog.pg_get_indexdef(i.indexrelid, 0, TRUE),
+                   'constraint_def', pg_catalog.pg_get_constraintdef(con.oid, TRUE),
+                   'idx_scan', s.idx_scan,
+                   'idx_tup_read', s.idx_tup_read,
+                   'idx_tup_fetch', s.idx_tup_fetch,
+                   'idx_blks_read', sio.idx_blks_read,
+                   'idx_blks_hit', sio.idx_blks_hit,
+                   'wasted_bytes', ib.wasted_bytes) ORDER BY c2.oid) AS indices
+            FROM relation_oids r
+            JOIN pg_catalog.pg_index i ON (i.indrelid = r.oid)
+            JOIN pg_catalog.pg_class c2 ON (i.indexrelid = c2.oid)
+            LEFT JOIN pg_catalog.pg_constraint con ON (conrelid = i.indrelid
+                                                       AND conindid = i.indexrelid
+                                                       AND contype IN ('p', 'u', 'x'))
+            LEFT JOIN pg_stat_user_indexes s ON (s.indexrelid = c2.oid)
+            LEFT JOIN pg_statio_user_indexes sio ON (sio.indexrelid = c2.oid)
+            LEFT JOIN index_bloat ib ON (ib.index_oid = c2.oid)
+           GROUP BY i.indrelid
+        ),
+        relation_constraints AS (
+          SELECT r.conrelid AS oid,
+                 json_agg(json_build_object(
+                   'name', r.conname,
+                   'constraint_def', pg_catalog.pg_get_constraintdef(r.oid, TRUE),
+                   'columns', r.conkey,
+                   'foreign_schema', n2.nspname,
+                   'foreign_table', c2.relname,
+                   'foreign_columns', r.confkey) ORDER BY r.oid) AS constraints
+            FROM relation_oids ro
+            JOIN pg_catalog.pg_constraint r ON (r.conrelid = ro.oid)
+            LEFT JOIN pg_catalog.pg_class c2 ON r.confrelid = c2.oid
+            LEFT JOIN pg_catalog.pg_namespace n2 ON n2.oid = c2.relnamespace
+           WHERE r.contype = 'f'
+           GROUP BY r.conrelid
+        )
+        SELECT c.oid,
+               pg_catalog.convert_to(CASE WHEN c.relkind IN ('v', 'm')
+                 THEN json_build_object(%s,
+                   'view_definition', pg_catalog.pg_get_viewdef(c.oid))
+                 ELSE json_build_object(%s)
+                 END::text, 'UTF8') AS document
+          FROM relation_oids r
+          JOIN pg_catalog.pg_class c ON (c.oid = r.oid)
+          LEFT JOIN pg_catalog.pg_namespace n ON (n.oid = c.relnamespace)
+          LEFT JOIN pg_catalog.pg_stat_user_tables s ON (s.relid = c.oid)
+          LEFT JOIN pg_catalog.pg_statio_user_tables sio ON (sio.relid = c.oid)
+          LEFT JOIN table_bloat tb ON (tb.oid = c.oid)
+          LEFT JOIN relation_columns rc ON (rc.oid = c.oid)
+          LEFT JOIN relation_indices ri ON (ri.oid = c.oid)
+          LEFT JOIN relation_constraints rco ON (rco.oid = c.oid)
+         ORDER BY c.oid
+        """ % (bloat, "'r','v','m'" if with_views else "'r'", fields, fields)
+        return self.db.bulk_query(query, stream=True)
 
     def triggers(self):
 
@@ -129,9 +387,21 @@ SELECT t.tgname, pg_catalog.pg_get_triggerdef(t.oid, true), t.tgenabled
 """
 
     def version(self):
-        return self.db.run_query("SELECT version()")[0]['version']
+        return self.db.run_query("SELECT version()", cached=True)[0]['version']
+
+    def databases(self):
+        query = """
+        SELECT oid, datname AS name
+          FROM pg_database
+         WHERE datallowconn AND NOT datistemplate
+         ORDER BY datname
+        """
+        return self.db.run_query(query)
 
     def table_bloat(self):
+        return self.db.run_query(self.table_bloat_query())
+
+    def table_bloat_query(self):
         # Based on https://github.com/pgexperts/pgx_scripts/blob/master/administration/table_bloat_check.sql
         # Original snippet is Copyright (c) 2014, PostgreSQL Experts, Inc.
         query = """
@@ -199,11 +469,14 @@ SELECT t.tgname, pg_catalog.pg_get_triggerdef(t.oid, true), t.tgenabled
           AND expected_bytes <= table_bytes
           THEN (table_bytes - expected_bytes)::NUMERIC
           ELSE 0::NUMERIC END AS wasted_bytes
-        FROM table_estimates;
+        FROM table_estimates
         """
-        return self.db.run_query(query)
+        return query
 
     def index_bloat(self):
+        return self.db.run_query(self.index_bloat_query())
+
+    def index_bloat_query(self):
         # Based on https://github.com/pgexperts/pgx_scripts/blob/master/administration/index_bloat_check.sql
         # Original snippet is Copyright (c) 2014, PostgreSQL Experts, Inc.
         query = """
@@ -223,7 +496,7 @@ SELECT t.tgname, pg_catalog.pg_get_triggerdef(t.oid, true), t.tgenabled
                  i.reltuples,
                  i.relpages,
                  i.relam,
-                 (quote_ident(s.schemaname) || '.' || quote_ident(s.tablename))::regclass AS starelid,
+                 a.attrelid AS starelid,
                  a.attrelid AS table_oid,
                  index_oid,
                  current_setting('block_size')::numeric AS bs,
@@ -237,7 +510,9 @@ SELECT t.tgname, pg_catalog.pg_get_triggerdef(t.oid, true), t.tgenabled
                  /* data len: we remove null values save space using it fractionnal part from stats */
                  sum( (1 - coalesce(s.null_frac, 0)) * coalesce(s.avg_width, 1024) ) AS nulldatawidth
             FROM pg_attribute a
-            JOIN pg_stats s ON (quote_ident(s.schemaname) || '.' || quote_ident(s.tablename))::regclass = a.attrelid AND s.attname = a.attname
+            JOIN pg_class sc ON sc.oid = a.attrelid
+            JOIN pg_namespace sn ON sn.oid = sc.relnamespace
+            JOIN pg_stats s ON s.schemaname = sn.nspname AND s.tablename = sc.relname AND s.attname = a.attname
             JOIN btree_index_atts i ON i.indrelid = a.attrelid AND a.attnum = i.attnum
            WHERE a.attnum > 0
            GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
@@ -283,8 +558,43 @@ SELECT t.tgname, pg_catalog.pg_get_triggerdef(t.oid, true), t.tgenabled
              JOIN pg_class AS c ON c.oid = sub.table_oid
              JOIN pg_stat_user_indexes AS stat ON sub.index_oid = stat.indexrelid
         """
+        return query
+
+    def bloat_relation_sizes(self):
+        # Cheap inputs for BloatEstimator, needed for all relations on every run
+        query = """
+        SELECT c.oid, NULL::oid AS table_oid, NULL AS indkey, c.reltuples, c.relpages,
+               current_setting('block_size')::int AS block_size
+          FROM pg_class c
+          JOIN pg_namespace n ON n.oid = c.relnamespace
+         WHERE c.relkind = 'r'
+               AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+        UNION ALL
+        SELECT c.oid, i.indrelid, i.indkey::text, c.reltuples, c.relpages,
+               current_setting('block_size')::int
+          FROM pg_index i
+          JOIN pg_class c ON c.oid = i.indexrelid
+          JOIN pg_am am ON am.oid = c.relam
+          JOIN pg_stat_user_indexes s ON s.indexrelid = i.indexrelid
+         WHERE am.amname = 'btree' AND c.relpages > 0
+        """
         return self.db.run_query(query)
 
+    def bloat_column_stats(self, oids):
+        # Expensive inputs for BloatEstimator: pg_stats for the columns of the given tables
+        condition, params = oid_filter(oids)
+        query = """
+        SELECT a.attrelid AS oid, a.attnum, s.null_frac, s.avg_width
+          FROM pg_attribute a
+          JOIN pg_class c ON c.oid = a.attrelid
+          JOIN pg_namespace n ON n.oid = c.relnamespace
+          LEFT JOIN pg_stats s ON s.schemaname = n.nspname AND s.tablename = c.relname AND s.attname = a.attname
+         WHERE a.attnum > 0
+               AND NOT a.attisdropped
+               %s
+        """ % condition
+        return self.db.run_query(query, params=params)
+
     def bgwriter_stats(self):
         query = "SELECT * FROM pg_stat_bgwriter"
         return self.db.run_query(query)
@@ -318,7 +628,7 @@ SELECT t.tgname, pg_catalog.pg_get_triggerdef(t.oid, true), t.tgenabled
           JOIN pg_namespace ON (pronamespace = pg_namespace.oid)
          WHERE nspname = 'pganalyze' AND proname = 'get_stat_activity'
         """
-        return self.db.run_query(query) == [{"enabled": 1}]
+        return self.db.run_query(query, cached=True) == [{"enabled": 1}]
 
     def backends(self):
         # http://www.postgresql.org/docs/devel/static/monitoring-stats.html#PG-STAT-ACTIVITY-VIEW
@@ -414,12 +724,74 @@ SELECT t.tgname, pg_catalog.pg_get_triggerdef(t.oid, true), t.tgenabled
 
         return self.db.run_query(query)
 
-    def functions(self):
+    def lock_counts(self):
+        query = """
+        SELECT n.nspname AS schema,
+               c.relname AS relation,
+               l.locktype,
+               l.mode,
+               l.granted,
+               count(*) AS count
+        FROM pg_locks l
+        LEFT JOIN pg_catalog.pg_class c ON l.relation = c.oid
+        LEFT JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_catalog.pg_database d ON d.oid = l.database
+        WHERE l.pid <> pg_backend_pid() AND
+              (d.datname IS NULL OR d.datname = current_database())
+        GROUP BY 1, 2, 3, 4, 5
+        """
+        return self.db.run_query(query)
+
+    def contended_locks(self):
+        # Only locks on objects somebody is waiting for, lock_key identifies the locked object
+        if self.db.version_numeric >= 90600:
+            blocked_by = "CASE WHEN NOT l.granted THEN pg_catalog.pg_blocking_pids(l.pid) END"
+        else:
+            blocked_by = "NULL::int[]"
+        # Before 14 the wait is measured from the start of the waiting statement. Waits can have started after
+        # our transaction, so they are measured up to clock_timestamp() instead of now().
+        wait_start = "l.waitstart" if self.db.version_numeric >= 140000 else "a.query_start"
+
+        query = """
+        WITH l AS (
+          SELECT *,
+                 concat_ws(':', locktype, coalesce(database, 0), coalesce(relation, 0), coalesce(page, -1),
+                           coalesce(tuple, -1), coalesce(virtualxid, ''), coalesce(transactionid::text, ''),
+                           coalesce(classid, 0), coalesce(objid, 0), coalesce(objsubid, -1)) AS lock_key
+            FROM pg_locks
+        )
+        SELECT n.nspname AS schema,
+               c.relname AS relation,
+               l.locktype,
+               l.page,
+               l.tuple,
+               l.virtualxid,
+               l.transactionid::text,
+               l.virtualtransaction,
+               l.pid,
+               l.mode,
+               l.granted,
+               l.lock_key,
+               %s AS blocked_by,
+               CASE WHEN NOT l.granted THEN extract(epoch FROM clock_timestamp() - %s)::float END AS wait_seconds
+        FROM l
+        LEFT JOIN pg_catalog.pg_class c ON l.relation = c.oid
+        LEFT JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_catalog.pg_database d ON d.oid = l.database
+        LEFT JOIN pg_catalog.pg_stat_activity a ON a.pid = l.pid
+        WHERE l.pid <> pg_backend_pid() AND
+              (d.datname IS NULL OR d.datname = current_database()) AND
+              l.lock_key IN (SELECT lock_key FROM l WHERE NOT granted)
+        """ % (blocked_by, wait_start)
+        return self.db.run_query(query)
+
+    def functions(self, known_hashes=None):
+        column, params = text_column('pp.prosrc', 'source', known_hashes)
         query = """
         SELECT pn.nspname AS schema_name,
                pp.proname AS function_name,
                pl.lanname AS language,
-               pp.prosrc AS source,
+               %s,
                pp.probin AS source_bin,
                pp.proconfig AS config,
                pg_get_function_arguments(pp.oid) AS arguments,
@@ -441,5 +813,5 @@ SELECT t.tgname, pg_catalog.pg_get_triggerdef(t.oid, true), t.tgenabled
          WHERE pl.lanname != 'internal'
                AND pn.nspname NOT IN ('pg_catalog', 'information_schema')
                AND pp.proname NOT IN ('pg_stat_statements', 'pg_stat_statements_reset')
-        """
-        return self.db.run_query(query)
+        """ % column
+        return self.db.bulk_query(query, params=params)
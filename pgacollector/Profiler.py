@@ -0,0 +1,175 @@
+import logging
+import os
+import sys
+import time
+import threading
+import resource
+import cProfile
+
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Phases of a run that happen after the snapshot has been assembled
+UPLOAD_PHASES = ('encode', 'compress', 'upload')
+
+
+def peak_rss_bytes():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def result_bytes(rows):
+    """ Rough size of a result as returned by the driver, numbers and other values count as 8 bytes """
+    size = 0
+    for row in rows:
+        for value in row:
+            size += len(value) if isinstance(value, basestring) else 8
+    return size
+
+
+class Profiler():
+    """
+    Collects timings of the collector itself, sent as the collector_stats section of each snapshot
+
+    Sections are the individual PostgresInformation/SystemInformation/PgStatStatements calls, queries
+    run while a section is active (in any thread) are attributed to it. Phases are the larger steps of
+    a run, their times exclude nested phases. Encoding and upload happen after the snapshot is built,
+    so their timings are sent with the next snapshot of the same process.
+
+    With profile_dir set, each phase is also profiled with cProfile and written there as a pstats file.
+    """
+
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.previous_upload = None
+        self.start(None)
+
+    def start(self, collected_at):
+        if collected_at is not None and self.collected_at is not None:
+            self.previous_upload = dict((name, self.phases[name]) for name in UPLOAD_PHASES if name in self.phases)
+        self.collected_at = collected_at
+        self.sections = {}
+        self.phases = {}
+
+    def _section_stats(self, name):
+        stats = self.sections.get(name)
+        if stats is None:
+            stats = self.sections[name] = {'wall_time': 0.0, 'server_time': 0.0, 'queries': 0, 'rows': 0, 'bytes': 0}
+        return stats
+
+    @contextmanager
+    def section(self, name):
+        previous = getattr(self.local, 'section', None)
+        self.local.section = name
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start_time
+            self.local.section = previous
+            with self.lock:
+                self._section_stats(name)['wall_time'] += elapsed
+
+    def iter_section(self, name, iterable):
+        """ Attributes the work done while consuming iterable (e.g. a streaming query result) to a section """
+        iterator = iter(iterable)
+        elapsed = 0.0
+        try:
+            while True:
+                previous = getattr(self.local, 'section', None)
+                self.local.section = name
+                start_time = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.time() - start_time
+                    self.local.section = previous
+                yield item
+        finally:
+            with self.lock:
+                self._section_stats(name)['wall_time'] += elapsed
+
+    def record_query(self, server_time, rows, size=None):
+        """
+        Called by DB for every query, with the time spent waiting for Postgres and the raw result rows
+
+        size is the size of the result on the wire (pg8000). Without it, it's estimated from the rows, but
+        only with profile_dir, as that goes through every value.
+        """
+        if size is None:
+            size = result_bytes(rows) if self.profile_dir else 0
+        with self.lock:
+            stats = self._section_stats(getattr(self.local, 'section', None) or 'other')
+            stats['server_time'] += server_time
+            stats['queries'] += 1
+            stats['rows'] += len(rows)
+            stats['bytes'] += size
+
+    def _begin(self):
+        stack = getattr(self.local, 'phases', None)
+        if stack is None:
+            stack = self.local.phases = []
+        stack.append(0.0)
+        return time.time()
+
+    def _end(self, name, start_time):
+        elapsed = time.time() - start_time
+        stack = self.local.phases
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed - nested
+
+    @contextmanager
+    def phase(self, name):
+        profile = None
+        if self.profile_dir:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        start_time = self._begin()
+        try:
+            yield
+        finally:
+            self._end(name, start_time)
+            if profile:
+                profile.disable()
+                self._dump(profile, name)
+
+    def iter_phase(self, name, iterable):
+        """ Like phase, for the time spent producing the items of iterable (e.g. encoding a streamed upload) """
+        iterator = iter(iterable)
+        while True:
+            start_time = self._begin()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._end(name, start_time)
+            yield item
+
+    def _dump(self, profile, name):
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        path = os.path.join(self.profile_dir, "%s-%s.pstats" % (self.collected_at, name))
+        profile.dump_stats(path)
+        logger.debug("Wrote profile of %s to %s", name, path)
+
+    def stats(self):
+        with self.lock:
+            result = {
+                'sections': dict((name, dict(stats)) for name, stats in self.sections.iteritems()),
+                'phases': dict(self.phases),
+                'peak_rss_bytes': peak_rss_bytes(),
+            }
+        if self.previous_upload:
+            result['previous_upload'] = self.previous_upload
+        return result
@@ -0,0 +1,113 @@
+import struct
+
+# Result columns pg8000 receives in binary format with a fixed size, by type oid
+FIXED_SIZE_TYPES = {
+    16: '?',   # bool
+    20: 'q',   # int8
+    21: 'h',   # int2
+    23: 'i',   # int4
+    26: 'I',   # oid
+    28: 'I',   # xid
+    700: 'f',  # float4
+    701: 'd',  # float8
+}
+
+FC_BINARY = 1
+
+_length = struct.Struct('!i').unpack_from
+_uint = struct.Struct('!I').unpack_from
+
+
+def uint4_recv(data, offset, length):
+    return _uint(data, offset)[0]
+
+
+def numeric_float_in(data, offset, length):
+    # JSON has no decimals anyway, so numerics go straight to float instead of through Decimal
+    return float(data[offset:offset + length])
+
+
+def compile_row_decoder(row_desc, input_funcs, with_end=False):
+    """
+    Returns a function that decodes the DataRow messages of a result into lists of values
+
+    Consecutive fixed-size binary columns are unpacked together by one precompiled struct, lengths
+    included. If one of them is NULL the lengths don't match, and that run is decoded field by
+    field like pg8000 does for all columns.
+
+    The function takes the offset of the first field as well, with_end makes it return the offset
+    after the last field along with the values.
+    """
+    segments = []
+    run = []
+
+    def close_run():
+        if run:
+            codes = [code for code, _ in run]
+            unpacker = struct.Struct('!' + ''.join('i' + code for code in codes))
+            lengths = tuple(struct.calcsize('!' + code) for code in codes)
+            segments.append((unpacker.unpack_from, unpacker.size, lengths, [func for _, func in run]))
+            del run[:]
+
+    for field, func in zip(row_desc, input_funcs):
+        code = FIXED_SIZE_TYPES.get(field['type_oid'])
+        if code and field['pg8000_fc'] == FC_BINARY:
+            run.append((code, func))
+            continue
+        close_run()
+        if segments and segments[-1][0] is None:
+            segments[-1][3].append(func)
+        else:
+            segments.append((None, 0, None, [func]))
+    close_run()
+
+    def decode(data, idx=2):
+        row = []
+        append = row.append
+        for unpack_from, size, lengths, funcs in segments:
+            if unpack_from is not None:
+                try:
+                    values = unpack_from(data, idx)
+                except struct.error:
+                    values = None
+                if values is not None and values[::2] == lengths:
+                    row.extend(values[1::2])
+                    idx += size
+                    continue
+
+            for func in funcs:
+                vlen = _length(data, idx)[0]
+                idx += 4
+                if vlen == -1:
+                    append(None)
+                else:
+                    append(func(data, idx, vlen))
+                    idx += vlen
+        if with_end:
+            return row, idx
+        return row
+
+    return decode
+
+
+def install(conn, data_row_code):
+    """
+    Switches a pg8000 connection to the fast decoding path
+
+    oid and xid columns are requested in binary format, numerics are converted to float without
+    Decimal, and DataRow messages are decoded by a decoder compiled once per prepared statement.
+    The sizes of the DataRow messages are summed up in the cursor's received_bytes.
+    """
+    conn.pg_types[26] = (FC_BINARY, uint4_recv)
+    conn.pg_types[28] = (FC_BINARY, uint4_recv)
+    conn.pg_types[1700] = (conn.pg_types[1700][0], numeric_float_in)
+
+    def handle_data_row(data, cursor):
+        ps = cursor.ps
+        decode = ps.get('row_decoder')
+        if decode is None:
+            decode = ps['row_decoder'] = compile_row_decoder(ps['row_desc'], ps['input_funcs'])
+        cursor._cached_rows.append(decode(data))
+        cursor.received_bytes = getattr(cursor, 'received_bytes', 0) + len(data)
+
+    conn.message_types[data_row_code] = handle_data_row
@@ -0,0 +1,46 @@
+import logging
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler():
+    """
+    Runs a job at fixed wall clock intervals, similar to a */N crontab entry
+
+    Runs that take longer than the interval skip the slots they overlapped instead of piling up.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def install_signal_handlers(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        logger.info("Received signal %d, stopping after current run", signum)
+        self.stop()
+
+    def stop(self):
+        self.stopped.set()
+
+    def next_run_after(self, timestamp):
+        return (int(timestamp) // self.interval + 1) * self.interval
+
+    def run_forever(self, job):
+        while not self.stopped.is_set():
+            job()
+
+            next_run = self.next_run_after(time.time())
+            logger.debug("Next run scheduled at %s", time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_run)))
+
+            while not self.stopped.is_set():
+                remaining = next_run - time.time()
+                if remaining <= 0:
+                    break
+                # Wake up regularly so signals get handled in a timely manner
+                self.stopped.wait(min(remaining, 1.0))
@@ -0,0 +1,94 @@
+import operator
+
+RELATION_FIELDS = ('schema_name', 'table_name', 'relation_type')
+
+# Columns of a relations() row that aren't statistics
+NON_STAT_FIELDS = frozenset(('oid', 'relid', 'relname', 'schemaname') + RELATION_FIELDS)
+
+
+def projection(keys):
+    """ Returns a function that copies keys out of a row into a new dict """
+    keys = tuple(keys)
+    if not keys:
+        return lambda row: {}
+    getter = operator.itemgetter(*keys)
+    if len(keys) == 1:
+        return lambda row: {keys[0]: getter(row)}
+    return lambda row: dict(zip(keys, getter(row)))
+
+
+class SortedRows(object):
+    """ Rows sorted by oid, handed out one relation at a time """
+    __slots__ = ('rows', 'head', 'head_oid')
+
+    def __init__(self, rows):
+        self.rows = iter(rows or ())
+        self.head = None
+        self.head_oid = None
+        for row in self.rows:
+            self.head, self.head_oid = row, row.pop('oid')
+            break
+
+    def take(self, oid):
+        """ Returns the rows of oid without their oid, skipping rows of smaller oids that have no relation """
+        rows = []
+        head, head_oid = self.head, self.head_oid
+        while head is not None and head_oid <= oid:
+            if head_oid == oid:
+                rows.append(head)
+            head = next(self.rows, None)
+            if head is not None:
+                head_oid = head.pop('oid')
+        self.head, self.head_oid = head, head_oid
+        return rows
+
+
+def assemble_schema(relations, columns=None, indexes=None, constraints=None, index_stats=None,
+                    view_definitions=None, table_bloat=None, index_bloat=None, unchanged_since=None):
+    """
+    Merges the per-relation query results into one record per relation, yielding them in oid order
+
+    All results have to be sorted by oid. They are merged in a single pass, so streamed results
+    are consumed alongside each other, and every record is complete once it has been yielded.
+    table_bloat and index_bloat map oids to wasted bytes, unchanged_since(oid) returns when the
+    definitions of a relation were last sent, or None if they are sent with this record.
+    """
+    table_bloat = table_bloat or {}
+    index_bloat = index_bloat or {}
+    columns = SortedRows(columns)
+    indexes = SortedRows(indexes)
+    constraints = SortedRows(constraints)
+    index_stats = SortedRows(index_stats)
+    view_definitions = SortedRows(view_definitions)
+
+    relation_fields = projection(RELATION_FIELDS)
+    stats = None
+
+    for row in relations:
+        if stats is None:
+            # All rows of a result have the same columns
+            stats = projection(key for key in row.keys() if key not in NON_STAT_FIELDS)
+
+        oid = row['oid']
+        record = relation_fields(row)
+        record['stats'] = stats(row)
+        record['stats']['wasted_bytes'] = table_bloat.get(oid)
+
+        since = unchanged_since(oid) if unchanged_since else None
+        if since:
+            # Definitions were sent with an earlier snapshot, only statistics follow
+            record['unchanged_since'] = since
+            record['indices'] = index_stats.take(oid)
+        else:
+            record['columns'] = columns.take(oid)
+            record['indices'] = indexes.take(oid)
+            record['constraints'] = constraints.take(oid)
+            index_stats.take(oid)
+
+        for index in record['indices']:
+            index['wasted_bytes'] = index_bloat.get(index.pop('index_oid'))
+
+        for definition in view_definitions.take(oid):
+            record.update(definition)
+
+        yield record
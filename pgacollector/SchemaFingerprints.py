@@ -0,0 +1,71 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Send all definitions at least this often, even if nothing changed
+FULL_SCHEMA_INTERVAL = 24 * 60 * 60
+
+
+class SchemaFingerprints():
+    """
+    Tracks which relation definitions the server already knows about
+
+    State maps each relation oid to its last sent fingerprint and the collected_at
+    timestamp of the snapshot that carried the full definition. It is only
+    committed once that snapshot has been submitted successfully.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.data = state.load('schema_fingerprints')
+        self.pending = None
+        self.collected_at = None
+
+    def changed_oids(self, fingerprints, collected_at):
+        """
+        Returns the set of relation oids whose definitions need to be sent, or None if all of them do
+        """
+        known = self.data.get('relations', {})
+        self.collected_at = collected_at
+
+        if 'last_full' not in self.data or collected_at - self.data['last_full'] >= FULL_SCHEMA_INTERVAL:
+            logger.debug("Sending full schema definitions")
+            self.pending = {'last_full': collected_at, 'relations': {}}
+            changed = None
+        else:
+            self.pending = {'last_full': self.data['last_full'], 'relations': {}}
+            changed = set(oid for oid, fingerprint in fingerprints.iteritems()
+                          if known.get(str(oid), [None])[0] != fingerprint)
+            logger.debug("Definitions changed for %d of %d relations", len(changed), len(fingerprints))
+
+        for oid, fingerprint in fingerprints.iteritems():
+            if changed is None or oid in changed:
+                self.pending['relations'][str(oid)] = [fingerprint, collected_at]
+            else:
+                self.pending['relations'][str(oid)] = known[str(oid)]
+
+        return changed
+
+    def fingerprinted(self, oid):
+        """ Whether the relation existed when the fingerprints were taken """
+        return str(oid) in self.pending['relations']
+
+    def unchanged_since(self, oid):
+        """ Returns when the definitions of a relation were last sent, or None if they are part of this snapshot """
+        entry = self.pending['relations'].get(str(oid))
+        if entry is None or entry[1] == self.collected_at:
+            return None
+        return entry[1]
+
+    def forget(self):
+        """ Forgets all fingerprints, so the next snapshot carries all definitions """
+        self.data = {}
+        self.state.save('schema_fingerprints', self.data)
+
+    def commit(self):
+        if self.pending is None:
+            return
+
+        self.state.save('schema_fingerprints', self.pending)
+        self.data = self.pending
+        self.pending = None
@@ -0,0 +1,73 @@
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Statistics of a relations() row that change with writes to the relation, size_bytes being estimated from relpages
+CHANGE_FIELDS = ('size_bytes', 'n_tup_ins', 'n_tup_upd', 'n_tup_del')
+
+
+def _signature(row):
+    return [row.get(field) for field in CHANGE_FIELDS]
+
+
+class SizeCache():
+    """
+    Keeps relation sizes between runs, so pg_table_size() only stat()s the files of relations being written to
+
+    Takes relations() rows with sizes estimated from relpages. Relations whose write counters or relpages
+    changed since their size was last measured are measured again. Unchanged ones keep their measured size
+    for up to ttl seconds. Afterwards, and for relations never measured, each run measures a share of them
+    so all are measured once per ttl, the others keep their last or estimated size. size_estimated marks
+    sizes that weren't measured within ttl.
+    """
+
+    def __init__(self, state, ttl, interval):
+        self.state = state
+        self.ttl = ttl
+        self.interval = interval
+        self.data = state.load('relation_sizes')
+
+    def _oids_to_measure(self, relations, collected_at):
+        changed = set()
+        stale = []
+        for oid, row in relations.iteritems():
+            cached = self.data.get(str(oid))
+            if cached is None:
+                stale.append((None, oid))
+            elif cached[2] != _signature(row):
+                changed.add(oid)
+            elif collected_at - cached[0] >= self.ttl:
+                stale.append((cached[0], oid))
+
+        if self.ttl <= self.interval:
+            return changed | set(oid for measured_at, oid in stale)
+
+        # Never measured first, then the oldest measurements
+        share = int(math.ceil(len(relations) * float(self.interval) / self.ttl))
+        stale.sort(key=lambda entry: -1 if entry[0] is None else entry[0])
+        return changed | set(oid for measured_at, oid in stale[:share])
+
+    def apply(self, PI, relations, collected_at):
+        """ Sets size_bytes and size_estimated of the relations() rows, measuring the sizes that need it """
+        by_oid = dict((row['oid'], row) for row in relations)
+        measure = self._oids_to_measure(by_oid, collected_at)
+        logger.debug("Measuring the size of %d of %d relations", len(measure), len(by_oid))
+
+        sizes = {}
+        if measure:
+            sizes = dict((row['oid'], row['size_bytes']) for row in PI.relation_sizes(measure))
+
+        data = {}
+        for oid, row in by_oid.iteritems():
+            cached = self.data.get(str(oid))
+            if oid in sizes:
+                cached = [collected_at, sizes[oid], _signature(row)]
+            if cached is not None:
+                data[str(oid)] = cached
+                row['size_bytes'] = cached[1]
+            row['size_estimated'] = cached is None or collected_at - cached[0] >= self.ttl
+
+        # Sizes don't describe anything the server knows about, so they can be kept even if the upload fails
+        self.data = data
+        self.state.save('relation_sizes', self.data)
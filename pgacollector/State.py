@@ -0,0 +1,50 @@
+import logging
+import json
+import os
+import re
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class State():
+    """
+    Small JSON documents persisted between collector runs
+
+    Each monitored database gets its own set of files, one per component.
+    """
+
+    def __init__(self, directory, server_key):
+        self.directory = directory
+        self.server_key = re.sub(r'[^A-Za-z0-9_.-]', '_', server_key)
+
+    @staticmethod
+    def server_key_for(dbconf):
+        return "%s_%s_%s" % (dbconf['host'] or 'local', dbconf['port'] or 5432, dbconf['dbname'])
+
+    def path(self, component):
+        return os.path.join(self.directory, "%s.%s.json" % (self.server_key, component))
+
+    def load(self, component):
+        try:
+            with open(self.path(component), 'r') as f:
+                return json.load(f)
+        except IOError:
+            return {}
+        except ValueError as e:
+            logger.warning("Ignoring corrupt state file %s: %s", self.path(component), e)
+            return {}
+
+    def save(self, component, data):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0700)
+
+        # Write to a temporary file first so a crash never leaves a half-written state file behind
+        fd, tmppath = tempfile.mkstemp(dir=self.directory, prefix='.' + component)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.rename(tmppath, self.path(component))
+        except Exception:
+            os.unlink(tmppath)
+            raise
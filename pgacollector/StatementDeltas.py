@@ -0,0 +1,103 @@
+import logging
+import hashlib
+
+logger = logging.getLogger(__name__)
+
+IDENTIFYING_COLUMNS = set(['userid', 'dbid', 'queryid'])
+
+# Gauges and derived values that can't be subtracted from each other
+NON_CUMULATIVE_COLUMNS = set([
+    'min_time', 'max_time', 'mean_time', 'stddev_time',
+    'min_exec_time', 'max_exec_time', 'mean_exec_time', 'stddev_exec_time',
+    'min_plan_time', 'max_plan_time', 'mean_plan_time', 'stddev_plan_time',
+])
+
+
+def entry_key(row):
+    # queryid only exists on 9.4+, older versions identify entries by their query text
+    queryid = row.get('queryid')
+    if queryid is None:
+        queryid = hashlib.md5(row['query'].encode('utf-8')).hexdigest()
+    return "%s:%s:%s" % (row['userid'], row['dbid'], queryid)
+
+
+def counter_columns(row):
+    return sorted(k for k, v in row.iteritems()
+                  if k not in IDENTIFYING_COLUMNS and k not in NON_CUMULATIVE_COLUMNS
+                  and isinstance(v, (int, long, float)) and not isinstance(v, bool))
+
+
+class StatementDeltas():
+    """
+    Turns cumulative pg_stat_statements counters into per-interval deltas
+
+    The counters seen during the last successfully submitted run are kept as state,
+    keyed by (userid, dbid, queryid). Entries that weren't called in the interval are
+    dropped. Counters going backwards mean the entry was evicted and re-added, or
+    pg_stat_statements_reset() was called, in which case the current values are the delta.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.data = state.load('statement_counters')
+        self.pending = None
+        self.summary = None
+
+    def apply(self, rows, collected_at):
+        previous = self.data.get('entries', {})
+        previous_columns = self.data.get('columns', [])
+
+        columns = counter_columns(rows[0]) if rows else previous_columns
+        current = {}
+        result = []
+        decreased = 0
+
+        for row in rows:
+            key = entry_key(row)
+            values = [row[k] or 0 for k in columns]
+            current[key] = values
+
+            old = previous.get(key)
+            if old is None or previous_columns != columns:
+                if not previous:
+                    # First run, we have no baseline to compare to yet
+                    continue
+                delta = values
+            elif any(new < before for new, before in zip(values, old)):
+                decreased += 1
+                delta = values
+            else:
+                delta = [new - before for new, before in zip(values, old)]
+
+            if delta[columns.index('calls')] == 0:
+                continue
+
+            row.update(zip(columns, delta))
+            result.append(row)
+
+        evicted = len(set(previous) - set(current))
+        reset = bool(previous) and evicted + decreased == len(previous)
+        if reset:
+            logger.debug("pg_stat_statements was reset since the last run")
+        elif evicted:
+            logger.debug("%d pg_stat_statements entries were evicted since the last run", evicted)
+
+        self.summary = {
+            'interval_start': self.data.get('collected_at'),
+            'interval_end': collected_at,
+            'reset_detected': reset,
+            'evicted_entries': evicted,
+            'total_entries': len(current),
+            'active_entries': len(result),
+        }
+        self.pending = {'collected_at': collected_at, 'columns': columns, 'entries': current}
+
+        return result
+
+    def commit(self):
+        if self.pending is None:
+            return
+
+        self.state.save('statement_counters', self.pending)
+        self.data = self.pending
+        self.pending = None
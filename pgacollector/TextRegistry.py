@@ -0,0 +1,97 @@
+import logging
+import hashlib
+
+logger = logging.getLogger(__name__)
+
+# Forget texts that haven't been referenced for this long, so the registry doesn't grow forever
+TEXT_RETENTION = 30 * 24 * 60 * 60
+
+
+def text_hash(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.md5(text).hexdigest()
+
+
+class TextRegistry():
+    """
+    Content-addressed store of large texts (query texts, function sources, view definitions)
+
+    Each text is sent in full once, afterwards snapshots only reference it by its md5 hash.
+    Texts are kept with their kind (query, source, view_definition), so the queries for one kind
+    only need to compare against the hashes of that kind.
+    pg_stat_statements entries additionally remember which hash belongs to which queryid,
+    so their texts don't have to be fetched from Postgres again. Changes are committed
+    once the snapshot carrying the new texts was submitted successfully.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.data = state.load('text_registry')
+        self.data.setdefault('texts', {})
+        self.data.setdefault('queryids', {})
+        self.start(None)
+
+    def start(self, collected_at):
+        self.collected_at = collected_at
+        self.new_texts = {}
+        self.referenced = {}
+        self.queryids = {}
+
+    def known_hashes(self, kind):
+        return [h for h, entry in self.data['texts'].iteritems() if entry[2:] == [kind]]
+
+    def is_ignored(self, queryid_key):
+        # Queries we filter out (our own, DEALLOCATE, ...) are remembered with an empty hash
+        entry = self.data['queryids'].get(queryid_key)
+        if entry is not None and entry[0] is None:
+            self.ignore(queryid_key)
+            return True
+        return False
+
+    def hash_for_queryid(self, queryid_key):
+        entry = self.data['queryids'].get(queryid_key)
+        return entry[0] if entry else None
+
+    def ignore(self, queryid_key):
+        self.queryids[queryid_key] = None
+
+    def add(self, text, queryid_key=None, kind='query'):
+        h = text_hash(text)
+        if h not in self.data['texts']:
+            self.new_texts[h] = text
+        self.reference(h, queryid_key, kind)
+        return h
+
+    def reference(self, h, queryid_key=None, kind='query'):
+        self.referenced[h] = kind
+        if queryid_key is not None:
+            self.queryids[queryid_key] = h
+
+    def forget(self):
+        """ Forgets all texts, so the next snapshot carries every text it references in full """
+        self.data = {'texts': {}, 'queryids': {}}
+        self.state.save('text_registry', self.data)
+
+    def commit(self):
+        if self.collected_at is None:
+            return
+
+        texts = self.data['texts']
+        for h, kind in self.referenced.iteritems():
+            texts[h] = [texts.get(h, [self.collected_at])[0], self.collected_at, kind]
+
+        queryids = self.data['queryids']
+        for key, h in self.queryids.iteritems():
+            queryids[key] = [h, self.collected_at]
+
+        expire_before = self.collected_at - TEXT_RETENTION
+        for h, entry in texts.items():
+            if entry[1] < expire_before:
+                del texts[h]
+        for key, (h, last_seen) in queryids.items():
+            if last_seen < expire_before or (h is not None and h not in texts):
+                del queryids[key]
+
+        self.state.save('text_registry', self.data)
+        self.start(None)
@@ -0,0 +1,334 @@
+import logging
+import httplib
+import json
+import select
+import base64
+import socket
+import threading
+import urllib
+import urlparse
+import zlib
+
+from json.encoder import encode_basestring_ascii, INFINITY
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+# Markers on the encoder stack, everything else on it is a value still to be encoded
+_LIST_ITEM = object()
+_DICT_ITEM = object()
+
+
+def _encode_float(o):
+    # Same representation as the json module uses
+    if o != o:
+        return 'NaN'
+    if o == INFINITY:
+        return 'Infinity'
+    if o == -INFINITY:
+        return '-Infinity'
+    return repr(o)
+
+
+def _encode_key(key):
+    if isinstance(key, basestring):
+        return encode_basestring_ascii(key)
+    if isinstance(key, float):
+        return '"%s"' % _encode_float(key)
+    if key is True:
+        return '"true"'
+    if key is False:
+        return '"false"'
+    if key is None:
+        return '"null"'
+    return '"%d"' % key
+
+
+class RawJSON(object):
+    """ A JSON document that is encoded already, like one built by Postgres, included as-is when encoding """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def load(self):
+        return json.loads(self.text)
+
+
+def iterencode(obj, default=None):
+    """
+    Encodes obj as JSON, yielding small string pieces
+
+    Unlike json.JSONEncoder.iterencode this walks the document with an explicit stack,
+    and accepts any iterable (including generators) where a list is expected.
+    default is called for objects that have no JSON representation.
+    """
+    stack = [obj]
+
+    while stack:
+        o = stack.pop()
+
+        if o is _LIST_ITEM:
+            iterator, first = stack.pop(), stack.pop()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                yield ']'
+                continue
+            stack.extend((False, iterator, _LIST_ITEM))
+            if not first:
+                yield ','
+            stack.append(item)
+        elif o is _DICT_ITEM:
+            iterator, first = stack.pop(), stack.pop()
+            try:
+                key, value = next(iterator)
+            except StopIteration:
+                yield '}'
+                continue
+            stack.extend((False, iterator, _DICT_ITEM))
+            yield ('' if first else ',') + _encode_key(key) + ':'
+            stack.append(value)
+        elif isinstance(o, RawJSON):
+            yield o.text
+        elif isinstance(o, basestring):
+            yield encode_basestring_ascii(o)
+        elif o is None:
+            yield 'null'
+        elif o is True:
+            yield 'true'
+        elif o is False:
+            yield 'false'
+        elif isinstance(o, (int, long)):
+            yield str(o)
+        elif isinstance(o, float):
+            yield _encode_float(o)
+        elif isinstance(o, dict) or hasattr(o, 'iteritems'):
+            yield '{'
+            stack.extend((True, o.iteritems(), _DICT_ITEM))
+        elif isinstance(o, (list, tuple)) or hasattr(o, 'next'):
+            yield '['
+            stack.extend((True, iter(o), _LIST_ITEM))
+        elif default is not None:
+            stack.append(default(o))
+        else:
+            raise TypeError(repr(o) + " is not JSON serializable")
+
+
+def buffered(pieces, chunk_size=CHUNK_SIZE):
+    """ Joins small string pieces into chunks of about chunk_size """
+    buf = []
+    size = 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf)
+
+
+def compressed(chunks, chunk_size=CHUNK_SIZE):
+    """ zlib-compresses a stream of chunks, output is compatible with zlib.compress() """
+    compressor = zlib.compressobj()
+    for chunk in buffered((compressor.compress(chunk) for chunk in chunks), chunk_size):
+        yield chunk
+    yield compressor.flush()
+
+
+def decompressed(chunks):
+    """ Reverses compressed() """
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+def batch_body(snapshots):
+    """
+    Streams the JSON document for uploading several snapshots in one request
+
+    snapshots are (metadata, data_chunks) pairs, where data_chunks is the already encoded JSON snapshot.
+    The result is {"snapshots": [{"metadata": {...}, "data": {...}}, ...]}.
+    """
+    yield '{"snapshots":['
+    for i, (metadata, data_chunks) in enumerate(snapshots):
+        yield (',' if i else '') + '{"metadata":' + ''.join(iterencode(metadata)) + ',"data":'
+        for chunk in data_chunks:
+            yield chunk
+        yield '}'
+    yield ']}'
+
+
+def form_encoded(fields, data_chunks, data_field='data'):
+    """ Streams an application/x-www-form-urlencoded body whose last field is built from data_chunks """
+    yield urllib.urlencode(fields) + '&' + data_field + '='
+    # Percent-encoding works byte by byte, so chunks can be encoded independently
+    for chunk in data_chunks:
+        yield urllib.quote_plus(chunk)
+
+
+def binary_headers(metadata, compressed):
+    """
+    Headers for the binary upload protocol: the body is the (deflated) JSON snapshot itself,
+    all other fields are passed as X-Pganalyze-* headers
+    """
+    headers = {'Content-Type': 'application/json'}
+    if compressed:
+        headers['Content-Encoding'] = 'deflate'
+
+    for name, value in metadata.iteritems():
+        header = 'X-Pganalyze-' + '-'.join(part.capitalize() for part in name.split('_'))
+        headers[header] = '' if value is None else str(value)
+
+    return headers
+
+
+class Endpoint():
+    """
+    Connection to one API endpoint that is kept open between uploads
+
+    Daemon and fleet mode upload to the same endpoints over and over, so reusing the connection
+    saves a TCP and TLS handshake per upload. timeout applies to this endpoint only. Proxies are
+    taken from the http_proxy/https_proxy/no_proxy environment variables like urllib does, HTTPS
+    is tunneled through them with CONNECT.
+    """
+
+    def __init__(self, url, timeout=None):
+        parsed = urlparse.urlparse(url)
+        self.url = url
+        self.timeout = timeout
+        self.netloc = parsed.netloc
+        self.connection_class = httplib.HTTPSConnection if parsed.scheme == 'https' else httplib.HTTPConnection
+        self.path = parsed.path or '/'
+        if parsed.query:
+            self.path += '?' + parsed.query
+        self.proxy_headers = {}
+        self.tunnel = None
+
+        proxy = urllib.getproxies().get(parsed.scheme)
+        if proxy and not urllib.proxy_bypass(parsed.hostname or ''):
+            if '://' not in proxy:
+                proxy = 'http://' + proxy
+            proxy = urlparse.urlparse(proxy)
+            if proxy.username:
+                credentials = '%s:%s' % (urllib.unquote(proxy.username), urllib.unquote(proxy.password or ''))
+                self.proxy_headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(credentials)
+            if parsed.scheme == 'https':
+                self.tunnel = self.netloc
+            else:
+                # Plain HTTP proxies take the whole URL as the path
+                self.path = url
+            self.netloc = proxy.hostname + (':%d' % proxy.port if proxy.port else '')
+
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def _is_stale(self):
+        # An idle keep-alive connection should have nothing to read, unless the server closed it
+        sock = self.conn.sock
+        return sock is None or bool(select.select([sock], [], [], 0)[0])
+
+    def _post(self, headers, body):
+        if self.conn is None:
+            self.conn = self.connection_class(self.netloc, timeout=self.timeout)
+            if self.tunnel:
+                self.conn.set_tunnel(self.tunnel, headers=self.proxy_headers)
+        if self.proxy_headers and not self.tunnel:
+            headers = dict(headers, **self.proxy_headers)
+
+        if isinstance(body, str):
+            self.conn.request('POST', self.path, body, headers)
+        else:
+            self.conn.putrequest('POST', self.path)
+            for name, value in headers.iteritems():
+                self.conn.putheader(name, value)
+            self.conn.putheader('Transfer-Encoding', 'chunked')
+            self.conn.endheaders()
+
+            for chunk in body:
+                if chunk:
+                    self.conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.conn.send('0\r\n\r\n')
+
+        res = self.conn.getresponse()
+        message = res.read()
+        if res.will_close:
+            self.close()
+        return res.status, message, res.getheader('Location')
+
+    def _post_once(self, headers, body):
+        with self.lock:
+            if self.conn and self._is_stale():
+                self.close()
+
+            reused = self.conn is not None
+            try:
+                return self._post(headers, body)
+            except socket.timeout:
+                self.close()
+                raise
+            except (IOError, httplib.HTTPException):
+                self.close()
+                # The server may have closed a reused connection just now, a string body can be sent again
+                if not reused or not isinstance(body, str):
+                    raise
+                return self._post(headers, body)
+
+    def post(self, headers, body, redirects=MAX_REDIRECTS):
+        """
+        POSTs body, either a string or an iterable of chunks sent using chunked transfer encoding
+
+        Redirects are followed by POSTing a string body again to the new location, chunks can't be
+        sent twice. Returns a (code, message) tuple like the non-streaming code path.
+        """
+        code, message, location = self._post_once(headers, body)
+        if code in REDIRECTS and location and isinstance(body, str) and redirects > 0:
+            target = Endpoint(urlparse.urljoin(self.url, location), self.timeout)
+            try:
+                return target.post(headers, body, redirects - 1)
+            finally:
+                target.close()
+        return code, message
+
+
+def post_all(endpoints, headers, body):
+    """
+    POSTs the same body to all endpoints at once, each on its own thread
+
+    Returns (url, code, message) tuples in the order of endpoints, connection errors are reported
+    with code 'exception'.
+    """
+    results = [None] * len(endpoints)
+
+    def post(i, endpoint):
+        try:
+            code, message = endpoint.post(headers, body)
+        except (IOError, httplib.HTTPException) as e:
+            code, message = 'exception', str(e)
+        results[i] = (endpoint.url, code, message)
+
+    threads = [threading.Thread(target=post, args=(i, endpoint)) for i, endpoint in enumerate(endpoints[1:], 1)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    # The primary endpoint is handled on the calling thread
+    if endpoints:
+        post(0, endpoints[0])
+
+    for thread in threads:
+        thread.join()
+
+    return results
@@ -0,0 +1,449 @@
+import logging
+import base64
+import json
+import socket
+import struct
+import threading
+import itertools
+import SocketServer
+
+logger = logging.getLogger(__name__)
+
+# Type oids whose values are shifted/suffixed when scaling up a recording
+OID = 26
+NAME = 19
+
+SSL_REQUEST = 80877103
+CANCEL_REQUEST = 80877102
+
+# Handled by the replay server itself, they are never looked up in a recording
+# Command tag and transaction status afterwards, the savepoint commands are used by Pipeline
+TRANSACTION_COMMANDS = {
+    'begin transaction': ('BEGIN', 'T'),
+    'commit': ('COMMIT', 'I'),
+    'rollback': ('ROLLBACK', 'I'),
+    'SAVEPOINT pganalyze_pipeline': ('SAVEPOINT', 'T'),
+    'ROLLBACK TO SAVEPOINT pganalyze_pipeline': ('ROLLBACK', 'T'),
+    'RELEASE SAVEPOINT pganalyze_pipeline': ('RELEASE', 'T'),
+}
+
+PARAMETERS = [('server_version', '9.4.0'), ('server_encoding', 'UTF8'), ('client_encoding', 'UTF8'),
+              ('DateStyle', 'ISO, MDY'), ('integer_datetimes', 'on'), ('standard_conforming_strings', 'on')]
+
+COLUMN_FIELDS = ('table_oid', 'column_attrnum', 'type_oid', 'type_size', 'type_modifier', 'format')
+
+
+def message(code, payload=''):
+    return code + struct.pack('!i', len(payload) + 4) + payload
+
+
+def parse_row_description(data):
+    count = struct.unpack_from('!h', data)[0]
+    columns = []
+    pos = 2
+    for i in range(count):
+        end = data.index('\x00', pos)
+        column = {'name': data[pos:end]}
+        column.update(zip(COLUMN_FIELDS, struct.unpack_from('!ihihih', data, end + 1)))
+        columns.append(column)
+        pos = end + 19
+    return columns
+
+
+def row_description(columns, describe_statement=False):
+    payload = [struct.pack('!h', len(columns))]
+    for column in columns:
+        # Formats aren't known yet when a statement is described, only once it is bound
+        fmt = 0 if describe_statement else column['format']
+        payload.append(column['name'] + '\x00' + struct.pack(
+            '!ihihih', column['table_oid'], column['column_attrnum'], column['type_oid'],
+            column['type_size'], column['type_modifier'], fmt))
+    return message('T', ''.join(payload))
+
+
+def error_response(text, sqlstate='XX000'):
+    return message('E', 'SERROR\x00C%s\x00M%s\x00\x00' % (sqlstate, text))
+
+
+def split_data_row(data):
+    """ Splits a DataRow message into its values, None for NULL """
+    count = struct.unpack_from('!h', data)[0]
+    values = []
+    pos = 2
+    for i in range(count):
+        length = struct.unpack_from('!i', data, pos)[0]
+        pos += 4
+        if length == -1:
+            values.append(None)
+        else:
+            values.append(data[pos:pos + length])
+            pos += length
+    return values
+
+
+def join_data_row(values):
+    payload = [struct.pack('!h', len(values))]
+    for value in values:
+        if value is None:
+            payload.append(struct.pack('!i', -1))
+        else:
+            payload.append(struct.pack('!i', len(value)) + value)
+    return ''.join(payload)
+
+
+def _oid_value(column, value):
+    return struct.unpack('!I', value)[0] if column['format'] == 1 else int(value)
+
+
+def scale_row(columns, data, copy, stride):
+    """
+    Returns the DataRow data of copy number copy of a row, for synthesizing larger catalogs
+
+    oid columns are shifted by copy * stride and name columns (except schema names) get a suffix,
+    so every copy describes a distinct relation.
+    """
+    if copy == 0:
+        return data
+
+    values = split_data_row(data)
+    for i, column in enumerate(columns):
+        value = values[i]
+        if value is None:
+            continue
+        if column['type_oid'] == OID:
+            oid = _oid_value(column, value) + copy * stride
+            values[i] = struct.pack('!I', oid) if column['format'] == 1 else str(oid)
+        elif column['type_oid'] == NAME and 'schema' not in column['name']:
+            values[i] = value + '_%d' % copy
+    return join_data_row(values)
+
+
+class Recording():
+    """
+    Results of the queries sent by the collector, as the backend messages describing them
+
+    Each query (as sent on the wire) maps to its result columns and the list of results it had,
+    in the order it was run. Rows are kept as raw DataRow messages in the formats pg8000 requested,
+    so replaying them exercises the same decoding as talking to a real server.
+    """
+
+    def __init__(self, queries=None):
+        self.queries = queries or {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            document = json.load(f)
+
+        queries = {}
+        for query, entry in document['queries'].iteritems():
+            for result in entry['results']:
+                if result.get('tag'):
+                    result['tag'] = result['tag'].encode('utf-8')
+                if 'rows' in result:
+                    result['rows'] = [base64.b64decode(row) for row in result['rows']]
+                if 'error' in result:
+                    result['error'] = base64.b64decode(result['error'])
+            entry['columns'] = [dict(column, name=column['name'].encode('utf-8')) for column in entry['columns']]
+            queries[query.encode('utf-8')] = entry
+        return cls(queries)
+
+    def save(self, path):
+        with self.lock:
+            queries = {}
+            for query, entry in self.queries.iteritems():
+                results = []
+                for result in entry['results']:
+                    result = dict(result)
+                    if 'rows' in result:
+                        result['rows'] = [base64.b64encode(row) for row in result['rows']]
+                    if 'error' in result:
+                        result['error'] = base64.b64encode(result['error'])
+                    results.append(result)
+                queries[query.decode('utf-8')] = {'columns': entry['columns'], 'results': results}
+
+        with open(path, 'w') as f:
+            json.dump({'version': 1, 'queries': queries}, f)
+
+    def max_oid(self):
+        """ Highest oid in any result, used to keep the oids of scaled copies apart """
+        highest = 0
+        for entry in self.queries.itervalues():
+            oid_columns = [(i, column) for i, column in enumerate(entry['columns']) if column['type_oid'] == OID]
+            if not oid_columns:
+                continue
+            for result in entry['results']:
+                for row in result.get('rows', []):
+                    values = split_data_row(row)
+                    for i, column in oid_columns:
+                        if values[i] is not None:
+                            highest = max(highest, _oid_value(column, values[i]))
+        return highest
+
+
+class WireRecorder():
+    """
+    Records the backend messages of every query run over pg8000 connections into a Recording
+
+    attach() hooks into a connection's message handlers, so recording works for any query the
+    collector runs, including rows fetched later from suspended portals.
+    """
+
+    def __init__(self):
+        self.recording = Recording()
+
+    def attach(self, conn):
+        import pg8000
+        from pg8000 import core
+
+        recording = self.recording
+        current = {}
+        execute = conn.execute
+
+        def recording_execute(cursor, operation, vals):
+            query = core.convert_paramstyle(pg8000.paramstyle, operation)[0]
+            if isinstance(query, unicode):
+                query = query.encode('utf-8')
+            with recording.lock:
+                entry = recording.queries.setdefault(query, {'columns': [], 'results': []})
+                current['entry'] = entry
+                current['result'] = {'rows': [], 'tag': None}
+                entry['results'].append(current['result'])
+            return execute(cursor, operation, vals)
+
+        def on_row_description(data):
+            columns = parse_row_description(data)
+            for column in columns:
+                column['format'] = conn.pg_types[column['type_oid']][0]
+            current['entry']['columns'] = columns
+
+        def on_no_data(data):
+            current['entry']['columns'] = []
+
+        def on_data_row(data):
+            current['result']['rows'].append(data)
+
+        def on_command_complete(data):
+            current['result']['tag'] = data[:-1]
+
+        def on_error(data):
+            if 'result' in current:
+                current['result'].clear()
+                current['result']['error'] = data
+
+        hooks = {'T': on_row_description, 'n': on_no_data, 'D': on_data_row,
+                 'C': on_command_complete, 'E': on_error}
+
+        def hooked(code, handler):
+            def handle(data, cursor):
+                hooks[code](data)
+                return handler(data, cursor)
+            return handle
+
+        for code in hooks:
+            conn.message_types[code] = hooked(code, conn.message_types[code])
+        conn.execute = recording_execute
+
+    def save(self, path):
+        self.recording.save(path)
+        logger.info("Wrote wire recording of %d queries to %s", len(self.recording.queries), path)
+
+
+class _ReplayHandler(SocketServer.BaseRequestHandler):
+    """ Speaks just enough of the Postgres protocol (v3, extended query) to answer pg8000 """
+
+    def setup(self):
+        # Like Postgres, don't let Nagle's algorithm hold back the last message of a response
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.request.makefile('rwb')
+        self.statements = {}
+        self.portals = {}
+        self.runs = {}
+        self.status = 'I'
+        self.failed = False
+
+    def finish(self):
+        self.file.close()
+
+    def read_message(self):
+        header = self.file.read(5)
+        if len(header) < 5:
+            return None, None
+        code, length = struct.unpack('!ci', header)
+        return code, self.file.read(length - 4)
+
+    def startup(self):
+        while True:
+            header = self.file.read(4)
+            if len(header) < 4:
+                # pg8000 closes the connection when SSL is refused, and retries without
+                return False
+            length = struct.unpack('!i', header)[0]
+            payload = self.file.read(length - 4)
+            code = struct.unpack_from('!i', payload)[0]
+            if code == SSL_REQUEST:
+                self.file.write('N')
+                self.file.flush()
+            elif code == CANCEL_REQUEST:
+                return False
+            else:
+                break
+
+        self.file.write(message('R', struct.pack('!i', 0)))
+        for name, value in PARAMETERS:
+            self.file.write(message('S', name + '\x00' + value + '\x00'))
+        self.file.write(message('K', struct.pack('!ii', 1, 1)))
+        self.file.write(message('Z', 'I'))
+        self.file.flush()
+        return True
+
+    def result_for(self, query):
+        """ Returns (columns, rows, tag) for a query, rows being an iterator of DataRow data """
+        command = TRANSACTION_COMMANDS.get(query)
+        if command:
+            tag, self.status = command
+            return [], iter([]), tag
+
+        entry = self.server.recording.queries.get(query)
+        if entry is None:
+            raise KeyError(query)
+
+        # Repeated runs of a query (e.g. FETCH from a cursor) get the recorded results in order
+        run = self.runs.get(query, 0)
+        self.runs[query] = run + 1
+        result = entry['results'][min(run, len(entry['results']) - 1)]
+        if 'error' in result:
+            raise ValueError(result['error'])
+
+        columns = entry['columns']
+        rows = result['rows']
+        scale = self.server.scale
+        if scale == 1 or not any(column['type_oid'] == OID for column in columns):
+            return columns, iter(rows), result['tag']
+
+        stride = self.server.stride
+        scaled = (scale_row(columns, row, copy, stride) for copy in range(scale) for row in rows)
+        tag = result['tag']
+        if tag and tag.startswith('SELECT '):
+            tag = 'SELECT %d' % (len(rows) * scale)
+        elif tag and tag.startswith('FETCH '):
+            tag = 'FETCH %d' % (len(rows) * scale)
+        return columns, scaled, tag
+
+    def fail(self, data):
+        self.file.write(data)
+        self.failed = True
+        if self.status == 'T':
+            self.status = 'E'
+
+    def handle(self):
+        if not self.startup():
+            return
+
+        while True:
+            code, data = self.read_message()
+            if code is None or code == 'X':
+                return
+
+            if code == 'S':
+                self.failed = False
+                self.file.write(message('Z', self.status))
+                self.file.flush()
+                continue
+            if code == 'H':
+                self.file.flush()
+                continue
+            if self.failed:
+                # After an error everything up to the next Sync is skipped
+                continue
+
+            if code == 'P':
+                name, query = data.split('\x00')[:2]
+                if query not in TRANSACTION_COMMANDS and query not in self.server.recording.queries:
+                    self.fail(error_response('query not in recording: %s' % query[:200]))
+                    continue
+                self.statements[name] = query
+                self.file.write(message('1'))
+            elif code == 'D':
+                name = data[1:].split('\x00')[0]
+                query = self.statements.get(name) if data[0] == 'S' else self.portals[name][0]
+                entry = self.server.recording.queries.get(query)
+                columns = entry['columns'] if entry else []
+                if data[0] == 'S':
+                    self.file.write(message('t', struct.pack('!h', 0)))
+                self.file.write(row_description(columns, data[0] == 'S') if columns else message('n'))
+            elif code == 'B':
+                portal, name = data.split('\x00')[:2]
+                query = self.statements[name]
+                try:
+                    columns, rows, tag = self.result_for(query)
+                except KeyError:
+                    self.fail(error_response('query not in recording: %s' % query[:200]))
+                    continue
+                except ValueError as e:
+                    self.fail(message('E', e.args[0]))
+                    continue
+                self.portals[portal] = (query, rows, tag)
+                self.file.write(message('2'))
+            elif code == 'E':
+                end = data.index('\x00')
+                portal = data[:end]
+                limit = struct.unpack_from('!i', data, end + 1)[0]
+                query, rows, tag = self.portals[portal]
+                batch = list(itertools.islice(rows, limit + 1 if limit else None))
+                suspended = limit and len(batch) > limit
+                if suspended:
+                    # One row too many was taken to find out whether there are more, put it back
+                    self.portals[portal] = (query, itertools.chain(batch[limit:], rows), tag)
+                    batch = batch[:limit]
+                for row in batch:
+                    self.file.write(message('D', row))
+                self.file.write(message('s') if suspended else message('C', (tag or '') + '\x00'))
+            elif code == 'C':
+                name = data[1:].split('\x00')[0]
+                if data[0] == 'P':
+                    self.portals.pop(name, None)
+                else:
+                    self.statements.pop(name, None)
+                self.file.write(message('3'))
+            elif code == 'Q':
+                self.file.write(error_response('simple query protocol is not supported'))
+                self.file.write(message('Z', self.status))
+                self.file.flush()
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ReplayServer():
+    """
+    Local stand-in for Postgres that answers queries from a Recording
+
+    With scale > 1, results that describe relations (those with oid columns) are repeated scale
+    times with distinct oids and names, to synthesize large catalogs from a small recording.
+    Queries that aren't in the recording fail with an error, like they would on a real server.
+    """
+
+    def __init__(self, recording, scale=1, address='127.0.0.1', port=0):
+        self.server = _Server((address, port), _ReplayHandler)
+        self.server.recording = recording
+        self.server.scale = scale
+        self.server.stride = recording.max_oid() + 1 if scale > 1 else 0
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("Replaying recording on %s:%d", *self.server.server_address[:2])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,137 @@
+import logging
+import threading
+import types
+import Queue
+
+from .PostgresInformation import PostgresInformation
+
+logger = logging.getLogger(__name__)
+
+# Never use more than this fraction of max_connections, no matter what was configured
+MAX_CONNECTION_SHARE = 0.1
+
+
+class WorkerPool():
+    """
+    Runs PostgresInformation methods concurrently on several connections
+
+    All connections import the snapshot exported by the main connection, so the
+    combined catalog result is as consistent as if it had been fetched in one transaction.
+    """
+
+    def __init__(self, db, size):
+        self.db = db
+        self.size = size
+        self.workers = []
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
+
+    def connection_budget(self):
+        query = """
+        SELECT current_setting('max_connections')::int AS max_connections,
+               current_setting('max_connections')::int
+                 - current_setting('superuser_reserved_connections')::int
+                 - (SELECT count(*) FROM pg_stat_activity) AS free_connections
+        """
+        row = self.db.run_query(query)[0]
+        share = int(row['max_connections'] * MAX_CONNECTION_SHARE)
+
+        # The main connection is already accounted for, it does work too
+        return max(1, min(self.size, share, row['free_connections'] + 1))
+
+    def _export_snapshot(self):
+        # Exporting requires a fresh transaction on the main connection
+        self.db.rollback()
+        try:
+            self.db.run_query("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ", should_raise=True)
+            return self.db.run_query("SELECT pg_export_snapshot() AS snapshot_id", should_raise=True)[0]['snapshot_id']
+        except Exception as e:
+            logger.debug("Couldn't export snapshot, falling back to sequential collection: %s", e)
+            return None
+
+    def _prepare_workers(self, count, snapshot_id):
+        while len(self.workers) > count:
+            self.workers.pop().close()
+
+        while len(self.workers) < count:
+            self.workers.append(self.db.clone())
+
+        for worker in self.workers:
+            worker.ensure_connected()
+            worker.rollback()
+            worker.run_query("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ", should_raise=True)
+            worker.run_query("SET TRANSACTION SNAPSHOT '%s'" % snapshot_id, should_raise=True)
+
+    def run(self, sections):
+        """
+        Runs (name, callable) pairs, each callable receives a PostgresInformation instance
+
+        Returns a dictionary of results by section name.
+        """
+        results = {}
+        count = self.connection_budget()
+
+        snapshot_id = self._export_snapshot() if count > 1 else None
+        if snapshot_id is None:
+            for name, fn in sections:
+                results[name] = fn(PostgresInformation(self.db))
+            return results
+
+        try:
+            self._prepare_workers(count - 1, snapshot_id)
+        except Exception as e:
+            logger.error("Failed to set up worker connections: %s", e)
+            self.close()
+            raise
+
+        logger.debug("Collecting %d sections using %d connections", len(sections), count)
+
+        tasks = Queue.Queue()
+        for section in sections:
+            tasks.put(section)
+
+        errors = []
+        lock = threading.Lock()
+
+        def work(db):
+            PI = PostgresInformation(db)
+            while not errors:
+                try:
+                    name, fn = tasks.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    result = fn(PI)
+                    # Streaming results have to be consumed while the snapshot is still in place
+                    if isinstance(result, types.GeneratorType):
+                        result = list(result)
+                except Exception as e:
+                    errors.append((name, e))
+                    return
+                with lock:
+                    results[name] = result
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in self.workers]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        # The exporting connection has to stay in its transaction anyway, so it does its share of the work
+        work(self.db)
+
+        for thread in threads:
+            thread.join()
+
+        for worker in self.workers:
+            worker.rollback()
+
+        if errors:
+            name, e = errors[0]
+            logger.error("Failed to collect %s: %s", name, e)
+            self.close()
+            raise e
+
+        return results
@@ -10,7 +10,14 @@ import calendar
 import datetime
 import re
 import json
-import urllib, urllib2
+import hashlib
+import collections
+import types
+import urllib
+import httplib
+import socket
+import threading
+import Queue
 import logging
 from pprint import pformat
 from optparse import OptionParser
@@ -26,20 +33,174 @@ except Exception as e:
 from pgacollector.PostgresInformation import PostgresInformation
 from pgacollector.PgStatStatements import PgStatStatements
 from pgacollector.SystemInformation import SystemInformation
-from pgacollector.DB import DB
+from pgacollector.DB import DB, db_driver
 from pgacollector.Configuration import Configuration
+from pgacollector.Scheduler import Scheduler
+from pgacollector.WorkerPool import WorkerPool
+from pgacollector.Pipeline import planned_queries
+from pgacollector.State import State
+from pgacollector.SchemaFingerprints import SchemaFingerprints
+from pgacollector.SchemaAssembly import assemble_schema
+from pgacollector.StatementDeltas import StatementDeltas
+from pgacollector.TextRegistry import TextRegistry
+from pgacollector.BloatEstimator import BloatEstimator
+from pgacollector.SizeCache import SizeCache
+from pgacollector.Profiler import Profiler
+from pgacollector.MetricsExporter import MetricsExporter
+from pgacollector.Fleet import Fleet
+from pgacollector.ActivitySampler import ActivitySampler
+from pgacollector.LockAnalysis import summarize_locks
+from pgacollector.Outbox import Outbox, OutboxSender
+from pgacollector.WireRecording import WireRecorder
+from pgacollector import Upload
+from pgacollector.Upload import RawJSON
 
 MYNAME = 'pganalyze-collector'
 VERSION = '0.8.1'
 API_URL = 'https://api.pganalyze.com/v1/snapshots'
-dbconf = {}
 
-def setup_database():
-    return DB(querymarker=MYNAME, host=dbconf['host'], port=dbconf['port'], username=dbconf['username'],
-              password=dbconf['password'], dbname=dbconf['dbname'])
-
-def is_remote_system():
-    global dbconf
+def setup_database(dbconf):
+    wire_recorder = WireRecorder() if option['record_wire'] else None
+    # A fleet run that exceeds its timeout gets cancelled, this also bounds what cancelling doesn't interrupt
+    timeout = dbconf.get('timeout', option['server_timeout']) if option['fleet'] else None
+    db = DB(querymarker=MYNAME, host=dbconf['host'], port=dbconf['port'], username=dbconf['username'],
+            password=dbconf['password'], dbname=dbconf['dbname'], exit_on_error=not option['daemon'],
+            wire_recorder=wire_recorder, timeout=timeout)
+    db.bulk_copy = option['bulk_copy']
+    return db
+
+class Server():
+    """ Connections and state kept around for one monitored database between runs """
+
+    def __init__(self, dbconf):
+        self.dbconf = dbconf
+        self.db = setup_database(dbconf)
+        self.profiler = Profiler(option['profile_dir'])
+        self.db.profiler = self.profiler
+        self.exporter = None
+        self.query_source = None
+        # OS level data is only meaningful if the collector runs on the database server
+        self.systeminformation = option['systeminformation'] and not is_remote_system(dbconf)
+        self.pool = None
+        if option['parallel_connections'] > 1:
+            self.pool = WorkerPool(self.db, option['parallel_connections'])
+
+        self.state = State(option['state_dir'], State.server_key_for(dbconf))
+        self.schema_fingerprints = None
+        if option['incremental_schema']:
+            self.schema_fingerprints = SchemaFingerprints(self.state)
+        self.statement_deltas = None
+        if option['query_deltas']:
+            self.statement_deltas = StatementDeltas(self.state)
+        self.text_registry = None
+        if option['dedupe_texts']:
+            self.text_registry = TextRegistry(self.state)
+        self.bloat_estimator = None
+        if option['collect_postgres_bloat'] and option['client_side_bloat']:
+            self.bloat_estimator = BloatEstimator(self.state, option['bloat_ttl'], option['interval'])
+        self.size_cache = None
+        if option['cached_sizes']:
+            self.size_cache = SizeCache(self.state, option['size_ttl'], option['interval'])
+
+        # Polls pg_stat_activity between runs over its own connection
+        self.activity_sampler = None
+        if option['sample_activity']:
+            db = self.db.clone()
+            db.profiler = None
+            self.activity_sampler = ActivitySampler(db, option['activity_sample_interval'],
+                                                    option['activity_bucket_seconds'], option['activity_buffer_size'])
+            self.activity_sampler.start()
+
+        # Used with --all-databases, by database name
+        self.databases = {}
+        self.collected_databases = []
+
+        # Kept open between runs
+        self.endpoints = [Upload.Endpoint(api_url, option['upload_timeout']) for api_url in dbconf['api_url']]
+
+        # One spool per API endpoint, so a failing endpoint doesn't hold up the others
+        self.outbox_senders = []
+        if option['outbox'] and not option['dryrun']:
+            for endpoint in self.endpoints:
+                directory = os.path.join(option['outbox'], self.state.server_key,
+                                         hashlib.md5(endpoint.url).hexdigest()[:8])
+                outbox = Outbox(directory, option['outbox_max_size'] * 1024 * 1024, option['outbox_max_age'])
+                sender = OutboxSender(outbox, spooled_sender(self, endpoint, outbox), option['outbox_batch_size'])
+                if option['daemon']:
+                    sender.start()
+                self.outbox_senders.append(sender)
+
+    def commit_state(self):
+        # Only called once the server has received the snapshot this state describes
+        if self.schema_fingerprints:
+            self.schema_fingerprints.commit()
+        if self.statement_deltas:
+            self.statement_deltas.commit()
+        if self.text_registry:
+            self.text_registry.commit()
+        if self.activity_sampler:
+            self.activity_sampler.commit()
+        for database in self.collected_databases:
+            database.commit_state()
+
+    def forget_state(self):
+        # The server may lack texts and definitions that later snapshots only reference
+        if self.schema_fingerprints:
+            self.schema_fingerprints.forget()
+        if self.text_registry:
+            self.text_registry.forget()
+        for database in self.databases.values():
+            database.forget_state()
+
+    def cancel(self):
+        """ Interrupts whatever the server's connections are doing, can be called from another thread """
+        connections = [self.db] + [database.db for database in self.databases.values()]
+        if self.activity_sampler:
+            connections.append(self.activity_sampler.db)
+        if self.pool:
+            connections.extend(self.pool.workers)
+
+        for db in connections:
+            try:
+                db.cancel()
+            except Exception as e:
+                logger.debug("Failed to cancel connection: %s", e)
+
+    def reset_connections(self):
+        if self.pool:
+            self.pool.close()
+        self.db.close()
+        for database in self.databases.values():
+            database.db.close()
+
+
+class Database():
+    """ Connection and per-database state for one database of a server in --all-databases mode """
+
+    def __init__(self, server, name):
+        self.name = name
+        self.db = server.db.clone(name)
+        self.state = State(option['state_dir'], State.server_key_for(dict(server.dbconf, dbname=name)))
+        self.schema_fingerprints = None
+        if option['incremental_schema']:
+            self.schema_fingerprints = SchemaFingerprints(self.state)
+        self.bloat_estimator = None
+        if option['collect_postgres_bloat'] and option['client_side_bloat']:
+            self.bloat_estimator = BloatEstimator(self.state, option['bloat_ttl'], option['interval'])
+        self.size_cache = None
+        if option['cached_sizes']:
+            self.size_cache = SizeCache(self.state, option['size_ttl'], option['interval'])
+
+    def commit_state(self):
+        if self.schema_fingerprints:
+            self.schema_fingerprints.commit()
+
+    def forget_state(self):
+        if self.schema_fingerprints:
+            self.schema_fingerprints.forget()
+
+
+def is_remote_system(dbconf):
     is_awshost = dbconf['host'] != None and re.search('amazonaws.com$', dbconf['host']) != None
     return is_awshost or SystemInformation().on_heroku
 
@@ -67,6 +228,9 @@ def parse_options(print_help=False):
     parser.add_option('--no-postgres-locks', action='store_false', dest='collect_postgres_locks',
                       default=True,
                       help='Don\'t collect Postgres lock information')
+    parser.add_option('--lock-summary', action='store_true', dest='lock_summary',
+                      help='Instead of all of pg_locks, send blocking trees and lock counts by relation and mode, '
+                           'plus the locks of waiting and blocking backends')
     parser.add_option('--no-postgres-functions', action='store_false', dest='collect_postgres_functions',
                       default=True,
                       help='Don\'t collect Postgres function/procedure information')
@@ -76,6 +240,20 @@ def parse_options(print_help=False):
     parser.add_option('--no-postgres-bloat', action='store_false', dest='collect_postgres_bloat',
                       default=True,
                       help='Don\'t collect Postgres table/index bloat statistics')
+    parser.add_option('--client-side-bloat', action='store_true', dest='client_side_bloat',
+                      help='Estimate table/index bloat in the collector from pg_stats and pg_class, '
+                           'caching the expensive parts in --state-dir')
+    parser.add_option('--bloat-ttl', action='store', type='int', dest='bloat_ttl',
+                      default=3600,
+                      help='Seconds client-side bloat estimates are reused, each run refreshes a share of '
+                           'tables so all are refreshed within this time. Default: %default')
+    parser.add_option('--cached-sizes', action='store_true', dest='cached_sizes',
+                      help='Only measure the size of tables that were written to since their last measurement, '
+                           'reusing the others from --state-dir or estimating them from relpages')
+    parser.add_option('--size-ttl', action='store', type='int', dest='size_ttl',
+                      default=3600,
+                      help='Seconds a measured table size is reused if the table wasn\'t written to, each run '
+                           'measures a share of tables so all are measured within this time. Default: %default')
     parser.add_option('--no-postgres-views', action='store_false', dest='collect_postgres_views',
                       default=True,
                       help='Don\'t collect Postgres view/materialized view information')
@@ -87,6 +265,101 @@ def parse_options(print_help=False):
     parser.add_option('--no-compression', action='store_false', dest='compression_enabled',
                       default=True,
                       help='Disable gzip compression for statistics data sent')
+    parser.add_option('--streaming-upload', action='store_true', dest='streaming_upload',
+                      help='Encode, compress and send data in chunks instead of building the whole request in memory')
+    parser.add_option('--upload-protocol', action='store', type='choice', dest='upload_protocol',
+                      choices=['form', 'binary'], default='form',
+                      help='form: urlencoded fields, binary: (deflated) JSON request body with metadata in '
+                           'X-Pganalyze-* headers, avoids percent-encoding compressed data. Default: %default')
+    parser.add_option('--upload-timeout', action='store', type='int', dest='upload_timeout',
+                      default=60,
+                      help='Seconds to wait for each API endpoint, all endpoints are sent to at the same time. '
+                           'Default: %default')
+    parser.add_option('--daemon', action='store_true', dest='daemon',
+                      help='Keep running and collect every --interval seconds, reusing the database connection')
+    parser.add_option('--interval', action='store', type='int', dest='interval',
+                      default=600,
+                      help='Seconds between collections in daemon mode. Default: %default')
+    parser.add_option('--parallel-connections', action='store', type='int', dest='parallel_connections',
+                      default=1,
+                      help='Collect Postgres information over up to this many connections sharing one snapshot, '
+                           'capped at 10% of max_connections. Default: %default')
+    parser.add_option('--bulk-copy', action='store_true', dest='bulk_copy',
+                      help='Transfer columns, indexes, functions, pg_stat_statements and --schema-engine server '
+                           'records with COPY TO STDOUT in binary format (pg8000 only). Each result is held in memory '
+                           'as a whole: columns, indexes and schema records are no longer streamed in batches, so '
+                           'peak memory grows with the size of the catalog')
+    parser.add_option('--pipeline-queries', action='store_true', dest='pipeline_queries',
+                      help='Send the independent Postgres information queries together, in one or two round-trips '
+                           'instead of one per query (pg8000 only)')
+    parser.add_option('--schema-engine', action='store', type='choice', dest='schema_engine',
+                      choices=['client', 'server'], default='client',
+                      help='client: merge the results of the schema queries in the collector, server: have Postgres '
+                           'build the JSON record of each relation, passed through as-is (9.4+, falls back to client '
+                           'on older versions). Default: %default')
+    parser.add_option('--state-dir', action='store', type='string', dest='state_dir',
+                      default='$HOME/.pganalyze_collector_state',
+                      help='Directory for state kept between runs. Default: %default')
+    parser.add_option('--incremental-schema', action='store_true', dest='incremental_schema',
+                      help='Only send column, index, constraint and view definitions of relations that changed')
+    parser.add_option('--query-deltas', action='store_true', dest='query_deltas',
+                      help='Send pg_stat_statements counters as differences to the last run, skipping idle queries')
+    parser.add_option('--dedupe-texts', action='store_true', dest='dedupe_texts',
+                      help='Send query texts, function sources and view definitions only once, referencing them by hash afterwards')
+    parser.add_option('--profile', action='store', type='string', dest='profile_dir',
+                      help='Write a cProfile/pstats file per collection phase to this directory')
+    parser.add_option('--record-wire', action='store', type='string', dest='record_wire', metavar='FILE',
+                      help='Record the results of all queries as Postgres protocol messages to FILE, '
+                           'for replaying them with benchmarks/replay.py (pg8000 driver only)')
+    parser.add_option('--http-exporter', action='store', type='string', dest='http_exporter', metavar='[HOST:]PORT',
+                      help='Keep running like --daemon and serve the most recently collected data on '
+                           'http://HOST:PORT/metrics in Prometheus text format')
+    parser.add_option('--exporter-max-series', action='store', type='int', dest='exporter_max_series',
+                      default=100,
+                      help='Export at most this many tables and queries individually, summing up the rest. '
+                           'Default: %default')
+    parser.add_option('--outbox', action='store', type='string', dest='outbox', metavar='DIR',
+                      help='Spool compressed snapshots in DIR and upload them from there, retrying with '
+                           'exponential backoff while the API is unreachable')
+    parser.add_option('--outbox-max-size', action='store', type='int', dest='outbox_max_size',
+                      default=100,
+                      help='Megabytes of snapshots kept per server in --outbox, dropping the oldest first. Default: %default')
+    parser.add_option('--outbox-max-age', action='store', type='int', dest='outbox_max_age',
+                      default=86400,
+                      help='Seconds after which spooled snapshots are dropped. Default: %default')
+    parser.add_option('--outbox-batch-size', action='store', type='int', dest='outbox_batch_size',
+                      default=1,
+                      help='Upload up to this many spooled snapshots per request when catching up, '
+                           'requires an API endpoint that accepts batches. Default: %default')
+    parser.add_option('--sample-activity', action='store_true', dest='sample_activity',
+                      help='Sample pg_stat_activity between collections and send backend states, wait events and '
+                           'the longest running transactions per --activity-bucket-seconds (long-running modes only)')
+    parser.add_option('--activity-sample-interval', action='store', type='float', dest='activity_sample_interval',
+                      default=1.0,
+                      help='Seconds between pg_stat_activity samples. Default: %default')
+    parser.add_option('--activity-bucket-seconds', action='store', type='int', dest='activity_bucket_seconds',
+                      default=10,
+                      help='Seconds of samples summed up into one bucket. Default: %default')
+    parser.add_option('--activity-buffer-size', action='store', type='int', dest='activity_buffer_size',
+                      default=120,
+                      help='Buckets kept until they have been sent, dropping the oldest first. Default: %default')
+    parser.add_option('--all-databases', action='store_true', dest='all_databases',
+                      help='Collect from all databases of the server, reading server-wide statistics and '
+                           'pg_stat_statements only once')
+    parser.add_option('--database-concurrency', action='store', type='int', dest='database_concurrency',
+                      default=4,
+                      help='Collect at most this many databases at the same time with --all-databases. Default: %default')
+    parser.add_option('--fleet', action='store_true', dest='fleet',
+                      help='Keep running and collect from every [pganalyze] and [pganalyze:<name>] section of the '
+                           'config file and of --config-dir, each section can set its own interval and timeout')
+    parser.add_option('--config-dir', action='store', type='string', dest='config_dir',
+                      help='Directory with additional *.conf files for --fleet')
+    parser.add_option('--max-concurrency', action='store', type='int', dest='max_concurrency',
+                      default=10,
+                      help='Collect from at most this many servers at the same time in --fleet mode. Default: %default')
+    parser.add_option('--server-timeout', action='store', type='int', dest='server_timeout',
+                      default=300,
+                      help='Cancel collections that take longer than this many seconds in --fleet mode. Default: %default')
 
     if print_help:
         parser.print_help()
@@ -95,8 +368,15 @@ def parse_options(print_help=False):
     (options, args) = parser.parse_args()
     options = options.__dict__
     options['configfile'] = re.split(',\s+', options['configfile'].replace('$HOME', os.environ['HOME']))
+    options['state_dir'] = options['state_dir'].replace('$HOME', os.environ['HOME'])
+    if options['outbox']:
+        options['outbox'] = options['outbox'].replace('$HOME', os.environ['HOME'])
     options['api_url'] = API_URL
 
+    # These keep running, so a failure must not end the process
+    if options['http_exporter'] or options['fleet']:
+        options['daemon'] = True
+
     return options
 
 
@@ -105,6 +385,9 @@ def configure_logger():
 
     loglevel = logging.DEBUG if option['verbose'] else logging.INFO
     logformat = '%(levelname)s - %(asctime)s %(message)s'
+    if option['fleet']:
+        # Runs for all servers log concurrently, the thread is named after the server
+        logformat = '%(levelname)s - %(asctime)s [%(threadName)s] %(message)s'
 
     logargs = {
         'format': logformat,
@@ -115,119 +398,290 @@ def configure_logger():
     return logtemp
 
 
-def fetch_system_information():
+def fetch_system_information(db, profiler):
     SI = SystemInformation(db)
     info = {}
 
-    info['os'] = SI.os()
-    info['cpu'] = SI.cpu()
-    info['scheduler'] = SI.scheduler()
-    info['storage'] = SI.storage()
-    info['memory'] = SI.memory()
+    for name in ('os', 'cpu', 'scheduler', 'storage', 'memory'):
+        with profiler.section('system.' + name):
+            info[name] = getattr(SI, name)()
 
     return info
 
 
-def fetch_postgres_information():
+# Sections describing the whole server, collected only once with --all-databases
+SERVER_SECTIONS = set(['settings', 'version', 'server', 'bgwriter', 'replication'])
+
+# Sections that keep state or pick their queries from earlier results, not planned for --pipeline-queries
+DEPENDENT_SECTIONS = set(['bloat'])
+
+
+def postgres_sections(changed_oids=None, known_hashes=None, bloat_estimator=None, collected_at=None,
+                      server_schema=False):
     """
-    Fetches information about the Postgres installation
+    Lists the (name, callable) pairs that make up the Postgres information
+
+    changed_oids restricts definitions (columns, indexes, ...) to these relations, None means all of them.
+    Large texts whose hash is in known_hashes, by field name, are left out. With a bloat_estimator, bloat is estimated client-side.
+    With server_schema, a single 'schema' section replaces everything that goes into the schema records.
+    """
+    with_views = option['collect_postgres_views']
+    known_hashes = known_hashes or {}
+    sections = []
+
+    # Slowest sections first, so they don't end up as stragglers when running in parallel
+    if server_schema:
+        sections.append(('schema', lambda PI: PI.schema_documents(with_views, option['collect_postgres_bloat'])))
+    elif option['collect_postgres_bloat'] and bloat_estimator:
+        sections.append(('bloat', lambda PI: bloat_estimator.estimate(PI, collected_at)))
+    elif option['collect_postgres_bloat']:
+        sections.append(('table_bloat', lambda PI: PI.table_bloat()))
+        sections.append(('index_bloat', lambda PI: PI.index_bloat()))
+
+    if not server_schema:
+        sections.append(('columns', lambda PI: PI.columns(with_views, changed_oids)))
+        sections.append(('indexes', lambda PI: PI.indexes(with_views, changed_oids)))
+        sections.append(('relations', lambda PI: PI.relations(with_views, option['cached_sizes'])))
+        sections.append(('constraints', lambda PI: PI.constraints(changed_oids)))
+
+        if changed_oids is not None:
+            sections.append(('index_stats', lambda PI: PI.index_stats(with_views)))
+
+        if with_views:
+            sections.append(('view_definitions',
+                             lambda PI: PI.view_definitions(changed_oids, known_hashes.get('view_definition'))))
+
+    if option['collect_postgres_functions']:
+        sections.append(('functions', lambda PI: PI.functions(known_hashes.get('source'))))
+
+    if option['collect_postgres_settings']:
+        sections.append(('settings', lambda PI: PI.settings()))
+
+    if option['collect_postgres_locks'] and option['lock_summary']:
+        sections.append(('locks', lambda PI: PI.contended_locks()))
+        sections.append(('lock_counts', lambda PI: PI.lock_counts()))
+    elif option['collect_postgres_locks']:
+        sections.append(('locks', lambda PI: PI.locks()))
+
+    sections.append(('version', lambda PI: PI.version()))
+    sections.append(('server', lambda PI: PI.server_stats()))
+    sections.append(('database', lambda PI: PI.db_stats()))
+    sections.append(('bgwriter', lambda PI: PI.bgwriter_stats()))
+    sections.append(('backends', lambda PI: PI.backends()))
+    sections.append(('replication', lambda PI: PI.replication()))
+    sections.append(('replication_conflicts', lambda PI: PI.replication_conflicts()))
+
+    return sections
+
+
+def profiled_section(profiler, name, fn):
+    def run(PI):
+        with profiler.section(name):
+            result = fn(PI)
+        # Streaming results do their work while being consumed
+        if isinstance(result, types.GeneratorType):
+            return profiler.iter_section(name, result)
+        return result
+    return run
+
+
+def run_sections(db, sections, profiler=None):
+    """
+    Runs the (name, callable) sections one after another on db
+
+    With --pipeline-queries, the queries of the independent sections are first sent together (see DB.run_queries).
+    """
+    if option['pipeline_queries']:
+        queries = planned_queries(db, [(name, fn) for name, fn in sections if name not in DEPENDENT_SECTIONS],
+                                  PostgresInformation)
+        if profiler:
+            with profiler.section('postgres.pipeline'):
+                db.prefetch(queries)
+        else:
+            db.prefetch(queries)
+
+    if profiler:
+        sections = [(name, profiled_section(profiler, 'postgres.' + name, fn)) for name, fn in sections]
 
-    Returns a groomed version of all info ready for posting to the web
-"""
     PI = PostgresInformation(db)
+    try:
+        return dict((name, fn(PI)) for name, fn in sections)
+    finally:
+        if option['pipeline_queries']:
+            db.discard_prefetched()
+
+
+def dedupe_texts(rows, field, text_registry):
+    for row in rows:
+        text = row.pop(field)
+        if text is None:
+            text_registry.reference(row[field + '_hash'], kind=field)
+        else:
+            row[field + '_hash'] = text_registry.add(text, kind=field)
 
-    info = {}
-    schema = {}
 
+def client_schema(results, schema_fingerprints=None, text_registry=None):
+    """ Builds the schema records out of the results of the schema sections, removing them from results """
     table_bloat_stats = {}
     index_bloat_stats = {}
 
+    if 'bloat' in results:
+        results['table_bloat'], results['index_bloat'] = results.pop('bloat')
+
     if option['collect_postgres_bloat']:
-        for row in PI.table_bloat():
+        for row in results.pop('table_bloat'):
             table_bloat_stats[row['oid']] = row['wasted_bytes']
 
-        for row in PI.index_bloat():
+        for row in results.pop('index_bloat'):
             index_bloat_stats[row['index_oid']] = row['wasted_bytes']
 
-    for row in PI.relations(option['collect_postgres_views']):
-        oid = row.pop('oid')
-        schema[oid] = dict((k, row[k]) for k in ('schema_name', 'table_name', 'relation_type'))
-        schema[oid]['stats'] = dict((k, row[k]) for k in set(row.keys()) - set(['relid', 'relname', 'schema_name', 'schemaname', 'table_name', 'relation_type']))
-        schema[oid]['stats']['wasted_bytes'] = table_bloat_stats.get(oid)
-        schema[oid]['columns'] = []
-        schema[oid]['indices'] = []
-        schema[oid]['constraints'] = []
-
-    if option['collect_postgres_views']:
-        for row in PI.view_definitions():
-            schema[row['oid']]['view_definition'] = row['view_definition']
-
-    for row in PI.columns(option['collect_postgres_views']):
-        oid = row.pop('oid')
-        schema[oid]['columns'].append(row)
-
-    for row in PI.indexes(option['collect_postgres_views']):
-        oid = row.pop('oid')
-        row['wasted_bytes'] = index_bloat_stats.get(row.pop('index_oid'))
-        schema[oid]['indices'].append(row)
-
-    for row in PI.constraints():
-        oid = row.pop('oid')
-        schema[oid]['constraints'].append(row)
-
-    # Populate result dictionary
-    info['schema']   = schema.values()
-    info['version']  = PI.version()
-    info['server']   = PI.server_stats()
-    info['database'] = PI.db_stats()
-    info['bgwriter'] = PI.bgwriter_stats()
-    info['backends'] = PI.backends()
-    info['replication']           = PI.replication()
-    info['replication_conflicts'] = PI.replication_conflicts()
+    view_definitions = results.pop('view_definitions', None)
+    if view_definitions and text_registry:
+        dedupe_texts(view_definitions, 'view_definition', text_registry)
 
-    if option['collect_postgres_functions']:
-        info['functions'] = PI.functions()
+    relations = results.pop('relations')
+    if schema_fingerprints:
+        # The fingerprints are taken before the other sections run, outside of their snapshot. Relations
+        # created in between would be sent without their definitions, they are left for the next run.
+        relations = [row for row in relations if schema_fingerprints.fingerprinted(row['oid'])]
 
-    if option['collect_postgres_settings']:
-        info['settings'] = PI.settings()
+    return list(assemble_schema(
+        relations, results.pop('columns'), results.pop('indexes'), results.pop('constraints'),
+        results.pop('index_stats', None), view_definitions, table_bloat_stats, index_bloat_stats,
+        schema_fingerprints.unchanged_since if schema_fingerprints else None))
+
+
+def fetch_postgres_information(db, pool=None, schema_fingerprints=None, collected_at=None, text_registry=None,
+                               bloat_estimator=None, profiler=None, scope=None, size_cache=None):
+    """
+    Fetches information about the Postgres installation
+
+    scope restricts the result to the server-wide ('server') or the per-database ('database') sections.
+    Returns a groomed version of all info ready for posting to the web
+"""
+    if scope == 'server':
+        sections = [(name, fn) for name, fn in postgres_sections() if name in SERVER_SECTIONS]
+        return run_sections(db, sections, profiler)
+
+    changed_oids = None
+    if schema_fingerprints:
+        fingerprints = PostgresInformation(db).relation_fingerprints(option['collect_postgres_views'])
+        changed_oids = schema_fingerprints.changed_oids(fingerprints, collected_at)
+
+    known_hashes = None
+    if text_registry:
+        known_hashes = dict((field, text_registry.known_hashes(field)) for field in ('view_definition', 'source'))
+    # Older versions lack json_build_object()
+    server_schema = option['schema_engine'] == 'server' and db.version_numeric >= 90400
+    sections = postgres_sections(changed_oids, known_hashes, bloat_estimator, collected_at, server_schema)
+    if scope == 'database':
+        sections = [(name, fn) for name, fn in sections if name not in SERVER_SECTIONS]
+
+    if pool:
+        if profiler:
+            sections = [(name, profiled_section(profiler, 'postgres.' + name, fn)) for name, fn in sections]
+        results = pool.run(sections)
+    else:
+        results = run_sections(db, sections, profiler)
+
+    info = {}
+
+    if size_cache and 'relations' in results:
+        if profiler:
+            with profiler.section('postgres.relation_sizes'):
+                size_cache.apply(PostgresInformation(db), results['relations'], collected_at)
+        else:
+            size_cache.apply(PostgresInformation(db), results['relations'], collected_at)
+
+    if server_schema:
+        info['schema'] = [RawJSON(str(row['document'])) for row in results.pop('schema')]
+    else:
+        info['schema'] = client_schema(results, schema_fingerprints, text_registry)
+
+    if text_registry and 'functions' in results:
+        dedupe_texts(results['functions'], 'source', text_registry)
 
-    if option['collect_postgres_locks']:
-        info['locks']    = PI.locks()
+    if 'lock_counts' in results:
+        results['locks'], results['lock_summary'] = summarize_locks(results['locks'], results.pop('lock_counts'))
+
+    # Remaining sections are passed through as-is
+    info.update(results)
 
     return info
 
 
+# Stands in for a RawJSON document while encoding. Texts from Postgres can't contain NUL, so it can't clash.
+RAW_JSON_PLACEHOLDER = re.compile(r'"\\u0000raw-json-(\d+)\\u0000"')
+
+
 class DatetimeEncoder(json.JSONEncoder):
 
+    def __init__(self, *args, **kwargs):
+        json.JSONEncoder.__init__(self, *args, **kwargs)
+        self.raw_json = []
+
+    def encode(self, obj):
+        self.raw_json = []
+        encoded = json.JSONEncoder.encode(self, obj)
+        if not self.raw_json:
+            return encoded
+        return RAW_JSON_PLACEHOLDER.sub(lambda m: self.raw_json[int(m.group(1))], encoded)
+
     def default(self, obj):
         if isinstance(obj, datetime.datetime):
             return str(obj)
 
+        # Encoded already, put in after encoding everything else
+        if isinstance(obj, RawJSON):
+            self.raw_json.append(obj.text)
+            return '\x00raw-json-%d\x00' % (len(self.raw_json) - 1)
+
+        # Result rows from DB.run_query
+        if isinstance(obj, collections.Mapping):
+            return dict(obj.iteritems())
+
         return json.JSONEncoder.default(self, obj)
 
 
-def post_data_to_web(data):
+def post_metadata(server, collected_at):
+    metadata = {}
+    metadata['api_key'] = server.dbconf['api_key']
+    metadata['collected_at'] = collected_at
+    metadata['collected_from'] = server.dbconf['host']
+    metadata['submitter'] = "%s %s" % (MYNAME, VERSION)
+    metadata['system_information'] = server.systeminformation
+    metadata['query_source'] = server.query_source
+    metadata['no_reset'] = True
+    return metadata
+
+
+def post_data_to_web(data, server, collected_at):
+    if option['streaming_upload'] and not option['dryrun']:
+        return stream_data_to_web(data, server, collected_at)
+
+    if option['upload_protocol'] == 'binary' and not option['dryrun']:
+        return post_binary_data_to_web(data, server, collected_at)
+
+    profiler = server.profiler
+
     to_post = {}
 
     if option['compression_enabled'] and compressor_lib:
         logger.debug("Compressing data using %s", compressor_lib)
-        data = json.dumps(data, cls=DatetimeEncoder)
-        to_post['data'] = compressor.compress(data)
+        with profiler.phase('encode'):
+            data = json.dumps(data, cls=DatetimeEncoder)
+        with profiler.phase('compress'):
+            to_post['data'] = compressor.compress(data)
         to_post['data_compressor'] = compressor_lib
     elif not option['jsonendpoint']:
         # only 'data' is in json format
-        data = json.dumps(data, cls=DatetimeEncoder)
+        with profiler.phase('encode'):
+            data = json.dumps(data, cls=DatetimeEncoder)
         to_post['data'] = data
     else:
         to_post['data'] = data
 
-    to_post['api_key'] = dbconf['api_key']
-    to_post['collected_at'] = calendar.timegm(time.gmtime())
-    to_post['collected_from'] = dbconf['host']
-    to_post['submitter'] = "%s %s" % (MYNAME, VERSION)
-    to_post['system_information'] = option['systeminformation']
-    to_post['query_source'] = option.get('query_source')
-    to_post['no_reset'] = True
+    to_post.update(post_metadata(server, collected_at))
 
     if option['dryrun']:
         logger.info("Dumping data that would get posted")
@@ -237,50 +691,399 @@ def post_data_to_web(data):
         logger.info("Exiting.")
         sys.exit(0)
 
-    errors = {}
+    if option['jsonendpoint']:
+        headers = {"Content-Type": "application/json"}
+        body = json.dumps(to_post, cls=DatetimeEncoder)
+    else:
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        body = urllib.urlencode(to_post)
 
-    for api_url in dbconf['api_url']:
+    return post_to_endpoints(server, headers, body)
+
+
+def post_binary_data_to_web(data, server, collected_at):
+    profiler = server.profiler
+    compress = option['compression_enabled'] and compressor_lib
+
+    with profiler.phase('encode'):
+        body = json.dumps(data, cls=DatetimeEncoder)
+    if compress:
+        logger.debug("Compressing data using %s", compressor_lib)
+        with profiler.phase('compress'):
+            body = compressor.compress(body)
+
+    headers = Upload.binary_headers(post_metadata(server, collected_at), compress)
+
+    return post_to_endpoints(server, headers, body)
+
+
+def post_to_endpoints(server, headers, body):
+    """ Sends one encoded body to all API endpoints at the same time """
+    for api_url in server.dbconf['api_url']:
         logger.info('Sending to %s', api_url)
 
+    with server.profiler.phase('upload'):
+        results = Upload.post_all(server.endpoints, headers, body)
+
+    errors = {}
+    for api_url, code, message in results:
+        check_response(errors, api_url, code, message)
+
+    return errors
+
+
+def stream_data_to_web(data, server, collected_at):
+    """
+    Encodes, compresses and sends the snapshot piece by piece
+
+    Memory use is bounded by the chunk size instead of the size of the encoded snapshot.
+    """
+    profiler = server.profiler
+    metadata = post_metadata(server, collected_at)
+    compress = option['compression_enabled'] and compressor_lib
+    default = DatetimeEncoder().default
+
+    # The steps are interleaved, so their times are taken while the pieces are produced
+    def encoded(obj):
+        return Upload.buffered(profiler.iter_phase('encode', Upload.iterencode(obj, default)))
+
+    def compressed(chunks):
+        return profiler.iter_phase('compress', Upload.compressed(chunks))
+
+    errors = {}
+
+    # Every endpoint gets its own pass over the data, so memory use stays bounded
+    for endpoint in server.endpoints:
+        api_url = endpoint.url
+        logger.info('Streaming to %s', api_url)
+
+        # Generators can only be consumed once, so the body is set up again for every endpoint
+        if option['upload_protocol'] == 'binary':
+            headers = Upload.binary_headers(metadata, compress)
+            body = encoded(data)
+            if compress:
+                body = compressed(body)
+        elif option['jsonendpoint']:
+            headers = {"Content-Type": "application/json"}
+            body = encoded(dict(metadata, data=data))
+            if compress:
+                headers['Content-Encoding'] = 'deflate'
+                body = compressed(body)
+        else:
+            headers = {"Content-Type": "application/x-www-form-urlencoded"}
+            fields = dict(metadata)
+            body = encoded(data)
+            if compress:
+                fields['data_compressor'] = compressor_lib
+                body = compressed(body)
+            body = Upload.form_encoded(fields, body)
+
         try:
-            if option['jsonendpoint']:
-                headers = {"Content-Type": "application/json"}
-                req = urllib2.Request(api_url, headers=headers, data=json.dumps(to_post, cls=DatetimeEncoder))
-                res = urllib2.urlopen(req)
+            with profiler.phase('upload'):
+                code, message = endpoint.post(headers, body)
+        except (IOError, httplib.HTTPException) as e:
+            message = str(e)
+            code = 'exception'
+
+        check_response(errors, api_url, code, message)
+
+    return errors
+
+
+def spool_data(data, server, collected_at):
+    """
+    Encodes and compresses the snapshot into the outbox of every API endpoint, then uploads what is spooled
+
+    In daemon mode the upload happens in the background, otherwise right away (unless still backing off).
+    """
+    profiler = server.profiler
+    metadata = post_metadata(server, collected_at)
+    default = DatetimeEncoder().default
+
+    first = None
+    for sender in server.outbox_senders:
+        if first is None:
+            encoded = Upload.buffered(profiler.iter_phase('encode', Upload.iterencode(data, default)))
+            body = profiler.iter_phase('compress', Upload.compressed(encoded))
+            first = (sender.outbox, sender.outbox.put(metadata, body))
+        else:
+            sender.outbox.put(metadata, first[0].read(first[1])[1])
+
+    if option['daemon']:
+        for sender in server.outbox_senders:
+            sender.wake()
+    else:
+        with profiler.phase('upload'):
+            for sender in server.outbox_senders:
+                sender.flush()
+
+
+def spooled_sender(server, endpoint, outbox):
+    """ Returns the function an OutboxSender uses to upload entries of outbox to endpoint """
+    api_url = endpoint.url
+
+    def send(names):
+        if len(names) > 1:
+            logger.info('Sending %d spooled snapshots to %s', len(names), api_url)
+            headers = {'Content-Type': 'application/json', 'Content-Encoding': 'deflate',
+                       'X-Pganalyze-Batch-Size': str(len(names))}
+            snapshots = (outbox.read(name) for name in names)
+            body = Upload.compressed(Upload.batch_body(
+                (metadata, Upload.decompressed(data)) for metadata, data in snapshots))
+        else:
+            logger.info('Sending spooled snapshot to %s', api_url)
+            metadata, body = outbox.read(names[0])
+            if option['upload_protocol'] == 'binary':
+                headers = Upload.binary_headers(metadata, True)
             else:
-                # FIXME: urllib doesn't do any SSL verification
-                res = urllib.urlopen(api_url, urllib.urlencode(to_post))
+                headers = {"Content-Type": "application/x-www-form-urlencoded"}
+                body = Upload.form_encoded(dict(metadata, data_compressor='zlib'), body)
 
-            message = res.read()
-            code = res.getcode()
-        except IOError as e:
+        try:
+            code, message = endpoint.post(headers, body)
+        except (IOError, httplib.HTTPException) as e:
             message = str(e)
             code = 'exception'
 
-        if not option['quiet']:
-            logger.info("Got %s while posting data: %s" % (code, message))
+        errors = {}
+        check_response(errors, api_url, code, message)
+        if errors:
+            logger.error("Rejected by server:\n%s" % pformat(errors))
+        return not errors
 
-        if code != 200 or message == 'ERROR: Invalid API key':
-            errors[api_url] = {'code': code, 'message': message}
+    return send
 
-    return errors
+
+def check_response(errors, api_url, code, message):
+    if not option['quiet']:
+        logger.info("Got %s while posting data: %s" % (code, message))
+
+    if code != 200 or message == 'ERROR: Invalid API key':
+        errors[api_url] = {'code': code, 'message': message}
 
 
-def fetch_query_information():
+def fetch_query_information(db, statement_deltas=None, collected_at=None, text_registry=None):
     query = "SELECT extname FROM pg_extension"
 
-    extensions = map(lambda q: q['extname'], db.run_query(query))
+    extensions = map(lambda q: q['extname'], db.run_query(query, cached=True))
     if 'pg_stat_statements' in extensions:
         logger.debug("Found pg_stat_statements, using it for query information")
-        return ['pg_stat_statements', PgStatStatements(db).fetch_queries()]
     else:
         logger.debug("Trying to enable pg_stat_statements...")
         db.run_query("CREATE EXTENSION IF NOT EXISTS pg_stat_statements", commit = True)
-        return ['pg_stat_statements', PgStatStatements(db).fetch_queries()]
+        db.invalidate_cache()
+
+    queries = PgStatStatements(db).fetch_queries(statement_deltas, collected_at, text_registry, option['all_databases'])
+    return ['pg_stat_statements', queries]
+
+
+def fetch_all_databases(server, collected_at, queries):
+    """
+    Collects the per-database sections of every database of the server, splitting queries up by dbid
+
+    At most --database-concurrency databases are collected at a time, each over its own connection
+    that is closed again afterwards, so the number of connections stays small.
+    """
+    queries_by_dbid = {}
+    for row in queries or []:
+        queries_by_dbid.setdefault(row.pop('dbid'), []).append(row)
+
+    tasks = Queue.Queue()
+    for row in PostgresInformation(server.db).databases():
+        tasks.put((row['oid'], row['name']))
+
+    results = []
+    server.collected_databases = []
+
+    def work():
+        while True:
+            try:
+                oid, name = tasks.get_nowait()
+            except Queue.Empty:
+                return
+
+            database = server.databases.get(name)
+            try:
+                if database is None:
+                    database = server.databases[name] = Database(server, name)
+                database.db.ensure_connected()
+                info = fetch_postgres_information(database.db, None, database.schema_fingerprints, collected_at,
+                                                  server.text_registry, database.bloat_estimator, server.profiler,
+                                                  scope='database', size_cache=database.size_cache)
+                # Streaming results have to be consumed before the connection goes away
+                for key, value in info.items():
+                    if isinstance(value, types.GeneratorType):
+                        info[key] = list(value)
+            except Exception as e:
+                logger.error("Failed to collect database %s: %s", name, e)
+                continue
+            finally:
+                if database:
+                    database.db.close()
+
+            results.append({'oid': oid, 'name': name, 'postgres': info, 'queries': queries_by_dbid.get(oid, [])})
+            server.collected_databases.append(database)
+
+    threads = [threading.Thread(target=work) for i in range(min(option['database_concurrency'], tasks.qsize()))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return sorted(results, key=lambda result: result['name'])
+
+
+def collect_and_post(server):
+    db = server.db
+    profiler = server.profiler
+    collected_at = calendar.timegm(time.gmtime())
+
+    profiler.start(collected_at)
+
+    # Spooled snapshots may have been dropped before delivery since the last run, along with texts and
+    # definitions the ones after them only reference
+    dropped = sum(sender.outbox.take_dropped() for sender in server.outbox_senders)
+    if dropped:
+        logger.warning("%d spooled snapshots were dropped, sending all texts and schema definitions", dropped)
+        server.forget_state()
+
+    if server.text_registry:
+        server.text_registry.start(collected_at)
+
+    data = {}
+    if option['collect_postgres_queries']:
+        with profiler.phase('queries'), profiler.section('queries.fetch_queries'):
+            (server.query_source, data['queries']) = fetch_query_information(db, server.statement_deltas,
+                                                                                collected_at, server.text_registry)
+        if server.statement_deltas:
+            data['query_deltas'] = server.statement_deltas.summary
+
+    if server.systeminformation:
+        with profiler.phase('system'):
+            data['system'] = fetch_system_information(db, profiler)
+
+    with profiler.phase('postgres'):
+        if option['all_databases']:
+            data['postgres'] = fetch_postgres_information(db, profiler=profiler, scope='server')
+            data['databases'] = fetch_all_databases(server, collected_at, data.pop('queries', None))
+        else:
+            data['postgres'] = fetch_postgres_information(db, server.pool, server.schema_fingerprints, collected_at,
+                                                          server.text_registry, server.bloat_estimator, profiler,
+                                                          size_cache=server.size_cache)
+
+    if server.activity_sampler:
+        data['activity'] = server.activity_sampler.snapshot()
+
+    if server.text_registry:
+        # Full texts for all hashes referenced for the first time in this snapshot
+        data['texts'] = server.text_registry.new_texts
+
+    # End the read transaction, otherwise a long-lived connection would keep
+    # seeing the same statistics snapshot and sit idle in transaction
+    db.rollback()
+
+    if db.wire_recorder:
+        db.wire_recorder.save(option['record_wire'])
+
+    data['collector_stats'] = profiler.stats()
+
+    if server.exporter:
+        server.exporter.update(data, collected_at)
+
+    if server.outbox_senders:
+        # Once spooled the snapshot is as good as delivered, the outbox keeps retrying. If it
+        # drops the snapshot instead, the next run starts over with full texts and definitions.
+        spool_data(data, server, collected_at)
+        errors = None
+    else:
+        errors = post_data_to_web(data, server, collected_at)
+    logger.debug("Collection phases took (seconds): %s", profiler.phases)
+    if not errors:
+        server.commit_state()
+        if not option['quiet']:
+            logger.info("Spooled successfully" if server.outbox_senders else "Submitted successfully")
+    else:
+        logger.error("Rejected by servers:\n%s" % pformat(errors))
+
+
+def run_daemon(server):
+    def job():
+        try:
+            server.db.ensure_connected()
+            collect_and_post(server)
+        except Exception as e:
+            logger.error("Collection failed: %s", e)
+            # Start over with fresh connections on the next run
+            server.reset_connections()
+
+    scheduler = Scheduler(option['interval'])
+    scheduler.install_signal_handlers()
+
+    logger.info("Running as daemon, collecting every %d seconds", option['interval'])
+    scheduler.run_forever(job)
+
+    server.reset_connections()
+
+
+def fleet_job(servers, dbconf):
+    def job():
+        server = servers.get(dbconf['name'])
+        try:
+            if server is None:
+                server = Server(dbconf)
+                if server.db.version_numeric < 90200:
+                    server.reset_connections()
+                    raise Exception("To use the collector you must have at least Postgres 9.2 or newer")
+                servers[dbconf['name']] = server
+
+            server.db.ensure_connected()
+            collect_and_post(server)
+        except Exception:
+            if server:
+                # Start over with fresh connections on the next run
+                server.reset_connections()
+            raise
+    return job
+
+
+def fleet_cancel(servers, name):
+    def cancel():
+        if name in servers:
+            servers[name].cancel()
+    return cancel
+
+
+def run_fleet(dbconfs):
+    fleet = Fleet(option['max_concurrency'])
+    fleet.install_signal_handlers()
+
+    servers = {}
+    for dbconf in dbconfs:
+        fleet.add(dbconf['name'], dbconf.get('interval', option['interval']),
+                  dbconf.get('timeout', option['server_timeout']), fleet_job(servers, dbconf),
+                  fleet_cancel(servers, dbconf['name']))
+
+    logger.info("Running in fleet mode for %d servers, at most %d at a time", len(dbconfs), option['max_concurrency'])
+    fleet.run_forever()
+
+    for server in servers.values():
+        server.reset_connections()
+
+
+def setup_exporter():
+    host, _, port = option['http_exporter'].rpartition(':')
+    try:
+        exporter = MetricsExporter(host, int(port), option['exporter_max_series'])
+    except (ValueError, socket.error) as e:
+        logger.error("Could not listen on %s for --http-exporter: %s", option['http_exporter'], e)
+        sys.exit(1)
+
+    exporter.start()
+    return exporter
 
 
 def main():
-    global option, logger, dbconf, db
+    global option, logger
 
     option = parse_options()
     logger = configure_logger()
@@ -291,31 +1094,51 @@ def main():
         c.write()
         sys.exit(0)
 
-    dbconf = c.read()
-    db     = setup_database()
+    if option['outbox'] and option['jsonendpoint']:
+        logger.error("--outbox can't be combined with --json-endpoint")
+        sys.exit(1)
 
-    if db.version_numeric < 90200:
-        logger.error("To use the collector you must have at least Postgres 9.2 or newer")
+    if option['sample_activity'] and not option['daemon']:
+        logger.error("--sample-activity requires --daemon, --http-exporter or --fleet")
         sys.exit(1)
 
-    if is_remote_system():
-        option['systeminformation'] = False
+    if option['schema_engine'] == 'server' and (option['incremental_schema'] or option['dedupe_texts'] or
+                                                option['client_side_bloat'] or option['cached_sizes']):
+        logger.error("--schema-engine server can't be combined with --incremental-schema, --dedupe-texts, "
+                     "--client-side-bloat or --cached-sizes")
+        sys.exit(1)
 
-    data = {}
-    if option['collect_postgres_queries']:
-        (option['query_source'], data['queries']) = fetch_query_information()
+    if option['record_wire'] and db_driver != 'pg8000':
+        logger.error("--record-wire requires the pg8000 driver, psycopg2 is in use")
+        sys.exit(1)
 
-    if option['systeminformation']:
-        data['system'] = fetch_system_information()
+    # Recordings are kept in memory until the end of the run, long-running modes would grow them forever
+    if option['record_wire'] and option['daemon']:
+        logger.error("--record-wire can't be combined with --daemon, --http-exporter or --fleet")
+        sys.exit(1)
 
-    data['postgres'] = fetch_postgres_information()
+    if option['fleet']:
+        if option['http_exporter']:
+            logger.error("--http-exporter can't be combined with --fleet yet")
+            sys.exit(1)
+        run_fleet(c.read_fleet())
+        return
 
-    errors = post_data_to_web(data)
-    if not errors:
-        if not option['quiet']:
-            logger.info("Submitted successfully")
+    dbconf = c.read()
+    server = Server(dbconf)
+
+    if server.db.version_numeric < 90200:
+        logger.error("To use the collector you must have at least Postgres 9.2 or newer")
+        sys.exit(1)
+
+    if option['http_exporter']:
+        server.exporter = setup_exporter()
+
+    if option['daemon']:
+        run_daemon(server)
     else:
-        logger.error("Rejected by servers:\n%s" % pformat(errors))
+        collect_and_post(server)
+        server.reset_connections()
 
 
 if __name__ == '__main__':
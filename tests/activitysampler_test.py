@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.ActivitySampler import ActivitySampler, sample_query
+
+
+def group(state, backends, wait_event_type=None, wait_event=None, pid=None, seconds=None):
+    return {'state': state, 'wait_event_type': wait_event_type, 'wait_event': wait_event, 'backends': backends,
+            'longest_xact_pid': pid, 'longest_xact_seconds': seconds, 'longest_xact_query_id': None}
+
+
+class TestActivitySampler(unittest.TestCase):
+    def setUp(self):
+        self.sampler = ActivitySampler(None, bucket_seconds=10, buffer_size=3)
+
+    def test_samples_are_summed_up_per_bucket(self):
+        self.sampler.add_sample([group('active', 2, 'Lock', 'transactionid', 101, 3.0), group('idle', 5)], 1000)
+        self.sampler.add_sample([group('active', 3, 'Lock', 'transactionid', 101, 4.0)], 1009)
+        self.sampler.add_sample([group('idle in transaction', 1, pid=102, seconds=60.0)], 1010)
+
+        buckets = self.sampler.snapshot(1015)
+        self.assertEqual([{
+            'start': 1000, 'seconds': 10, 'samples': 2,
+            'states': {'active': 5, 'idle': 5},
+            'wait_events': {'Lock:transactionid': 5},
+            'longest_transactions': [{'pid': 101, 'seconds': 4.0, 'state': 'active', 'query_id': None}],
+        }], buckets)
+
+        # The bucket still being filled is sent once it is over
+        self.assertEqual([1000, 1010], [b['start'] for b in self.sampler.snapshot(1020)])
+
+    def test_buckets_are_kept_until_committed(self):
+        for now in range(1000, 1060, 10):
+            self.sampler.add_sample([group('active', 1)], now)
+
+        self.assertEqual([1020, 1030, 1040], [b['start'] for b in self.sampler.snapshot(1055)])
+        self.sampler.add_sample([group('active', 1)], 1060)
+        self.sampler.commit()
+        self.assertEqual([1050], [b['start'] for b in self.sampler.snapshot(1065)])
+
+    def test_query_matches_server_version(self):
+        self.assertTrue('WHEN waiting' in sample_query(90500))
+        self.assertTrue('wait_event_type, wait_event' in sample_query(90600))
+        self.assertTrue('array_agg(query_id' in sample_query(140000))
+        self.assertTrue('pganalyze.get_stat_activity()' in sample_query(90500, stat_activity_helper=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
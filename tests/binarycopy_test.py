@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import struct
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'vendor'))
+from pg8000 import core
+from pgacollector.BinaryCopy import BinaryCopyParser, SIGNATURE, compile_copy_decoder, numeric_recv
+from pgacollector.RowDecoder import uint4_recv
+from pgacollector.WireRecording import join_data_row
+
+PG_TYPES = {
+    18: (core.FC_TEXT, lambda d, o, l: unicode(d[o:o + l], 'utf-8')),
+    19: (core.FC_BINARY, lambda d, o, l: unicode(d[o:o + l], 'utf-8')),
+    20: (core.FC_BINARY, core.int8_recv),
+    22: (core.FC_TEXT, lambda d, o, l: map(int, d[o:o + l].split())),
+    26: (core.FC_BINARY, uint4_recv),
+    1700: (core.FC_TEXT, lambda d, o, l: float(d[o:o + l])),
+}
+
+
+def numeric(ndigits, weight, sign, dscale, digits):
+    return struct.pack('!hhHh', ndigits, weight, sign, dscale) + struct.pack('!%dh' % ndigits, *digits)
+
+
+def row_desc(*type_oids):
+    return [{'type_oid': type_oid} for type_oid in type_oids]
+
+
+class TestBinaryCopy(unittest.TestCase):
+    def test_parses_tuples_split_across_writes(self):
+        decode = compile_copy_decoder(row_desc(26, 19, 20, 18, 1700), PG_TYPES)
+        data = SIGNATURE + struct.pack('!ii', 0, 0)
+        for i in range(3):
+            data += join_data_row([struct.pack('!I', 16384 + i), 'users_%d' % i, None if i == 1 else struct.pack('!q', i),
+                                   'v', numeric(2, 0, 0x4000 if i else 0, 2, [12, 5000])])
+        data += '\xff\xff'
+
+        for chunk_size in (len(data), 7):
+            parser = BinaryCopyParser(decode)
+            for offset in range(0, len(data), chunk_size):
+                parser.write(data[offset:offset + chunk_size])
+
+            self.assertEqual([[16384, u'users_0', 0, u'v', 12.5],
+                              [16385, u'users_1', None, u'v', -12.5],
+                              [16386, u'users_2', 2, u'v', -12.5]], parser.finish())
+
+    def test_numeric_and_unsupported_types(self):
+        self.assertEqual(123450000.0, numeric_recv(numeric(2, 2, 0, 0, [1, 2345]), 0, 12))
+        self.assertEqual(0.0012, numeric_recv(numeric(1, -1, 0, 4, [12]), 0, 10))
+        nan = numeric_recv(numeric(0, 0, 0xC000, 0, []), 0, 8)
+        self.assertTrue(nan != nan)
+
+        # int2vector is only decoded from text
+        self.assertEqual(None, compile_copy_decoder(row_desc(26, 22), PG_TYPES))
+
+    def test_incomplete_data_fails(self):
+        parser = BinaryCopyParser(compile_copy_decoder(row_desc(20), PG_TYPES))
+        parser.write(SIGNATURE + struct.pack('!ii', 0, 0) + join_data_row([struct.pack('!q', 1)])[:-3])
+
+        self.assertRaises(ValueError, parser.finish)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.BloatEstimator import BloatEstimator, table_tuple_width, table_bloat
+from helpers import MemoryState, StubInformation
+
+
+class TestBloatEstimator(unittest.TestCase):
+    def test_table_estimate_matches_query(self):
+        # datahdr = 9 + 24 = 33, aligned to 40, plus 0.5 * nullhdr 24 plus 4
+        width = table_tuple_width([(0.0, 4), (0.5, 10)])
+        self.assertEqual(56, width)
+
+        # ceil(1000 * 56 / 8172) = 7 pages expected, 10 pages used
+        self.assertEqual({'table_bytes': 81920, 'expected_bytes': 57344, 'wasted_bytes': 24576},
+                         table_bloat(width, 1000.0, 10, 8192))
+
+    def test_missing_statistics(self):
+        self.assertEqual(None, table_tuple_width([(0.0, 4), (None, None)]))
+
+    def test_widths_are_refreshed_in_rotation(self):
+        state = MemoryState()
+        PI = StubInformation()
+
+        tables, indexes = BloatEstimator(state, 3600, 600).estimate(PI, 0)
+        self.assertEqual(range(1, 13), PI.requested[-1])
+        self.assertEqual(12, len(tables))
+        self.assertEqual(12, len(indexes))
+        self.assertEqual(24576, tables[0]['wasted_bytes'])
+
+        # Each later run refreshes a sixth of the tables, oldest first
+        seen = set()
+        for collected_at in range(600, 3600, 600):
+            tables, indexes = BloatEstimator(state, 3600, 600).estimate(PI, collected_at)
+            self.assertEqual(2, len(PI.requested[-1]))
+            seen.update(PI.requested[-1])
+            self.assertEqual(12, len(tables))
+        self.assertEqual(10, len(seen))
+
+
+if __name__ == '__main__': unittest.main()
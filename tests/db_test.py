@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import re
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'vendor'))
+from pgacollector.DB import DB
+
+MARKER = '/* pganalyze-collector */'
+EXTENSIONS = 'SELECT extname FROM pg_extension'
+
+RESULTS = {
+    'SHOW server_version_num': ([('server_version_num',)], [('90500',)]),
+    EXTENSIONS: ([('extname',)], [('pg_stat_statements',)]),
+    'SELECT relname FROM pg_class': ([('relname',)], [('t%d' % i,) for i in range(5)]),
+}
+
+
+class StubSocket():
+    def __init__(self):
+        self.timeout = None
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+
+class StubCursor():
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rows = None
+
+    def execute(self, operation, params=None):
+        query = operation[len(MARKER):]
+        cursors = self.connection.cursors
+        declare = re.match(r'DECLARE (\w+) NO SCROLL CURSOR FOR (.*)', query)
+        fetch = re.match(r'FETCH FORWARD (\d+) FROM (\w+)', query)
+        close = re.match(r'CLOSE (\w+)', query)
+
+        if declare and declare.group(1) not in cursors and declare.group(2) in RESULTS:
+            description, rows = RESULTS[declare.group(2)]
+            cursors[declare.group(1)] = (description, list(rows))
+            self.description = None
+        elif fetch and fetch.group(2) in cursors:
+            self.description, rows = cursors[fetch.group(2)]
+            self.rows = rows[:int(fetch.group(1))]
+            del rows[:int(fetch.group(1))]
+        elif close and close.group(1) in cursors:
+            del cursors[close.group(1)]
+            self.description = None
+        elif query in RESULTS:
+            self.description, self.rows = RESULTS[query]
+        else:
+            raise Exception('relation "%s" does not exist' % query)
+        self.connection.queries.append(query)
+
+    def fetchall(self):
+        return list(self.rows)
+
+
+class StubConnection():
+    """ Answers the queries in RESULTS, remembering which ones were run """
+
+    def __init__(self):
+        self.queries = []
+        self.closed = False
+        self._usock = StubSocket()
+        # Rows left in each open server-side cursor
+        self.cursors = {}
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class TestDB(unittest.TestCase):
+    def setUp(self):
+        self.methods = dict((name, DB.__dict__[name]) for name in ('_connect_with_kw', '_register_pg_type_wrappers'))
+        DB._connect_with_kw = lambda db, kw: StubConnection()
+        DB._register_pg_type_wrappers = lambda db: None
+        self.db = DB('postgres', 'pganalyze-collector', exit_on_error=False, cache_ttl=60)
+
+    def tearDown(self):
+        for name, method in self.methods.items():
+            setattr(DB, name, method)
+
+    def test_cached_results_are_reused_until_they_expire(self):
+        conn = self.db.conn
+        first = self.db.run_query(EXTENSIONS, cached=True)
+        self.assertTrue(first is self.db.run_query(EXTENSIONS, cached=True))
+        self.assertEqual(1, conn.queries.count(EXTENSIONS))
+
+        # Uncached queries always go to the server
+        self.assertEqual([{'extname': 'pg_stat_statements'}], self.db.run_query(EXTENSIONS))
+        self.assertEqual(2, conn.queries.count(EXTENSIONS))
+
+        fetched_at, result = self.db.query_cache[EXTENSIONS]
+        self.db.query_cache[EXTENSIONS] = (fetched_at - 61, result)
+        self.assertEqual(first, self.db.run_query(EXTENSIONS, cached=True))
+        self.assertEqual(3, conn.queries.count(EXTENSIONS))
+
+        self.db.invalidate_cache()
+        self.db.run_query(EXTENSIONS, cached=True)
+        self.assertEqual(4, conn.queries.count(EXTENSIONS))
+
+    def test_reconnect_starts_with_an_empty_cache(self):
+        self.db.run_query(EXTENSIONS, cached=True)
+        conn = self.db.conn
+        self.db.ensure_connected()
+        self.assertTrue(conn is self.db.conn)
+
+        self.db.close()
+        self.assertTrue(conn.closed)
+        self.assertEqual(None, self.db.conn)
+        self.db.close()
+
+        self.db.ensure_connected()
+        self.assertFalse(conn is self.db.conn)
+        self.assertEqual(90500, self.db.version_numeric)
+        self.assertEqual(['SHOW server_version_num'], self.db.conn.queries)
+        self.assertFalse(EXTENSIONS in self.db.query_cache)
+
+    def test_timeout_applies_to_clones(self):
+        db = DB('postgres', 'pganalyze-collector', exit_on_error=False, timeout=5)
+        clone = db.clone()
+
+        self.assertEqual(5, db.conn._usock.timeout)
+        self.assertEqual(5, clone.conn._usock.timeout)
+        self.assertEqual(None, self.db.conn._usock.timeout)
+
+    def test_closed_cursor_names_are_reused(self):
+        conn = self.db.conn
+        del conn.queries[:]
+        first = self.db.iter_query('SELECT relname FROM pg_class', batch_size=2)
+        second = self.db.iter_query('SELECT relname FROM pg_class', batch_size=2)
+
+        # Both open at the same time, like columns and indexes while the schema is assembled
+        self.assertEqual('t0', next(first)['relname'])
+        self.assertEqual('t0', next(second)['relname'])
+        self.assertEqual(['pganalyze_cursor', 'pganalyze_cursor_1'], sorted(conn.cursors))
+        self.assertEqual(5, len(list(first)) + 1)
+        self.assertEqual(5, len(list(second)) + 1)
+        self.assertEqual({}, conn.cursors)
+
+        self.assertEqual(5, len(list(self.db.iter_query('SELECT relname FROM pg_class', batch_size=2))))
+        self.assertEqual(set(['DECLARE pganalyze_cursor NO SCROLL CURSOR FOR SELECT relname FROM pg_class',
+                              'DECLARE pganalyze_cursor_1 NO SCROLL CURSOR FOR SELECT relname FROM pg_class',
+                              'FETCH FORWARD 2 FROM pganalyze_cursor', 'FETCH FORWARD 2 FROM pganalyze_cursor_1',
+                              'CLOSE pganalyze_cursor', 'CLOSE pganalyze_cursor_1']), set(conn.queries))
+
+    def test_errors_are_raised_instead_of_exiting(self):
+        self.assertRaises(Exception, self.db.run_query, 'SELECT 1')
+        self.assertEqual(1, len(self.db.run_query(EXTENSIONS)))
+
+
+if __name__ == '__main__':
+    unittest.main()
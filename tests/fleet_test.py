@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.Fleet import Fleet
+from pgacollector.Configuration import Configuration
+
+
+def run_for(fleet, seconds):
+    thread = threading.Thread(target=fleet.run_forever)
+    thread.start()
+    time.sleep(seconds)
+    fleet.stop()
+    thread.join()
+
+
+class TestFleet(unittest.TestCase):
+    def test_concurrency_limit(self):
+        fleet = Fleet(2)
+        lock = threading.Lock()
+        state = {'running': 0, 'max_running': 0, 'runs': 0}
+
+        def job():
+            with lock:
+                state['running'] += 1
+                state['runs'] += 1
+                state['max_running'] = max(state['max_running'], state['running'])
+            time.sleep(0.1)
+            with lock:
+                state['running'] -= 1
+
+        for i in range(6):
+            fleet.add('server%d' % i, 0.2, 5, job)
+        run_for(fleet, 0.7)
+
+        self.assertEqual(2, state['max_running'])
+        self.assertTrue(state['runs'] >= 6)
+
+    def test_timeout_cancels_run(self):
+        fleet = Fleet(1)
+        cancelled = threading.Event()
+        runs = []
+
+        def job():
+            runs.append(time.time())
+            cancelled.wait(5)
+
+        fleet.add('slow', 0.5, 1, job, cancelled.set)
+        run_for(fleet, 1.5)
+
+        self.assertTrue(cancelled.is_set())
+        # The slot at 0.5s was skipped while the first run was still going
+        self.assertTrue(len(runs) == 1 or runs[1] - runs[0] >= 1)
+
+    def test_failures_are_contained(self):
+        fleet = Fleet(1)
+        runs = []
+
+        def job():
+            runs.append(1)
+            sys.exit(1)
+
+        fleet.add('broken', 0.1, 5, job)
+        run_for(fleet, 0.35)
+
+        self.assertTrue(len(runs) >= 3)
+
+
+class TestFleetConfiguration(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, content):
+        path = os.path.join(self.directory, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        os.chmod(path, 0600)
+        return path
+
+    def test_reads_sections_and_config_dir(self):
+        main = self.write('main', "[pganalyze]\napi_key: a\ndb_name: one\n\n"
+                                  "[pganalyze:orders]\napi_key: b\ndb_url: postgres://u@orders.example.com/orders\n"
+                                  "interval: 60\ntimeout: 30\n")
+        os.mkdir(os.path.join(self.directory, 'fleet'))
+        self.write('fleet/billing.conf', "[pganalyze]\napi_key: c\ndb_name: billing\n")
+        self.write('fleet/README', "not a config file")
+
+        c = Configuration({'configfile': [main], 'config_dir': os.path.join(self.directory, 'fleet'),
+                           'api_url': 'https://api.pganalyze.com/v1/snapshots'})
+        servers = dict((dbconf['name'], dbconf) for dbconf in c.read_fleet())
+
+        self.assertEqual(['billing', 'main', 'orders'], sorted(servers.keys()))
+        self.assertEqual('orders.example.com', servers['orders']['host'])
+        self.assertEqual((60, 30), (servers['orders']['interval'], servers['orders']['timeout']))
+        self.assertFalse('interval' in servers['billing'])
+
+
+if __name__ == '__main__': unittest.main()
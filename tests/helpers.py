@@ -0,0 +1,89 @@
+# Stand-ins shared by several tests
+
+import struct
+
+from pgacollector.WireRecording import Recording, join_data_row
+
+MARKER = '/* pganalyze-collector */'
+RELATIONS = 'SELECT c.oid, c.relname, n.nspname AS schema_name, c.reltuples FROM pg_class c'
+RELATION = RELATIONS + ' WHERE c.oid = ANY(%s::oid[])'
+SETTINGS = 'SELECT name, setting FROM pg_settings'
+
+
+class MemoryState():
+    """ Keeps components in memory instead of --state-dir """
+
+    def __init__(self):
+        self.components = {}
+
+    def load(self, component):
+        return self.components.get(component, {})
+
+    def save(self, component, data):
+        self.components[component] = data
+
+
+class StubInformation():
+    """
+    Twelve tables (oids 1-12) with one index each (oids 101-112), all with the same statistics
+
+    Measured sizes are oid * 16384, twice the size_bytes of the relations the tests estimate them from,
+    as if every table had as much TOAST as heap.
+    """
+
+    def __init__(self):
+        self.requested = []
+
+    def bloat_relation_sizes(self):
+        tables = [{'oid': oid, 'table_oid': None, 'indkey': None, 'reltuples': 1000.0, 'relpages': 10,
+                   'block_size': 8192} for oid in range(1, 13)]
+        indexes = [{'oid': oid + 100, 'table_oid': oid, 'indkey': '1', 'reltuples': 1000.0, 'relpages': 5,
+                    'block_size': 8192} for oid in range(1, 13)]
+        return tables + indexes
+
+    def bloat_column_stats(self, oids):
+        self.requested.append(sorted(oids))
+        return [row for oid in oids for row in ({'oid': oid, 'attnum': 1, 'null_frac': 0.0, 'avg_width': 4},
+                                                {'oid': oid, 'attnum': 2, 'null_frac': 0.5, 'avg_width': 10})]
+
+    def relation_sizes(self, oids):
+        self.requested.append(sorted(oids))
+        return [{'oid': oid, 'size_bytes': oid * 16384} for oid in oids]
+
+
+def column(name, type_oid, fmt):
+    return {'name': name, 'table_oid': 0, 'column_attrnum': 0, 'type_oid': type_oid,
+            'type_size': -1, 'type_modifier': -1, 'format': fmt}
+
+
+def sample_recording(relations=150, marker='', binary_oids=False):
+    """
+    Recording of the server version, settings and pg_class queries, with the given number of relations
+
+    Queries are recorded with marker prepended, as DB runs them. Like pg8000 requests them, names and texts
+    are in binary format, oids in text format unless the connection uses RowDecoder (binary_oids).
+    """
+    def relation(i):
+        oid = struct.pack('!I', 16384 + i) if binary_oids else str(16384 + i)
+        return join_data_row([oid, 'table_%d' % i, 'public', '%d' % (i * 10)])
+
+    relation_columns = [column('oid', 26, 1 if binary_oids else 0), column('relname', 19, 1),
+                        column('schema_name', 19, 1), column('reltuples', 25, 1)]
+    return Recording({
+        marker + 'SHOW server_version_num': {
+            'columns': [column('server_version_num', 25, 1)],
+            'results': [{'rows': [join_data_row(['90500'])], 'tag': 'SHOW'}],
+        },
+        marker + RELATIONS: {
+            'columns': relation_columns,
+            'results': [{'rows': [relation(i) for i in range(relations)], 'tag': 'SELECT %d' % relations}],
+        },
+        marker + RELATION.replace('%s', '$1'): {
+            'columns': relation_columns,
+            'results': [{'rows': [relation(0)], 'tag': 'SELECT 1'}],
+        },
+        marker + SETTINGS: {
+            'columns': [column('name', 25, 1), column('setting', 25, 1)],
+            'results': [{'rows': [join_data_row(['work_mem', '4096'])], 'tag': 'SELECT 1'}],
+        },
+    })
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import json
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.LockAnalysis import summarize_locks, wait_graph
+
+
+def lock(pid, mode, granted, key='relation:1:16384', blocked_by=None, wait_seconds=None):
+    return {'schema': 'public', 'relation': 'users', 'locktype': 'relation', 'pid': pid, 'mode': mode,
+            'granted': granted, 'lock_key': key, 'blocked_by': blocked_by,
+            'wait_seconds': None if granted else wait_seconds}
+
+
+class TestLockAnalysis(unittest.TestCase):
+    def test_conflicting_modes_block(self):
+        rows = [
+            lock(100, 'AccessExclusiveLock', True),
+            lock(101, 'AccessShareLock', True),
+            lock(200, 'RowExclusiveLock', False),
+            # Waits for 200 to commit, which itself waits for 100
+            lock(200, 'ExclusiveLock', True, key='transactionid:500'),
+            lock(300, 'ShareLock', False, key='transactionid:500'),
+        ]
+
+        self.assertEqual({200: set([100]), 300: set([200])}, wait_graph(rows))
+
+    def test_summary_keeps_participants_and_builds_trees(self):
+        rows = [
+            lock(100, 'AccessExclusiveLock', True),
+            lock(101, 'AccessShareLock', True, key='relation:1:16390'),
+            lock(200, 'RowExclusiveLock', False, blocked_by=[100], wait_seconds=2.5),
+            lock(201, 'AccessShareLock', False, blocked_by=[100, 200], wait_seconds=1.0),
+            lock(300, 'ShareLock', False, key='transactionid:500', blocked_by=[201], wait_seconds=0.5),
+        ]
+        counts = [{'schema': 'public', 'relation': 'users', 'locktype': 'relation', 'mode': 'AccessShareLock',
+                   'granted': True, 'count': 1}]
+
+        participants, summary = summarize_locks(rows, counts)
+
+        self.assertEqual([100, 200, 201, 300], [row['pid'] for row in participants])
+        self.assertFalse('lock_key' in participants[0])
+        self.assertEqual([100, 200], participants[2]['blocked_by'])
+        self.assertEqual(3, summary['waiting'])
+        self.assertEqual(counts, summary['counts'])
+        self.assertEqual([{
+            # 201 waits for both 100 and 200, it is listed once
+            'pid': 100, 'wait_seconds': None, 'blocked_total': 3, 'blocked': [
+                {'pid': 200, 'parent': 100, 'wait_seconds': 2.5},
+                {'pid': 201, 'parent': 200, 'wait_seconds': 1.0},
+                {'pid': 300, 'parent': 201, 'wait_seconds': 0.5},
+            ],
+        }], summary['blocking_trees'])
+
+    def test_long_queue(self):
+        # pg_blocking_pids() lists the waiters queued ahead too, so a queue is a chain as long as itself
+        rows = [lock(100, 'AccessExclusiveLock', True)]
+        rows += [lock(1000 + i, 'ExclusiveLock', False, blocked_by=[100] + range(1000, 1000 + i), wait_seconds=1.0)
+                 for i in range(1500)]
+
+        participants, summary = summarize_locks(rows, [])
+
+        tree, = summary['blocking_trees']
+        self.assertEqual(1500, tree['blocked_total'])
+        self.assertEqual({'pid': 1000, 'parent': 100, 'wait_seconds': 1.0}, tree['blocked'][0])
+        self.assertEqual({'pid': 2499, 'parent': 2498, 'wait_seconds': 1.0}, tree['blocked'][-1])
+        json.dumps(summary)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import urllib2
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.MetricsExporter import MetricsExporter, render
+
+
+def table(name, size_bytes, seq_scan):
+    return {'schema_name': 'public', 'table_name': name, 'relation_type': 'r',
+            'stats': {'size_bytes': size_bytes, 'seq_scan': seq_scan, 'last_vacuum': None}}
+
+
+def snapshot():
+    return {
+        'queries': [{'queryid': 1, 'calls': 10, 'total_time': 5.0},
+                    {'queryid': 2, 'calls': 3, 'total_time': 50.0},
+                    {'queryid': 3, 'calls': 1, 'total_time': 1.0}],
+        'postgres': {
+            'schema': [table('big', 3000, 1), table('medium', 2000, 2), table('sm"all', 1000, 3), table('tiny', 10, 4)],
+            'database': [{'datid': 16384, 'datname': 'app', 'xact_commit': 1234, 'stats_reset': None}],
+            'backends': [{'state': 'active'}, {'state': 'idle'}, {'state': 'idle'}],
+        },
+        'system': {'memory': {'total_bytes': 8589934592}},
+    }
+
+
+class TestMetricsExporter(unittest.TestCase):
+    def test_render(self):
+        lines = render(snapshot(), 1428494400, 2).splitlines()
+
+        self.assertTrue('# TYPE pganalyze_query_calls_total counter' in lines)
+        self.assertTrue('pganalyze_query_calls_total{queryid="2"} 3' in lines)
+        self.assertTrue('pganalyze_query_calls_total{queryid="__other__"} 1' in lines)
+        self.assertTrue('pganalyze_table_seq_scan_total{schema="public",table="big"} 1' in lines)
+        self.assertTrue('pganalyze_table_size_bytes{schema="",table="__other__"} 1010' in lines)
+        self.assertTrue('pganalyze_database_xact_commit{database="app"} 1234' in lines)
+        self.assertTrue('pganalyze_backends{state="idle"} 2' in lines)
+        self.assertTrue('pganalyze_system_memory_total_bytes 8589934592' in lines)
+        self.assertEqual(1, lines.count('# TYPE pganalyze_table_size_bytes gauge'))
+
+    def test_escaping_and_deltas(self):
+        data = snapshot()
+        data['query_deltas'] = {}
+        output = render(data, 1428494400, 10)
+
+        self.assertTrue('table="sm\\"all"' in output)
+        self.assertTrue('# TYPE pganalyze_query_calls_interval gauge' in output)
+
+    def test_all_databases(self):
+        data = {'postgres': {'database': [{'datid': 16384, 'datname': 'app', 'xact_commit': 1234}]},
+                'databases': [{'oid': 16384, 'name': 'app', 'postgres': {'schema': [table('big', 3000, 1)]},
+                               'queries': [{'queryid': 1, 'calls': 10, 'total_time': 5.0}]},
+                              {'oid': 16385, 'name': 'reports', 'postgres': {'schema': [table('big', 20, 5),
+                                                                                        table('tiny', 10, 6)]},
+                               'queries': [{'queryid': 1, 'calls': 7, 'total_time': 1.0}]}]}
+        lines = render(data, 1428494400, 2).splitlines()
+
+        self.assertTrue('pganalyze_table_seq_scan_total{database="app",schema="public",table="big"} 1' in lines)
+        self.assertTrue('pganalyze_table_seq_scan_total{database="reports",schema="public",table="big"} 5' in lines)
+        self.assertTrue('pganalyze_table_size_bytes{database="reports",schema="",table="__other__"} 10' in lines)
+        self.assertTrue('pganalyze_query_calls_total{database="app",queryid="1"} 10' in lines)
+        self.assertTrue('pganalyze_query_calls_total{database="reports",queryid="1"} 7' in lines)
+
+    def test_serves_rendered_snapshot(self):
+        exporter = MetricsExporter('127.0.0.1', 0, 10)
+        exporter.start()
+        url = 'http://127.0.0.1:%d' % exporter.httpd.server_address[1]
+
+        try:
+            with self.assertRaises(urllib2.HTTPError) as cm:
+                urllib2.urlopen(url + '/metrics')
+            self.assertEqual(503, cm.exception.code)
+
+            exporter.update(snapshot(), 1428494400)
+            response = urllib2.urlopen(url + '/metrics')
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+            self.assertEqual(exporter.body, response.read())
+
+            with self.assertRaises(urllib2.HTTPError) as cm:
+                urllib2.urlopen(url + '/')
+            self.assertEqual(404, cm.exception.code)
+        finally:
+            exporter.stop()
+
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import tempfile
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.Outbox import Outbox, OutboxSender
+from pgacollector import Upload
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.outbox = Outbox(os.path.join(self.directory, 'outbox'), 1024 * 1024, 3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def put(self, collected_at, data):
+        return self.outbox.put({'collected_at': collected_at}, Upload.compressed([json.dumps(data)]))
+
+    def test_entries_roundtrip_oldest_first(self):
+        now = int(time.time())
+        self.put(now, {'b': 2})
+        self.put(now - 10, {'a': 1})
+
+        names = self.outbox.entries()
+        self.assertEqual(2, len(names))
+        metadata, body = self.outbox.read(names[0])
+        self.assertEqual({'collected_at': now - 10}, metadata)
+        self.assertEqual({'a': 1}, json.loads(zlib.decompress(''.join(body))))
+
+    def test_evicts_expired_then_oldest(self):
+        now = int(time.time())
+        self.put(now - 7200, {'expired': True})
+        self.assertEqual([], self.outbox.entries())
+        self.assertEqual(1, self.outbox.take_dropped())
+        self.assertEqual(0, self.outbox.take_dropped())
+
+        self.outbox.max_bytes = 200
+        for i in range(5):
+            self.put(now + i, {'payload': 'x' * 50, 'i': i})
+        names = self.outbox.entries()
+        self.assertTrue(0 < len(names) < 5)
+        self.assertTrue(names[-1].startswith('%012d-' % (now + 4)))
+        self.assertEqual(5 - len(names), self.outbox.take_dropped())
+
+    def test_sender_backs_off_and_batches(self):
+        now = int(time.time())
+        for i in range(3):
+            self.put(now + i, {'i': i})
+
+        batches = []
+        accept = [False]
+
+        def send(names):
+            batches.append(names)
+            return accept[0]
+
+        sender = OutboxSender(self.outbox, send, batch_size=2)
+        self.assertFalse(sender.flush())
+        self.assertEqual(1, len(batches))
+        # Still backing off, nothing is sent
+        self.assertFalse(sender.flush())
+        self.assertEqual(1, len(batches))
+
+        accept[0] = True
+        sender.next_attempt = 0
+        self.assertTrue(sender.flush())
+        self.assertEqual([2, 2, 1], [len(names) for names in batches])
+        self.assertEqual([], self.outbox.entries())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.PgStatStatements import PgStatStatements
+from pgacollector.TextRegistry import TextRegistry, text_hash
+from helpers import MemoryState
+
+
+class StubDB():
+    """ pg_stat_statements 1.2 without the pganalyze helper, entries are (queryid, text) pairs """
+
+    querymarker = '/* pganalyze-collector */'
+    version_numeric = 90600
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.evicted = set()
+        self.text_fetches = []
+
+    def row(self, queryid, query):
+        return {'userid': 10, 'dbid': 16384, 'queryid': queryid, 'query': query, 'calls': queryid * 10}
+
+    def run_query(self, query, should_raise=False, commit=False, cached=False, params=None):
+        if 'showtext := false' in query:
+            return [self.row(queryid, None) for queryid, text in self.entries]
+        if 'pronargs = 1' in query:
+            return [{'enabled': 1}]
+        if 'queryid = ANY' in query:
+            queryids = sorted(int(queryid) for queryid in params[0].strip('{}').split(','))
+            self.text_fetches.append(queryids)
+            return [self.row(queryid, text) for queryid, text in self.entries
+                    if queryid in queryids and queryid not in self.evicted]
+        return []
+
+    def bulk_query(self, query, stream=False, params=None):
+        return self.run_query(query, params=params)
+
+
+class TestPgStatStatements(unittest.TestCase):
+    def test_texts_are_fetched_once_per_queryid(self):
+        state = MemoryState()
+        db = StubDB([(1, 'SELECT 1'), (2, StubDB.querymarker + 'SELECT 2'), (3, 'DEALLOCATE pdo_stmt_1')])
+
+        texts = TextRegistry(state)
+        texts.start(1000)
+        queries = PgStatStatements(db).fetch_queries(texts=texts)
+        texts.commit()
+
+        self.assertEqual([{'queryid': 1, 'calls': 10, 'query_hash': text_hash('SELECT 1')}], queries)
+        self.assertEqual([[1, 2, 3]], db.text_fetches)
+
+        # Only new entries are fetched, our own queries and DEALLOCATEs are remembered as ignored
+        db.entries += [(4, 'SELECT 4'), (5, 'SELECT 5')]
+        db.evicted.add(5)
+        texts = TextRegistry(state)
+        texts.start(1600)
+        queries = PgStatStatements(db).fetch_queries(texts=texts)
+
+        self.assertEqual([[4, 5]], db.text_fetches[1:])
+        self.assertEqual([1, 4], [row['queryid'] for row in queries])
+        self.assertEqual({text_hash('SELECT 4'): 'SELECT 4'}, texts.new_texts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'vendor'))
+import pg8000
+from pgacollector.DB import DB
+from pgacollector.Profiler import Profiler
+from pgacollector.WireRecording import ReplayServer
+from helpers import MARKER, RELATIONS, RELATION, SETTINGS, sample_recording
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.server = ReplayServer(sample_recording(marker=MARKER, binary_oids=True))
+        self.server.start()
+        self.db = DB('postgres', 'pganalyze-collector', username='test', host='127.0.0.1', port=self.server.port,
+                     exit_on_error=False)
+
+    def tearDown(self):
+        self.db.close()
+        self.server.stop()
+
+    def test_errors_only_fail_their_own_query(self):
+        # The second time around the statements are prepared already, and only executed
+        for attempt in range(2):
+            relations, missing, settings = self.db.run_queries([RELATIONS, 'SELECT 1', SETTINGS])
+
+            self.assertEqual(150, len(relations))
+            self.assertEqual((16384 + 149, u'table_149'), (relations[-1]['oid'], relations[-1]['relname']))
+            self.assertTrue(isinstance(missing, pg8000.ProgrammingError))
+            self.assertEqual([{'name': u'work_mem', 'setting': u'4096'}], settings)
+
+        self.assertTrue(self.db.conn.in_transaction)
+        self.assertEqual(1, len(self.db.run_query(SETTINGS)))
+
+    def test_prefetched_results_are_handed_out_once(self):
+        self.db.prefetch([SETTINGS, 'SELECT 1'])
+
+        self.assertEqual([SETTINGS], list(self.db.prefetched))
+        self.assertEqual(1, len(self.db.run_query(SETTINGS)))
+        self.assertEqual({}, self.db.prefetched)
+
+    def test_result_size_is_taken_from_the_wire(self):
+        self.db.profiler = Profiler()
+        self.db.profiler.start(1428494400)
+        self.db.run_queries([RELATIONS, SETTINGS])
+        self.db.run_query(SETTINGS)
+
+        recording = sample_recording(marker=MARKER, binary_oids=True)
+        rows = recording.queries[MARKER + RELATIONS]['results'][0]['rows']
+        rows += recording.queries[MARKER + SETTINGS]['results'][0]['rows'] * 2
+        stats = self.db.profiler.stats()['sections']['other']
+        self.assertEqual((3, 152), (stats['queries'], stats['rows']))
+        self.assertEqual(sum(len(row) for row in rows), stats['bytes'])
+
+    def test_parameters_keep_the_statement_text(self):
+        self.db.prefetch([(RELATION, ('{16384}',)), SETTINGS])
+        self.assertEqual(['table_0'], [row['relname'] for row in self.db.run_query(RELATION, params=['{16384}'])])
+        self.assertEqual([SETTINGS], list(self.db.prefetched))
+
+        # Other oids run the statement prepared by the pipeline
+        self.assertEqual(1, len(self.db.run_queries([(RELATION, ('{16384,16385}',))])[0]))
+        self.assertEqual(1, len(self.db.run_query(RELATION, params=['{16385}'])))
+        statements = [operation for types, operation in self.db.conn._caches[pg8000.paramstyle]['ps']]
+        self.assertEqual(1, statements.count(MARKER + RELATION))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# Needs a Postgres server to run against, configured through PGHOST, PGPORT, PGUSER, PGPASSWORD
+# and PGDATABASE. Creates and drops the table pganalyze_postgres_information_test.
+
+import unittest
+import os
+import sys
+import time
+import threading
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(1, ROOT)
+sys.path.insert(1, os.path.join(ROOT, 'vendor'))
+from pgacollector.DB import DB
+from pgacollector.PostgresInformation import PostgresInformation
+
+TABLE = 'pganalyze_postgres_information_test'
+
+
+@unittest.skipUnless(os.environ.get('PGHOST'), "PGHOST isn't set")
+class TestPostgresInformation(unittest.TestCase):
+    def setUp(self):
+        self.db = DB(os.environ.get('PGDATABASE', 'postgres'), 'pganalyze-collector', username=os.environ.get('PGUSER'),
+                     password=os.environ.get('PGPASSWORD'), host=os.environ['PGHOST'], port=os.environ.get('PGPORT'),
+                     exit_on_error=False)
+        self.db.run_query("DROP TABLE IF EXISTS %s" % TABLE, commit=True)
+        self.db.run_query("CREATE TABLE %s (id int)" % TABLE, commit=True)
+
+    def tearDown(self):
+        self.db.rollback()
+        self.db.run_query("DROP TABLE %s" % TABLE, commit=True)
+        self.db.close()
+
+    def test_waits_starting_after_the_transaction_are_not_negative(self):
+        holder = self.db.clone()
+        waiter = self.db.clone()
+        holder.run_query("LOCK TABLE %s IN ACCESS EXCLUSIVE MODE" % TABLE)
+
+        # Our transaction, and with it now(), starts before the wait
+        self.db.rollback()
+        self.db.run_query("SELECT 1 AS one")
+        time.sleep(0.5)
+
+        thread = threading.Thread(target=waiter.run_query, args=("SELECT * FROM %s" % TABLE,))
+        thread.start()
+        try:
+            for i in range(100):
+                if holder.run_query("SELECT 1 AS one FROM pg_locks WHERE relation = '%s'::regclass AND NOT granted"
+                                    % TABLE):
+                    break
+                time.sleep(0.1)
+
+            waiting = [row for row in PostgresInformation(self.db).contended_locks() if not row['granted']]
+            self.assertEqual(1, len(waiting))
+            self.assertTrue(waiting[0]['wait_seconds'] >= 0)
+        finally:
+            holder.rollback()
+            thread.join()
+            waiter.rollback()
+            holder.close()
+            waiter.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.Profiler import Profiler
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profiler = Profiler()
+        self.profiler.start(1428494400)
+
+    def test_queries_are_attributed_to_the_active_section(self):
+        def worker():
+            with self.profiler.section('postgres.columns'):
+                self.profiler.record_query(0.5, [(1, 'abc'), (2, None)], 27)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        with self.profiler.section('postgres.settings'):
+            self.profiler.record_query(0.25, [('work_mem', '4MB')])
+        thread.join()
+        self.profiler.record_query(0.1, [])
+
+        sections = self.profiler.stats()['sections']
+        columns = sections['postgres.columns']
+        self.assertEqual((1, 2, 27, 0.5), (columns['queries'], columns['rows'], columns['bytes'], columns['server_time']))
+        self.assertEqual(1, sections['postgres.settings']['rows'])
+        self.assertEqual(1, sections['other']['queries'])
+
+    def test_result_size_is_estimated_only_when_profiling(self):
+        self.profiler.record_query(0.1, [(1, 'abc'), (2, None)])
+        self.assertEqual(0, self.profiler.stats()['sections']['other']['bytes'])
+
+        profiler = Profiler(profile_dir='profiles')
+        profiler.start(1428494400)
+        profiler.record_query(0.1, [(1, 'abc'), (2, None)])
+        self.assertEqual(27, profiler.stats()['sections']['other']['bytes'])
+
+    def test_streamed_sections(self):
+        def rows():
+            for i in range(3):
+                self.profiler.record_query(0.1, [(i,)])
+                yield i
+
+        self.assertEqual([0, 1, 2], list(self.profiler.iter_section('postgres.indexes', rows())))
+        self.assertEqual(3, self.profiler.stats()['sections']['postgres.indexes']['rows'])
+
+    def test_phases_exclude_nested_phases(self):
+        def chunks():
+            for i in range(2):
+                time.sleep(0.05)
+                yield 'x'
+
+        with self.profiler.phase('upload'):
+            list(self.profiler.iter_phase('encode', chunks()))
+
+        phases = self.profiler.stats()['phases']
+        self.assertTrue(phases['encode'] >= 0.1)
+        self.assertTrue(phases['upload'] < 0.05)
+
+    def test_upload_timings_are_sent_with_next_snapshot(self):
+        with self.profiler.phase('upload'):
+            pass
+        self.assertFalse('previous_upload' in self.profiler.stats())
+
+        self.profiler.start(1428495000)
+        self.assertEqual(['upload'], self.profiler.stats()['previous_upload'].keys())
+        self.assertEqual({}, self.profiler.stats()['phases'])
+
+
+if __name__ == '__main__': unittest.main()
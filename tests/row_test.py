@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import json
+import collections
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'vendor'))
+from pgacollector.DB import ResultColumns, Row
+
+
+class TestRow(unittest.TestCase):
+    def setUp(self):
+        self.columns = ResultColumns(('oid', 'relid', 'name', 'relid'))
+
+    def test_behaves_like_dict(self):
+        row = Row(self.columns, (16384, 1, 'users', 2))
+
+        self.assertEqual({'oid': 16384, 'relid': 2, 'name': 'users'}, row)
+        self.assertEqual([{'oid': 16384, 'relid': 2, 'name': 'users'}], [row])
+        self.assertEqual('users', row['name'])
+        self.assertEqual(None, row.get('missing'))
+        self.assertEqual(3, len(row))
+        self.assertTrue(isinstance(row, collections.Mapping))
+        self.assertEqual(set(['oid', 'relid', 'name']), set(row.keys()))
+
+    def test_pop_delete_and_extra_keys(self):
+        row = Row(self.columns, (16384, 1, 'users', 2))
+
+        self.assertEqual(16384, row.pop('oid'))
+        self.assertRaises(KeyError, lambda: row['oid'])
+        self.assertEqual('gone', row.pop('oid', 'gone'))
+        del row['relid']
+        row['wasted_bytes'] = 8192
+        row['current_value'] = row.pop('name')
+
+        self.assertEqual({'wasted_bytes': 8192, 'current_value': 'users'}, dict(row.iteritems()))
+        self.assertFalse('name' in row)
+
+    def test_rows_share_columns(self):
+        first, second = Row(self.columns, [1, 2, 'a', 3]), Row(self.columns, [4, 5, 'b', 6])
+        first['name'] = 'changed'
+
+        self.assertEqual('b', second['name'])
+        self.assertEqual({'oid': 1, 'relid': 3, 'name': 'changed'}, json.loads(json.dumps(dict(first))))
+
+
+if __name__ == '__main__': unittest.main()
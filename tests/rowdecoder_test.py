@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import struct
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'vendor'))
+from pg8000 import core
+from pgacollector.RowDecoder import compile_row_decoder, numeric_float_in, uint4_recv
+from pgacollector.WireRecording import join_data_row
+
+
+def text_recv(data, offset, length):
+    return unicode(data[offset:offset + length], 'utf-8')
+
+
+# oid, name, int8, bool, numeric, float8
+ROW_DESC = [
+    {'type_oid': 26, 'pg8000_fc': core.FC_BINARY, 'func': uint4_recv},
+    {'type_oid': 19, 'pg8000_fc': core.FC_BINARY, 'func': text_recv},
+    {'type_oid': 20, 'pg8000_fc': core.FC_BINARY, 'func': core.int8_recv},
+    {'type_oid': 16, 'pg8000_fc': core.FC_BINARY, 'func': lambda d, o, l: d[o] == '\x01'},
+    {'type_oid': 1700, 'pg8000_fc': core.FC_TEXT, 'func': numeric_float_in},
+    {'type_oid': 701, 'pg8000_fc': core.FC_BINARY, 'func': core.float8_recv},
+]
+
+
+class TestRowDecoder(unittest.TestCase):
+    def setUp(self):
+        self.decode = compile_row_decoder(ROW_DESC, [f['func'] for f in ROW_DESC])
+
+    def test_decodes_fixed_and_variable_columns(self):
+        data = join_data_row([struct.pack('!I', 3000000000), 'users', struct.pack('!q', -5), '\x01', 'NaN',
+                              struct.pack('!d', 1.5)])
+        row = self.decode(data)
+
+        self.assertEqual([3000000000, u'users', -5, True], row[:4])
+        # NaN
+        self.assertTrue(row[4] != row[4])
+        self.assertEqual(1.5, row[5])
+
+    def test_nulls_fall_back_to_decoding_field_by_field(self):
+        data = join_data_row([struct.pack('!I', 16384), None, None, '\x00', '12.50', None])
+
+        self.assertEqual([16384, None, None, False, 12.5, None], self.decode(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import time
+import signal
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.Scheduler import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    def test_runs_are_aligned_to_the_interval(self):
+        scheduler = Scheduler(60)
+        self.assertEqual(180, scheduler.next_run_after(120))
+        self.assertEqual(180, scheduler.next_run_after(125.5))
+        self.assertEqual(240, scheduler.next_run_after(180.0))
+
+    def test_run_forever(self):
+        scheduler = Scheduler(1)
+        runs = []
+
+        def job():
+            runs.append(time.time())
+            if len(runs) == 2:
+                scheduler.stop()
+
+        scheduler.run_forever(job)
+
+        # The second run starts at the next full second, not one interval after the first
+        self.assertEqual(2, len(runs))
+        self.assertTrue(runs[1] - scheduler.next_run_after(runs[0]) < 0.5)
+        self.assertTrue(runs[1] >= scheduler.next_run_after(runs[0]))
+
+    def test_overlapped_slots_are_skipped(self):
+        scheduler = Scheduler(1)
+        runs = []
+
+        def job():
+            runs.append(time.time())
+            if len(runs) == 1:
+                time.sleep(1.5)
+            else:
+                scheduler.stop()
+
+        scheduler.run_forever(job)
+
+        # The slot at the next full second passed while the first run was still going
+        self.assertEqual(2, len(runs))
+        self.assertTrue(runs[1] >= int(runs[0]) + 2)
+        self.assertTrue(runs[1] - runs[0] < 3)
+
+    def test_signals_stop_the_scheduler(self):
+        handlers = dict((signum, signal.getsignal(signum)) for signum in (signal.SIGTERM, signal.SIGINT))
+        scheduler = Scheduler(3600)
+        runs = []
+
+        def job():
+            runs.append(time.time())
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        try:
+            scheduler.install_signal_handlers()
+            started = time.time()
+            scheduler.run_forever(job)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        # The run in progress is finished, no further runs happen
+        self.assertEqual(1, len(runs))
+        self.assertTrue(time.time() - started < 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
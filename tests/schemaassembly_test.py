@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'vendor'))
+from pgacollector.DB import ResultColumns, Row
+from pgacollector.SchemaAssembly import assemble_schema
+
+
+def rows(names, *values):
+    columns = ResultColumns(names)
+    return [Row(columns, list(v)) for v in values]
+
+
+def relations(*oids):
+    return rows(('oid', 'schema_name', 'table_name', 'size_bytes', 'relation_type', 'relid', 'relname',
+                 'schemaname', 'seq_scan'),
+                *[(oid, 'public', 't%d' % oid, oid * 8192, 'r', oid, 't%d' % oid, 'public', oid) for oid in oids])
+
+
+class TestAssembleSchema(unittest.TestCase):
+    def test_merges_sorted_results(self):
+        columns = rows(('oid', 'name', 'position'), (1, 'id', 1), (1, 'name', 2), (3, 'id', 1))
+        indexes = rows(('oid', 'index_oid', 'name'), (0, 9, 'orphan'), (3, 10, 't3_pkey'))
+        constraints = rows(('oid', 'name'), (1, 't1_fkey'), (2, 'temp_fkey'))
+
+        schema = list(assemble_schema(relations(1, 3), columns, iter(indexes), constraints,
+                                      table_bloat={1: 4096}, index_bloat={10: 8192}))
+
+        self.assertEqual([{
+            'schema_name': 'public', 'table_name': 't1', 'relation_type': 'r',
+            'stats': {'size_bytes': 8192, 'seq_scan': 1, 'wasted_bytes': 4096},
+            'columns': [{'name': 'id', 'position': 1}, {'name': 'name', 'position': 2}],
+            'indices': [],
+            'constraints': [{'name': 't1_fkey'}],
+        }, {
+            'schema_name': 'public', 'table_name': 't3', 'relation_type': 'r',
+            'stats': {'size_bytes': 3 * 8192, 'seq_scan': 3, 'wasted_bytes': None},
+            'columns': [{'name': 'id', 'position': 1}],
+            'indices': [{'name': 't3_pkey', 'wasted_bytes': 8192}],
+            'constraints': [],
+        }], schema)
+
+    def test_unchanged_relations_get_index_stats(self):
+        indexes = rows(('oid', 'index_oid', 'name', 'columns'), (2, 20, 't2_pkey', [1]))
+        index_stats = rows(('oid', 'index_oid', 'name', 'idx_scan'), (1, 10, 't1_pkey', 5), (2, 20, 't2_pkey', 7))
+        views = rows(('oid', 'view_definition'), (2, 'SELECT 1'))
+
+        schema = list(assemble_schema(relations(1, 2), [], indexes, [], index_stats, views,
+                                      unchanged_since=lambda oid: 1000 if oid == 1 else None))
+
+        self.assertEqual(1000, schema[0]['unchanged_since'])
+        self.assertFalse('columns' in schema[0])
+        self.assertEqual([{'name': 't1_pkey', 'idx_scan': 5, 'wasted_bytes': None}], schema[0]['indices'])
+        self.assertEqual([{'name': 't2_pkey', 'columns': [1], 'wasted_bytes': None}], schema[1]['indices'])
+        self.assertEqual('SELECT 1', schema[1]['view_definition'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# Needs a Postgres 9.4+ server to run against, configured through PGHOST, PGPORT, PGUSER,
+# PGPASSWORD and PGDATABASE. Creates and drops the table pganalyze_schema_engine_test.
+
+import unittest
+import os
+import sys
+import imp
+import json
+import time
+import logging
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(1, ROOT)
+sys.path.insert(1, os.path.join(ROOT, 'vendor'))
+from pgacollector.DB import DB
+from pgacollector.Upload import RawJSON
+
+TABLE = 'pganalyze_schema_engine_test'
+
+
+def load_collector():
+    path = os.path.join(ROOT, 'pganalyze-collector.py')
+    collector = imp.load_source('pganalyze_collector', path)
+    sys.argv = [path]
+    collector.option = collector.parse_options()
+    collector.logger = logging.getLogger('pganalyze-collector')
+    return collector
+
+
+@unittest.skipUnless(os.environ.get('PGHOST'), "PGHOST isn't set")
+class TestSchemaEngine(unittest.TestCase):
+    def setUp(self):
+        self.collector = load_collector()
+        self.db = DB(os.environ.get('PGDATABASE', 'postgres'), 'pganalyze-collector', username=os.environ.get('PGUSER'),
+                     password=os.environ.get('PGPASSWORD'), host=os.environ['PGHOST'], port=os.environ.get('PGPORT'),
+                     exit_on_error=False)
+        self.db.run_query("DROP TABLE IF EXISTS %s" % TABLE, commit=True)
+        self.db.run_query("CREATE TABLE %s (id serial PRIMARY KEY, name text NOT NULL)" % TABLE, commit=True)
+        self.db.run_query("INSERT INTO %s (name) SELECT 'row ' || i FROM generate_series(1, 100) i" % TABLE,
+                          commit=True)
+        self.db.run_query("ANALYZE %s" % TABLE, commit=True)
+
+        # The statistics collector takes a moment to pick up the ANALYZE
+        for i in range(100):
+            self.db.rollback()
+            rows = self.db.run_query("SELECT last_analyze FROM pg_stat_user_tables WHERE relname = '%s'" % TABLE)
+            if rows[0]['last_analyze']:
+                break
+            time.sleep(0.1)
+
+    def tearDown(self):
+        self.db.rollback()
+        self.db.run_query("DROP TABLE %s" % TABLE, commit=True)
+        self.db.close()
+
+    def record(self, engine):
+        self.collector.option['schema_engine'] = engine
+        info = self.collector.fetch_postgres_information(self.db)
+        for record in info['schema']:
+            if isinstance(record, RawJSON):
+                record = record.load()
+            else:
+                record = json.loads(json.dumps(record, cls=self.collector.DatetimeEncoder))
+            if record['table_name'] == TABLE:
+                return record
+
+    def test_statistics_match(self):
+        if self.db.version_numeric < 90400:
+            self.skipTest("--schema-engine server needs 9.4+")
+
+        # Both in the same transaction, so they see the same statistics
+        self.db.rollback()
+        client = self.record('client')
+        server = self.record('server')
+
+        self.assertNotEqual(None, client['stats']['last_analyze'])
+        self.assertEqual(client['stats'], server['stats'])
+
+
+if __name__ == '__main__':
+    unittest.main()
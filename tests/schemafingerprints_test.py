@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.SchemaFingerprints import SchemaFingerprints, FULL_SCHEMA_INTERVAL
+from pgacollector.State import State
+
+
+class TestSchemaFingerprints(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.state = State(os.path.join(self.directory, 'state'), 'db.example.com_5432_app')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_only_changed_relations_are_sent(self):
+        fingerprints = SchemaFingerprints(self.state)
+        self.assertEqual(None, fingerprints.changed_oids({1: 'a', 2: 'b'}, 1000))
+        self.assertEqual(None, fingerprints.unchanged_since(1))
+        fingerprints.commit()
+
+        fingerprints = SchemaFingerprints(self.state)
+        self.assertEqual(set([2, 3]), fingerprints.changed_oids({1: 'a', 2: 'changed', 3: 'new'}, 1600))
+        self.assertEqual(1000, fingerprints.unchanged_since(1))
+        self.assertEqual(None, fingerprints.unchanged_since(2))
+        self.assertTrue(fingerprints.fingerprinted(3))
+        self.assertFalse(fingerprints.fingerprinted(4))
+        fingerprints.commit()
+
+        fingerprints = SchemaFingerprints(self.state)
+        self.assertEqual(set(), fingerprints.changed_oids({1: 'a', 2: 'changed', 3: 'new'}, 2200))
+        self.assertEqual(1600, fingerprints.unchanged_since(3))
+
+        # Everything is sent again once a day
+        fingerprints = SchemaFingerprints(self.state)
+        self.assertEqual(None, fingerprints.changed_oids({1: 'a', 2: 'changed', 3: 'new'}, 1000 + FULL_SCHEMA_INTERVAL))
+
+    def test_nothing_is_kept_without_commit(self):
+        fingerprints = SchemaFingerprints(self.state)
+        fingerprints.changed_oids({1: 'a'}, 1000)
+
+        # The upload failed
+        fingerprints = SchemaFingerprints(self.state)
+        self.assertEqual(None, fingerprints.changed_oids({1: 'a'}, 1600))
+        fingerprints.commit()
+
+        fingerprints = SchemaFingerprints(self.state)
+        self.assertEqual(set(), fingerprints.changed_oids({1: 'a'}, 2200))
+        fingerprints.forget()
+        self.assertEqual(None, SchemaFingerprints(self.state).changed_oids({1: 'a'}, 2800))
+
+
+class TestState(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_components_are_persisted_per_server(self):
+        state = State(os.path.join(self.directory, 'state'), State.server_key_for(
+            {'host': None, 'port': None, 'dbname': 'app/1'}))
+        self.assertEqual({}, state.load('schema_fingerprints'))
+
+        state.save('schema_fingerprints', {'last_full': 1000})
+        self.assertEqual({'last_full': 1000}, state.load('schema_fingerprints'))
+        self.assertEqual(['local_5432_app_1.schema_fingerprints.json'],
+                         os.listdir(os.path.join(self.directory, 'state')))
+
+        other = State(os.path.join(self.directory, 'state'), State.server_key_for(
+            {'host': 'db.example.com', 'port': 5433, 'dbname': 'app'}))
+        self.assertEqual({}, other.load('schema_fingerprints'))
+
+    def test_corrupt_files_are_ignored(self):
+        state = State(self.directory, 'local_5432_app')
+        with open(state.path('text_registry'), 'w') as f:
+            f.write('{"texts": {')
+
+        self.assertEqual({}, state.load('text_registry'))
+
+
+if __name__ == '__main__':
+    unittest.main()
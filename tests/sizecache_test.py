@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.SizeCache import SizeCache
+from helpers import MemoryState, StubInformation
+
+
+def relations(inserts=None):
+    inserts = inserts or {}
+    return [{'oid': oid, 'size_bytes': oid * 8192, 'n_tup_ins': inserts.get(oid, 0), 'n_tup_upd': 0,
+             'n_tup_del': 0} for oid in range(1, 13)]
+
+
+class TestSizeCache(unittest.TestCase):
+    def test_only_written_tables_are_measured(self):
+        state = MemoryState()
+        PI = StubInformation()
+
+        # 600 / 3600 of 12 tables are measured per run, the others are estimated until their turn
+        rows = relations()
+        SizeCache(state, 3600, 600).apply(PI, rows, 0)
+        self.assertEqual([1, 2], PI.requested[-1])
+        self.assertEqual([(16384, False), (32768, False), (24576, True)],
+                         [(row['size_bytes'], row['size_estimated']) for row in rows[:3]])
+
+        for run in range(1, 6):
+            SizeCache(state, 3600, 600).apply(PI, relations(), run * 600)
+        self.assertEqual(6, len(PI.requested))
+
+        # Writes are measured right away, unchanged tables keep their size until it expires
+        rows = relations({5: 1})
+        SizeCache(state, 3600, 600).apply(PI, rows, 3000)
+        self.assertEqual([5], PI.requested[-1])
+        self.assertEqual([False] * 12, [row['size_estimated'] for row in rows])
+        self.assertEqual([oid * 16384 for oid in range(1, 13)], [row['size_bytes'] for row in rows])
+
+        rows = relations({5: 1})
+        SizeCache(state, 3600, 600).apply(PI, rows, 3600)
+        self.assertEqual([1, 2], PI.requested[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
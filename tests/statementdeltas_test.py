@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.StatementDeltas import StatementDeltas
+from helpers import MemoryState
+
+
+def entry(queryid, calls, total_time, max_time=1.0):
+    return {'userid': 10, 'dbid': 1, 'queryid': queryid, 'query': 'SELECT %d' % queryid,
+            'calls': calls, 'total_time': total_time, 'max_time': max_time}
+
+
+class TestStatementDeltas(unittest.TestCase):
+    def setUp(self):
+        self.state = MemoryState()
+
+    def run_interval(self, rows, collected_at):
+        deltas = StatementDeltas(self.state)
+        result = deltas.apply(rows, collected_at)
+        deltas.commit()
+        return result, deltas.summary
+
+    def test_first_run_establishes_baseline(self):
+        result, summary = self.run_interval([entry(1, 5, 10.0)], 600)
+
+        self.assertEqual([], result)
+        self.assertEqual(None, summary['interval_start'])
+
+    def test_idle_entries_are_dropped(self):
+        self.run_interval([entry(1, 5, 10.0), entry(2, 3, 1.0)], 600)
+        result, summary = self.run_interval([entry(1, 7, 12.5, 4.0), entry(2, 3, 1.0)], 1200)
+
+        self.assertEqual(1, len(result))
+        self.assertEqual(2, result[0]['calls'])
+        self.assertEqual(2.5, result[0]['total_time'])
+        self.assertEqual(4.0, result[0]['max_time'])
+        self.assertEqual(600, summary['interval_start'])
+
+    def test_new_and_evicted_entries(self):
+        self.run_interval([entry(1, 5, 10.0), entry(2, 3, 1.0)], 600)
+        result, summary = self.run_interval([entry(1, 6, 11.0), entry(3, 2, 2.0)], 1200)
+
+        self.assertEqual([1, 2], sorted(row['calls'] for row in result))
+        self.assertEqual(1, summary['evicted_entries'])
+        self.assertFalse(summary['reset_detected'])
+
+    def test_reset_is_detected(self):
+        self.run_interval([entry(1, 5, 10.0), entry(2, 3, 1.0)], 600)
+        result, summary = self.run_interval([entry(1, 1, 0.5)], 1200)
+
+        self.assertTrue(summary['reset_detected'])
+        self.assertEqual(1, result[0]['calls'])
+
+    def test_failed_upload_keeps_previous_baseline(self):
+        self.run_interval([entry(1, 5, 10.0)], 600)
+        StatementDeltas(self.state).apply([entry(1, 7, 12.0)], 1200)
+        result, summary = self.run_interval([entry(1, 8, 13.0)], 1800)
+
+        self.assertEqual(3, result[0]['calls'])
+        self.assertEqual(600, summary['interval_start'])
+
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.TextRegistry import TextRegistry, text_hash, TEXT_RETENTION
+from helpers import MemoryState
+
+
+class TestTextRegistry(unittest.TestCase):
+    def test_known_hashes_by_kind(self):
+        state = MemoryState()
+        registry = TextRegistry(state)
+        registry.start(1000)
+        registry.add('SELECT 1', '1:1:1')
+        registry.add('BEGIN RETURN 1; END', kind='source')
+        registry.add('SELECT * FROM t', kind='view_definition')
+        registry.commit()
+
+        registry = TextRegistry(state)
+        self.assertEqual([text_hash('BEGIN RETURN 1; END')], registry.known_hashes('source'))
+        self.assertEqual([text_hash('SELECT * FROM t')], registry.known_hashes('view_definition'))
+        self.assertEqual([text_hash('SELECT 1')], registry.known_hashes('query'))
+
+    def test_unreferenced_texts_expire(self):
+        state = MemoryState()
+        registry = TextRegistry(state)
+        registry.start(1000)
+        old = registry.add('SELECT 1', '1:1:1')
+        kept = registry.add('SELECT 2', '1:1:2')
+        registry.ignore('1:1:3')
+        registry.commit()
+        self.assertEqual({}, registry.new_texts)
+
+        # Referencing a text keeps it, and the queryid it belongs to
+        registry = TextRegistry(state)
+        registry.start(1000 + TEXT_RETENTION)
+        self.assertEqual(kept, registry.hash_for_queryid('1:1:2'))
+        registry.reference(kept, '1:1:2')
+        self.assertEqual(kept, registry.add('SELECT 2'))
+        self.assertEqual({}, registry.new_texts)
+        registry.commit()
+
+        registry = TextRegistry(state)
+        registry.start(1001 + TEXT_RETENTION)
+        registry.commit()
+
+        self.assertEqual({kept: [1000, 1000 + TEXT_RETENTION, 'query']}, state.components['text_registry']['texts'])
+        self.assertEqual(None, registry.hash_for_queryid('1:1:1'))
+        self.assertFalse(registry.is_ignored('1:1:3'))
+
+        registry.start(1002 + TEXT_RETENTION)
+        self.assertEqual(old, registry.add('SELECT 1'))
+        self.assertEqual({old: 'SELECT 1'}, registry.new_texts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'vendor'))
+import pg8000
+from pgacollector.WireRecording import Recording, ReplayServer, WireRecorder
+from helpers import RELATIONS, column, sample_recording
+
+
+class TestWireRecording(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = ReplayServer(sample_recording(150), scale=2)
+        self.server.start()
+        self.conn = pg8000.connect(user='test', host='127.0.0.1', port=self.server.port)
+
+    def tearDown(self):
+        self.conn.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def query(self, query):
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        return cursor.fetchall()
+
+    def test_replay_scales_relations(self):
+        # More rows than pg8000 fetches at once, so the portal gets suspended in between
+        rows = self.query(RELATIONS)
+
+        self.assertEqual(300, len(rows))
+        self.assertEqual([16384, u'table_0', u'public', u'0'], list(rows[0]))
+        self.assertEqual([16384 + 16384 + 150, u'table_0_1', u'public', u'0'], list(rows[150]))
+        self.assertEqual(300, len(set(row[0] for row in rows)))
+
+    def test_unknown_queries_fail(self):
+        self.assertRaises(pg8000.ProgrammingError, self.query, 'SELECT 1')
+        self.conn.rollback()
+        self.assertEqual(300, len(self.query(RELATIONS)))
+
+    def test_recording_roundtrip(self):
+        recorder = WireRecorder()
+        recorder.attach(self.conn)
+        rows = self.query(RELATIONS)
+
+        path = os.path.join(self.directory, 'recording.json')
+        recorder.save(path)
+        recording = Recording.load(path)
+
+        self.assertEqual([column('oid', 26, 0), column('relname', 19, 1), column('schema_name', 19, 1),
+                          column('reltuples', 25, 1)], recording.queries[RELATIONS]['columns'])
+        result = recording.queries[RELATIONS]['results'][0]
+        self.assertEqual('SELECT 300', result['tag'])
+        self.assertEqual(len(rows), len(result['rows']))
+        self.assertEqual(16384 + 16384 + 150 + 149, recording.max_oid())
+
+
+if __name__ == '__main__':
+    unittest.main()
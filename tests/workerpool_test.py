@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+from pgacollector.WorkerPool import WorkerPool
+
+
+class StubDB():
+    """ Answers the queries WorkerPool runs itself, and remembers them """
+
+    def __init__(self, max_connections=100, free_connections=50, can_export=True):
+        self.max_connections = max_connections
+        self.free_connections = free_connections
+        self.can_export = can_export
+        self.queries = []
+        self.clones = []
+        self.closed = False
+
+    def run_query(self, query, should_raise=False, commit=False, cached=False):
+        self.queries.append(' '.join(query.split()))
+        if 'max_connections' in query:
+            return [{'max_connections': self.max_connections, 'free_connections': self.free_connections}]
+        if 'pg_export_snapshot' in query:
+            if not self.can_export:
+                raise Exception("cannot export a snapshot from a subtransaction")
+            return [{'snapshot_id': '00000003-0000001B-1'}]
+        return []
+
+    def clone(self):
+        db = StubDB()
+        self.clones.append(db)
+        return db
+
+    def ensure_connected(self):
+        pass
+
+    def rollback(self):
+        self.queries.append('ROLLBACK')
+
+    def close(self):
+        self.closed = True
+
+
+def sections(names):
+    def section(name):
+        def fn(PI):
+            PI.db.queries.append(name)
+            # Generators stand in for streamed results
+            return (i for i in range(3))
+        return fn
+    return [(name, section(name)) for name in names]
+
+
+class TestWorkerPool(unittest.TestCase):
+    def test_connection_budget(self):
+        # 10% of max_connections, the free slots (plus the main connection) and the configured size
+        self.assertEqual(4, WorkerPool(StubDB(100, 50), 4).connection_budget())
+        self.assertEqual(2, WorkerPool(StubDB(20, 50), 4).connection_budget())
+        self.assertEqual(3, WorkerPool(StubDB(100, 2), 4).connection_budget())
+        self.assertEqual(1, WorkerPool(StubDB(100, -5), 4).connection_budget())
+        self.assertEqual(1, WorkerPool(StubDB(5, 50), 4).connection_budget())
+
+    def test_workers_import_the_exported_snapshot(self):
+        db = StubDB()
+        pool = WorkerPool(db, 3)
+        names = ['columns', 'indexes', 'relations', 'constraints', 'functions', 'settings']
+        results = pool.run(sections(names))
+
+        self.assertEqual(dict((name, [0, 1, 2]) for name in names), results)
+        self.assertEqual(2, len(db.clones))
+        self.assertTrue('SELECT pg_export_snapshot() AS snapshot_id' in db.queries)
+        for worker in db.clones:
+            self.assertEqual(["ROLLBACK", "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ",
+                              "SET TRANSACTION SNAPSHOT '00000003-0000001B-1'"], worker.queries[:3])
+            self.assertEqual('ROLLBACK', worker.queries[-1])
+        self.assertEqual(sorted(names), sorted(query for query in db.queries + db.clones[0].queries +
+                                               db.clones[1].queries if query in names))
+
+        # Worker connections are kept for the next run
+        pool.run(sections(names))
+        self.assertEqual(2, len(db.clones))
+        pool.close()
+        self.assertTrue(all(worker.closed for worker in db.clones))
+
+    def test_sequential_without_snapshot(self):
+        db = StubDB(can_export=False)
+        results = WorkerPool(db, 3).run(sections(['columns', 'indexes']))
+
+        self.assertEqual([], db.clones)
+        self.assertEqual(['columns', 'indexes'], db.queries[-2:])
+        self.assertTrue(hasattr(results['columns'], 'next'))
+
+    def test_errors_close_the_workers(self):
+        def failing(PI):
+            raise Exception("canceling statement due to statement timeout")
+
+        db = StubDB()
+        pool = WorkerPool(db, 3)
+        self.assertRaises(Exception, pool.run, [('columns', failing)] + sections(['indexes']))
+        self.assertEqual([], pool.workers)
+        self.assertTrue(all(worker.closed for worker in db.clones))
+
+
+if __name__ == '__main__':
+    unittest.main()